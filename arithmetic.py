@@ -0,0 +1,63 @@
+"""
+Arithmetic with a number known at compile time, for the specialized handlers of Compiler.mul,
+div and mod. A multiplication by a number is a chain of left shifts of the product, each followed
+by an addition or a subtraction of the multiplicand for a nonzero digit of the multiplier, from
+its most significant digit on (Horner's scheme). The digits are the binary ones or the
+non-adjacent form, with -1 digits, whichever chain costs less on the machine.
+"""
+from machine_instructions import COSTS, ADD, SHL
+
+# the loop of Compiler.mul runs over the bits of a variable below it without comparing the
+# operands first: the comparison costs more than the few extra rounds the loop may make
+DRIVER_BOUND = 1 << 8
+
+
+def power_of_two(value):
+    """
+    :return: k if value is 2^k, None otherwise
+    """
+    if value > 0 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+
+def binary_digits(value):
+    """
+    :return: list of binary digits of a positive value, the most significant first
+    """
+    return [int(bit) for bit in bin(value)[2:]]
+
+
+def naf_digits(value):
+    """
+    :return: list of digits 1, 0, -1 of the non-adjacent form of a positive value, the most
+             significant first; no two nonzero digits are next to each other
+    """
+    digits = []
+    while value:
+        if value & 1:
+            digit = 2 - (value & 3)  # 1 for ...01, -1 for ...11
+            value -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        value >>= 1
+    return digits[::-1]
+
+
+def chain_cost(digits):
+    """
+    :return: cost of the chain of the digits, without the copy of the multiplicand
+    """
+    nonzero = sum(1 for digit in digits if digit)
+    return (len(digits) - 1) * COSTS[SHL] + (nonzero - 1) * COSTS[ADD]
+
+
+def multiplier_digits(value):
+    """
+    :param value: positive multiplier
+    :return: the cheaper of its binary and non-adjacent digits
+    """
+    binary, naf = binary_digits(value), naf_digits(value)
+    return naf if chain_cost(naf) < chain_cost(binary) else binary
+
@@ -0,0 +1,275 @@
+"""
+AST built by _Parser, annotated by SemanticAnalyzer and consumed by Compiler. Every node has an
+integer kind tag and its source span: line number plus start and end offset in the source text.
+"""
+
+# values
+NUM = 0
+INT = 1
+TAB = 2
+# arithmetic
+ADD = 3
+SUB = 4
+MUL = 5
+DIV = 6
+MOD = 7
+# conditions
+EQ = 8
+NEQ = 9
+LT = 10
+GT = 11
+LEQ = 12
+GEQ = 13
+# commands
+ASSIGN = 14
+IF = 15
+IF_ELSE = 16
+WHILE = 17
+REPEAT = 18
+FOR_TO = 19
+FOR_DT = 20
+READ = 21
+WRITE = 22
+# program structure
+PROGRAM = 23
+INT_DECLARATION = 24
+TAB_DECLARATION = 25
+
+ARITHMETIC = {"+": ADD, "-": SUB, "*": MUL, "/": DIV, "%": MOD}
+RELATIONS = {"=": EQ, "!=": NEQ, "<": LT, ">": GT, "<=": LEQ, ">=": GEQ}
+SYMBOLS = {kind: symbol for symbol, kind in list(ARITHMETIC.items()) + list(RELATIONS.items())}
+VARIABLES = (INT, TAB)
+
+
+class Node(object):
+    __slots__ = ('lineno', 'index', 'end')
+    kind = None
+
+    def __init__(self, lineno, index, end):
+        self.lineno = lineno
+        self.index = index
+        self.end = end
+
+
+class Num(Node):
+    __slots__ = ('value',)
+    kind = NUM
+
+    def __init__(self, value, lineno, index, end):
+        self.value = value
+        super().__init__(lineno, index, end)
+
+    def key(self):
+        """
+        Hashable description of the value, equal for equal values, whatever their position.
+        """
+        return NUM, self.value
+
+
+class Identifier(Node):
+    """
+    int variable or iterator, var is its Int set by SemanticAnalyzer
+    """
+    __slots__ = ('name', 'var')
+    kind = INT
+
+    def __init__(self, name, lineno, index, end):
+        self.name = name
+        self.var = None
+        super().__init__(lineno, index, end)
+
+    def key(self):
+        return INT, self.name
+
+
+class TabElement(Node):
+    """
+    tab(index), index is Num or Identifier, var is the Tab set by SemanticAnalyzer
+    """
+    __slots__ = ('name', 'index_value', 'var')
+    kind = TAB
+
+    def __init__(self, name, index_value, lineno, index, end):
+        self.name = name
+        self.index_value = index_value
+        self.var = None
+        super().__init__(lineno, index, end)
+
+    def key(self):
+        return TAB, self.name, self.index_value.key()
+
+
+class BinaryOperation(Node):
+    """
+    left op right, kind is one of ADD, SUB, MUL, DIV, MOD (expressions) or EQ, NEQ, LT, GT, LEQ,
+    GEQ (conditions)
+    """
+    __slots__ = ('kind', 'left', 'right')
+    other_result = None  # see FusedDivision
+
+    def __init__(self, kind, left, right, lineno, index, end):
+        self.kind = kind
+        self.left = left
+        self.right = right
+        super().__init__(lineno, index, end)
+
+    def key(self):
+        return self.kind, self.left.key(), self.right.key()
+
+
+class FusedDivision(BinaryOperation):
+    """
+    left / right or left % right which also stores the other one of the quotient and the
+    remainder to the cell of other_result, an Int made by VariableManager.new_temporary
+    """
+    __slots__ = ('other_result',)
+
+    def __init__(self, kind, left, right, other_result, lineno, index, end):
+        self.other_result = other_result
+        super().__init__(kind, left, right, lineno, index, end)
+
+
+class Assign(Node):
+    __slots__ = ('lvalue', 'rvalue')
+    kind = ASSIGN
+
+    def __init__(self, lvalue, rvalue, lineno, index, end):
+        self.lvalue = lvalue
+        self.rvalue = rvalue
+        super().__init__(lineno, index, end)
+
+
+class If(Node):
+    __slots__ = ('condition', 'commands')
+    kind = IF
+
+    def __init__(self, condition, commands, lineno, index, end):
+        self.condition = condition
+        self.commands = commands
+        super().__init__(lineno, index, end)
+
+
+class IfElse(Node):
+    __slots__ = ('condition', 'commands', 'else_commands')
+    kind = IF_ELSE
+
+    def __init__(self, condition, commands, else_commands, lineno, index, end):
+        self.condition = condition
+        self.commands = commands
+        self.else_commands = else_commands
+        super().__init__(lineno, index, end)
+
+
+class While(Node):
+    __slots__ = ('condition', 'commands')
+    kind = WHILE
+
+    def __init__(self, condition, commands, lineno, index, end):
+        self.condition = condition
+        self.commands = commands
+        super().__init__(lineno, index, end)
+
+
+class Repeat(Node):
+    __slots__ = ('condition', 'commands')
+    kind = REPEAT
+
+    def __init__(self, condition, commands, lineno, index, end):
+        self.condition = condition
+        self.commands = commands
+        super().__init__(lineno, index, end)
+
+
+class For(Node):
+    """
+    FOR iterator FROM start TO/DOWNTO stop DO commands ENDFOR, kind is FOR_TO or FOR_DT.
+    SemanticAnalyzer sets iterator_var and bound_var (Int of the iterator and of its hidden bound)
+    and step_address, the iterator address after the body.
+    """
+    __slots__ = ('kind', 'iterator', 'start', 'stop', 'commands', 'iterator_var', 'bound_var',
+                 'step_address')
+
+    def __init__(self, kind, iterator, start, stop, commands, lineno, index, end):
+        self.kind = kind
+        self.iterator = iterator
+        self.start = start
+        self.stop = stop
+        self.commands = commands
+        self.iterator_var = None
+        self.bound_var = None
+        self.step_address = None
+        super().__init__(lineno, index, end)
+
+
+class Read(Node):
+    __slots__ = ('lvalue',)
+    kind = READ
+
+    def __init__(self, lvalue, lineno, index, end):
+        self.lvalue = lvalue
+        super().__init__(lineno, index, end)
+
+
+class Write(Node):
+    __slots__ = ('value',)
+    kind = WRITE
+
+    def __init__(self, value, lineno, index, end):
+        self.value = value
+        super().__init__(lineno, index, end)
+
+
+class IntDeclaration(Node):
+    __slots__ = ('name',)
+    kind = INT_DECLARATION
+
+    def __init__(self, name, lineno, index, end):
+        self.name = name
+        super().__init__(lineno, index, end)
+
+
+class TabDeclaration(Node):
+    __slots__ = ('name', 'start_index', 'end_index')
+    kind = TAB_DECLARATION
+
+    def __init__(self, name, start_index, end_index, lineno, index, end):
+        self.name = name
+        self.start_index = start_index
+        self.end_index = end_index
+        super().__init__(lineno, index, end)
+
+
+class Program(Node):
+    __slots__ = ('declarations', 'commands')
+    kind = PROGRAM
+
+    def __init__(self, declarations, commands, lineno, index, end):
+        self.declarations = declarations
+        self.commands = commands
+        super().__init__(lineno, index, end)
+
+
+def walk(commands, handlers, visit=None):
+    """
+    Calls handlers[node.kind](node) for every command in program order, without recursion.
+    A handler of a compound command returns a generator, which yields the lists of nested
+    commands; each list is walked before the generator is resumed.
+    :param commands: list of command nodes
+    :param handlers: dict kind -> handler
+    :param visit: function called with every command before its handler
+    :return:
+    """
+    stack = [iter(commands)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, list):  # body yielded by a handler
+                stack.append(iter(item))
+            else:
+                if visit is not None:
+                    visit(item)
+                body = handlers[item.kind](item)
+                if body is not None:
+                    stack.append(body)
+            break
+        else:
+            stack.pop()
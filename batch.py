@@ -0,0 +1,180 @@
+"""
+Batch compilation of many programs on a pool of processes.
+Usage: python batch.py [-j N] [-o OUTPUT_DIR] [--manifest FILE] [--report FILE] [--cache DIR]
+                       [-O LEVEL] [INPUT ...]
+INPUT may be a file, a directory (all *.imp inside) or a glob pattern. A manifest lists one input
+per line, optionally followed by the output path. Without -o outputs are written next to the
+inputs with the .mr extension. Two inputs with the same output path are an error.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from compile_cache import CompileCache
+from fast_lex import LEXERS
+from kompilator import CompilerSession
+from passes import OPTIMIZATION_LEVELS
+
+# every worker process builds its lexer, parser and compiler once
+_session = None
+
+
+def _init_worker(cache_dir=None, cache_bytes=None, lexer="sly", optimization=0):
+    global _session
+    cache = None
+    if cache_dir is not None:
+        cache = CompileCache(cache_dir, cache_bytes)
+    _session = CompilerSession(cache, lexer, optimization)
+
+
+def compile_file(task):
+    """
+    Compiles one file in a worker.
+    :param task: tuple (input path, output path)
+    :return: dict with the report entry of the file
+    """
+    input_file, output_file = task
+    entry = {"input": input_file, "output": output_file}
+    start = time.perf_counter()
+    try:
+        with open(input_file, "r") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        entry.update(status="unreadable", diagnostics=[str(e)], stats={},
+                     seconds=time.perf_counter() - start)
+        return entry
+
+    result = _session.compile_source(text)
+    if result.ok:
+        try:
+            with open(output_file, "wb") as f:
+                result.write(f)
+        except OSError as e:
+            entry.update(status="unwritable", diagnostics=result.diagnostics + [str(e)],
+                         stats=result.stats, seconds=time.perf_counter() - start)
+            return entry
+    entry.update(status="ok" if result.ok else "failed",
+                 diagnostics=result.diagnostics,
+                 stats=result.stats,
+                 seconds=time.perf_counter() - start)
+    return entry
+
+
+def output_path(input_file, output_dir=None):
+    name = os.path.splitext(input_file)[0] + ".mr"
+    if output_dir is not None:
+        name = os.path.join(output_dir, os.path.basename(name))
+    return name
+
+
+def collect_tasks(inputs, manifest=None, output_dir=None):
+    """
+    Expands the command line inputs and the manifest into (input, output) pairs.
+    Duplicates are dropped, the first occurrence decides the position in the report.
+    Raises ValueError if two inputs get the same output, e.g. files with one name from two
+    directories compiled with -o.
+    """
+    tasks = []
+    if manifest is not None:
+        with open(manifest, "r") as f:
+            for line in f:
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                out = fields[1] if len(fields) > 1 else output_path(fields[0], output_dir)
+                tasks.append((fields[0], out))
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            files = sorted(glob.glob(os.path.join(pattern, "*.imp")))
+        elif glob.has_magic(pattern):
+            files = sorted(glob.glob(pattern, recursive=True))
+        else:
+            files = [pattern]
+        tasks += [(f, output_path(f, output_dir)) for f in files]
+
+    seen = set()
+    unique = []
+    outputs = {}  # output path -> input
+    for task in tasks:
+        if os.path.abspath(task[0]) not in seen:
+            seen.add(os.path.abspath(task[0]))
+            unique.append(task)
+            output = os.path.abspath(task[1])
+            if output in outputs:
+                raise ValueError("{} and {} would both be compiled to {}"
+                                 .format(outputs[output], task[0], task[1]))
+            outputs[output] = task[0]
+    return unique
+
+
+def run_batch(tasks, jobs=None, cache_dir=None, cache_bytes=None, lexer="sly", optimization=0):
+    """
+    Compiles all tasks on a process pool. Results come back in the order of tasks, whatever
+    the order in which the workers finish.
+    :param cache_dir: directory of a CompileCache shared by all workers
+    :param lexer: name of the tokenizer backend from fast_lex.LEXERS
+    :param optimization: optimization level, one of passes.OPTIMIZATION_LEVELS
+    :return: list of report entries
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if not tasks:
+        return []
+    # a few chunks per worker: low IPC overhead, still balanced when file sizes differ
+    chunksize = max(1, len(tasks) // (4 * jobs))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(cache_dir, cache_bytes, lexer, optimization)) as pool:
+        return list(pool.map(compile_file, tasks, chunksize=chunksize))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Compile many programs in parallel")
+    arg_parser.add_argument("inputs", nargs="*", help="files, directories or glob patterns")
+    arg_parser.add_argument("--manifest", help="file with one 'input [output]' per line")
+    arg_parser.add_argument("-o", "--output-dir", help="directory for the compiled programs")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    arg_parser.add_argument("--report", default="-", help="JSON report file, '-' for stdout")
+    arg_parser.add_argument("--cache", metavar="DIR", help="directory of the compile cache")
+    arg_parser.add_argument("--cache-size", type=int, default=256, metavar="MB",
+                            help="size limit of the compile cache")
+    arg_parser.add_argument("--lexer", choices=sorted(LEXERS), default="sly",
+                            help="tokenizer backend, 'fast' is meant for very big sources")
+    arg_parser.add_argument("-O", dest="optimization", type=int, choices=OPTIMIZATION_LEVELS,
+                            default=0, help="optimization level")
+    args = arg_parser.parse_args()
+
+    try:
+        tasks = collect_tasks(args.inputs, args.manifest, args.output_dir)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    entries = run_batch(tasks, args.jobs, args.cache, args.cache_size * 1024 * 1024, args.lexer,
+                        args.optimization)
+    failed = sum(entry["status"] != "ok" for entry in entries)
+    cache_hits = sum(entry["stats"].get("cache") == "hit" for entry in entries)
+    cache_misses = sum(entry["stats"].get("cache") == "miss" for entry in entries)
+    report = {
+        "summary": {
+            "files": len(entries),
+            "ok": len(entries) - failed,
+            "failed": failed,
+            "jobs": args.jobs or os.cpu_count() or 1,
+            "seconds": time.perf_counter() - start,
+            "cache_hits": cache_hits,
+            "cache_misses": cache_misses,
+        },
+        "files": entries,
+    }
+    if args.report == "-":
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1)
+    sys.exit(1 if failed else 0)
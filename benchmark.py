@@ -0,0 +1,699 @@
+"""
+Benchmarks of the compiler itself and, with vm, of the generated code.
+Usage: python benchmark.py <name> [options], see python benchmark.py -h
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VARIABLES = "abcdefgh"
+OPERATORS = "+-*/%"
+RELATIONS = ["=", "!=", "<", ">", "<=", ">="]
+
+
+def generate_program(statements, seed=0, max_depth=2, max_block=None):
+    """
+    Random valid program with roughly the given number of statements.
+    :param statements: number of statements
+    :param seed: random seed
+    :param max_depth: maximal nesting of IF and FOR
+    :param max_block: maximal number of statements inside one IF or FOR, by default up to half
+                      of the enclosing block
+    :return: source code
+    """
+    rng = random.Random(seed)
+    lines = ["DECLARE " + ", ".join(VARIABLES) + ", t(0:15)", "BEGIN"]
+    lines += ["READ {};".format(v) for v in VARIABLES]
+    lines.append("FOR i FROM 0 TO 15 DO t(i) := i; ENDFOR")
+
+    def value(iterators):
+        kind = rng.randrange(4)
+        if kind == 0:
+            return str(rng.randrange(1000))
+        if kind == 1:
+            return "t({})".format(rng.choice(VARIABLES[:3] + "5"))
+        return rng.choice(VARIABLES + "".join(iterators))
+
+    def block(count, depth, iterators):
+        result = []
+        while count > 0:
+            kind = rng.randrange(10) if depth < max_depth else 9
+            if kind == 0:
+                inner = rng.randint(1, max(1, min(count // 2, max_block or count)))
+                cond = "{} {} {}".format(value(iterators), rng.choice(RELATIONS), value(iterators))
+                result += ["IF {} THEN".format(cond)] + block(inner, depth + 1, iterators)
+                if rng.randrange(2):
+                    result += ["ELSE"] + block(inner, depth + 1, iterators)
+                result.append("ENDIF")
+                count -= inner
+            elif kind == 1:
+                inner = rng.randint(1, max(1, min(count // 2, max_block or count)))
+                iterator = "ijklmnop"[depth]
+                keyword = rng.choice(["TO", "DOWNTO"])
+                result += ["FOR {} FROM {} {} {} DO".format(iterator, value(iterators), keyword,
+                                                            value(iterators))]
+                result += block(inner, depth + 1, iterators + iterator) + ["ENDFOR"]
+                count -= inner
+            elif kind == 2:
+                result.append("WRITE {};".format(value(iterators)))
+                count -= 1
+            else:
+                expr = value(iterators)
+                if rng.randrange(3):
+                    expr += " {} {}".format(rng.choice(OPERATORS), value(iterators))
+                result.append("{} := {};".format(rng.choice(VARIABLES), expr))
+                count -= 1
+        return result
+
+    lines += block(statements, 0, "")
+    lines.append("END")
+    return "\n".join(lines) + "\n"
+
+
+def identifier(number):
+    letters = ""
+    while True:
+        number, digit = divmod(number, 26)
+        letters += "abcdefghijklmnopqrstuvwxyz"[digit]
+        if not number:
+            return letters
+
+
+def generate_nested(depth):
+    """
+    Program with IF, FOR, REPEAT and WHILE nested depth times, every level executed once.
+    It reads a and writes a and the number of levels.
+    :param depth: nesting depth
+    :return: source code
+    """
+    opening, closing = [], []
+    for level in range(depth):
+        kind = level % 4
+        if kind == 0:
+            opening.append("IF a >= 0 THEN")
+            closing.append("ENDIF")
+        elif kind == 1:
+            opening.append("FOR i{} FROM 1 TO 1 DO".format(identifier(level)))
+            closing.append("ENDFOR")
+        elif kind == 2:
+            opening.append("REPEAT")
+            closing.append("UNTIL a >= 0;")
+        else:
+            opening.append("WHILE b = 0 DO")
+            closing.append("b := 1; ENDWHILE")
+    lines = ["DECLARE a, b, c", "BEGIN", "READ a;", "b := 0;", "c := 0;"]
+    lines += opening + ["WRITE a;", "c := {};".format(depth)] + closing[::-1]
+    lines += ["WRITE c;", "END"]
+    return "\n".join(lines) + "\n"
+
+
+STARTUP_SNIPPET = """
+import time
+start = time.perf_counter()
+from lex import _Lexer
+from parser import _Parser
+_Parser()
+next(_Lexer().tokenize("BEGIN"))
+print(time.perf_counter() - start)
+"""
+
+
+def run_startup(repeat, table_cache):
+    env = dict(os.environ, KOMPILATOR_TABLE_CACHE="1" if table_cache else "0")
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], cwd=HERE, env=env,
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout))
+    return times
+
+
+def bench_startup(args):
+    """
+    Import-to-first-token time of a fresh interpreter, with and without cached parser tables.
+    """
+    run_startup(1, table_cache=True)  # make sure the cache exists
+    for name, cached in (("tables built", False), ("tables cached", True)):
+        times = sorted(run_startup(args.repeat, cached))
+        print("{:14} median {:7.2f} ms   min {:7.2f} ms"
+              .format(name, 1000 * times[len(times) // 2], 1000 * times[0]))
+
+
+def bench_throughput(args):
+    """
+    Programs per second: a kompilator.py process per program vs compile_source in one process.
+    """
+    from kompilator import compile_source
+    programs = [generate_program(20, seed) for seed in range(args.programs)]
+    with tempfile.TemporaryDirectory() as tmp:
+        source, output = os.path.join(tmp, "in.imp"), os.path.join(tmp, "out.mr")
+        cli_programs = programs[:max(1, args.programs // 10)]
+        start = time.perf_counter()
+        for text in cli_programs:
+            with open(source, "w") as f:
+                f.write(text)
+            subprocess.run([sys.executable, os.path.join(HERE, "kompilator.py"), source, output],
+                           check=True)
+        cli_rate = len(cli_programs) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for text in programs:
+        assert compile_source(text).ok
+    api_rate = len(programs) / (time.perf_counter() - start)
+    print("kompilator.py   {:8.1f} programs/s".format(cli_rate))
+    print("compile_source  {:8.1f} programs/s  ({:.1f}x)".format(api_rate, api_rate / cli_rate))
+
+
+def bench_lexer(args):
+    """
+    Tokenizer throughput in MB/s of both lexer backends on one big generated source.
+    """
+    from fast_lex import LEXERS
+    text = generate_program(args.statements, seed=1).replace(";\n", "; [comment]\n")
+    megabytes = len(text.encode()) / 1e6
+    reference = None
+    for name in sorted(LEXERS, reverse=True):
+        lexer = LEXERS[name]()
+        start = time.perf_counter()
+        tokens = [(t.type, t.value, t.lineno, t.index, t.end) for t in lexer.tokenize(text)]
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference = tokens
+        assert tokens == reference, "backends disagree"
+        print("{:5} {:8.2f} MB/s  ({:.2f} MB, {} tokens)"
+              .format(name, megabytes / seconds, megabytes, len(tokens)))
+
+
+def bench_ast(args):
+    """
+    Memory taken by the AST of one big generated program, peak memory of the whole compilation
+    and the time of parsing and code generation.
+    """
+    import tracemalloc
+    from kompilator import CompilerSession
+    text = generate_program(args.statements, seed=2)
+    session = CompilerSession()
+
+    tracemalloc.start()
+    ast = session.parser.parse(session.lexer.tokenize(text))
+    ast_bytes, parse_peak = tracemalloc.get_traced_memory()
+    del ast
+    tracemalloc.reset_peak()
+    assert session.compile_source(text).ok
+    compile_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stats = session.compile_source(text).stats
+    print("statements {}, {:.2f} MB of source".format(args.statements, len(text) / 1e6))
+    print("AST          {:8.1f} MB".format(ast_bytes / 1e6))
+    print("parse peak   {:8.1f} MB".format(parse_peak / 1e6))
+    print("compile peak {:8.1f} MB".format(compile_peak / 1e6))
+    print("parse        {:8.2f} s".format(stats["parse_seconds"]))
+    print("codegen      {:8.2f} s".format(stats["compile_seconds"]))
+
+
+STREAM_SNIPPET = """
+import resource, time
+from benchmark import generate_program
+from kompilator import CompilerSession
+text = generate_program({statements}, seed=2, max_block=100)
+session = CompilerSession()
+start = time.perf_counter()
+if {stream}:
+    assert session.compile_to_file(text, {output!r})
+else:
+    result = session.compile_source(text)
+    with open({output!r}, "w") as f:
+        f.write(result.code)
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def bench_stream(args):
+    """
+    Peak resident memory and time of compile_source and of the streaming compile_to_file, each
+    in a fresh interpreter. The program is a long list of small top-level statements.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, stream in (("compile_source", False), ("compile_to_file", True)):
+            snippet = STREAM_SNIPPET.format(statements=args.statements, stream=stream,
+                                            output=os.path.join(tmp, "out.mr"))
+            out = subprocess.run([sys.executable, "-c", snippet], cwd=HERE, capture_output=True,
+                                 text=True, check=True)
+            seconds, max_rss = out.stdout.split()
+            print("{:16} {:8.1f} MB peak RSS {:8.2f} s"
+                  .format(name, int(max_rss) / 1024, float(seconds)))
+
+
+def bench_nesting(args):
+    """
+    Stress test of deep nesting: compile time at a quarter, half and the whole depth should grow
+    linearly.
+    """
+    from kompilator import compile_source
+    for depth in (args.depth // 4, args.depth // 2, args.depth):
+        result = compile_source(generate_nested(depth))
+        assert result.ok, result.diagnostics
+        print("depth {:6}  parse {:6.2f} s  codegen {:6.2f} s  {} instructions"
+              .format(depth, result.stats["parse_seconds"], result.stats["compile_seconds"],
+                      result.stats["instructions"]))
+
+
+def bench_expressions(args):
+    """
+    Compile time of a program made only of assignments, most of them with an arithmetic
+    operation on variables and table elements.
+    """
+    from kompilator import compile_source
+    text = generate_program(args.statements, seed=3, max_depth=0)
+    times = []
+    for _ in range(args.repeat):
+        result = compile_source(text)
+        assert result.ok, result.diagnostics
+        times.append(result.stats["compile_seconds"])
+    times.sort()
+    print("{} statements, {} instructions".format(args.statements, result.stats["instructions"]))
+    print("codegen median {:6.3f} s   min {:6.3f} s".format(times[len(times) // 2], times[0]))
+
+
+def remove_labels_text(instructions):
+    """
+    Label resolution of the text instructions, as MachineInstructions did it before the code was
+    kept in records: LABELn lines mark positions, jumps end with the label name.
+    """
+    labels = {}
+    result = []
+    for instr in instructions:
+        if instr[0:5] == "LABEL":
+            labels[instr] = len(result)
+        else:
+            result.append(instr)
+    i = 0
+    for instr in result:
+        if 'LABEL' in instr:
+            label = instr[instr.index("LABEL"):]
+            offset = labels[label] - i
+            result[i] = instr.replace(label, str(offset)).strip()
+        i += 1
+    return result
+
+
+def bench_labels(args):
+    """
+    Label resolution of about a million instructions: the text instructions with remove_labels
+    of the previous version against resolve_labels of the encoded ones (and their rendering).
+    """
+    from array import array
+    from kompilator import CompilerSession
+    from machine_instructions import JUMP, JODD, OPERAND_SHIFT, decode
+    session = CompilerSession()
+    instructions = session.compiler.Instructions
+    unresolved = {}
+
+    def keep_unresolved():
+        unresolved.update(code=array('q', instructions.code), labels=instructions.labels,
+                          jumps=instructions.jumps, debug=instructions.debug)
+    instructions.resolve_labels = keep_unresolved
+    text = generate_program(args.statements // 7, seed=4)
+    assert session.compile_source(text).ok
+    del instructions.resolve_labels
+    code, labels, jumps = unresolved["code"], unresolved["labels"], unresolved["jumps"]
+    instructions.labels, instructions.debug = labels, unresolved["debug"]
+
+    # the same code as text with LABELn lines
+    at_position = {}
+    for label, position in enumerate(labels):
+        at_position.setdefault(position, []).append("LABEL{}".format(label))
+    instructions.code = array('q', code)
+    for position in jumps:
+        instructions.code[position] &= (1 << OPERAND_SHIFT) - 1
+    lines = []
+    for number, line in enumerate(instructions.render()):
+        lines += at_position.get(number, [])
+        opcode, _, _, label = decode(code[number])
+        if JUMP <= opcode <= JODD:
+            line = line[:line.rindex(" ")] + " LABEL{}".format(label)
+        lines.append(line)
+
+    start = time.perf_counter()
+    reference = remove_labels_text(lines)
+    text_seconds = time.perf_counter() - start
+
+    instructions.code, instructions.jumps = code, jumps
+    start = time.perf_counter()
+    instructions.resolve_labels()
+    resolve_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    rendered = instructions.render()
+    render_seconds = time.perf_counter() - start
+    assert rendered == reference, "resolvers disagree"
+    print("{} instructions, {} labels, {} jumps".format(len(rendered), len(labels), len(jumps)))
+    print("remove_labels (text)   {:8.3f} s".format(text_seconds))
+    print("resolve_labels         {:8.3f} s".format(resolve_seconds))
+    print("render                 {:8.3f} s".format(render_seconds))
+
+
+def bench_output(args):
+    """
+    Instructions per second of writing the machine code of a big program to a file: print per
+    instruction and string concatenation as before, write_lines of the rendered text and
+    MachineInstructions.write straight from the encoded code.
+    """
+    from machine_instructions import write_lines
+    from kompilator import CompilerSession
+    session = CompilerSession()
+    compiler = session.compiler
+    ast = session.parser.parse(session.lexer.tokenize(generate_program(args.statements // 7,
+                                                                       seed=4)))
+    compiler.reset(ast)
+    compiler.compile(ast)
+    instructions = compiler.Instructions
+    lines = instructions.render()
+
+    def printed(f):
+        for instr in lines:
+            print(instr, file=f)
+
+    def concatenated(f):
+        output_code = ""
+        for inst in lines:
+            output_code += inst + "\n"
+        f.write(output_code)
+
+    writers = [
+        ("print per instruction", "w", printed),
+        ("+= and one write", "w", concatenated),
+        ("write_lines, text file", "w", lambda f: write_lines(lines, f)),
+        ("write_lines, binary file", "wb", lambda f: write_lines(lines, f)),
+        ("render + write_lines", "wb", lambda f: write_lines(instructions.render(), f)),
+        ("MachineInstructions.write", "wb", instructions.write),
+    ]
+    print("{} instructions".format(len(lines)))
+    reference = None
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out.mr")
+        for name, mode, writer in writers:
+            times = []
+            for _ in range(max(1, args.repeat // 4)):
+                start = time.perf_counter()
+                with open(path, mode) as f:
+                    writer(f)
+                times.append(time.perf_counter() - start)
+            with open(path, "rb") as f:
+                written = f.read()
+            if reference is None:
+                reference = written
+            assert written == reference, name
+            print("{:26} {:8.2f} M instructions/s".format(name, len(lines) / min(times) / 1e6))
+
+
+def bench_object(args):
+    """
+    Size and load time of a corpus of compiled programs as text and in the object format. A text
+    program is loaded when it's read and assembled into instructions, an object file when it's
+    memory-mapped with its tables decoded.
+    """
+    from kompilator import CompilerSession
+    from object_format import assemble, load
+    session = CompilerSession()
+    results = [session.compile_source(generate_program(200, seed)) for seed in range(args.programs)]
+    with tempfile.TemporaryDirectory() as tmp:
+        text_files, object_files = [], []
+        for number, result in enumerate(results):
+            assert result.ok
+            text_files.append(os.path.join(tmp, "{}.mr".format(number)))
+            object_files.append(os.path.join(tmp, "{}.mro".format(number)))
+            with open(text_files[-1], "wb") as f:
+                result.write(f)
+            with open(object_files[-1], "wb") as f:
+                result.write_object(f)
+        text_bytes = sum(os.path.getsize(path) for path in text_files)
+        object_bytes = sum(os.path.getsize(path) for path in object_files)
+
+        start = time.perf_counter()
+        for path in text_files:
+            with open(path, "r") as f:
+                assemble(f.read().splitlines())
+        text_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for path in object_files:
+            load(path).close()
+        object_seconds = time.perf_counter() - start
+
+        for path, result in zip(object_files, results):
+            with load(path) as obj:
+                assert obj.disassemble() == result.instructions, path
+    instructions = sum(len(result.instructions) for result in results)
+    print("{} programs, {} instructions".format(len(results), instructions))
+    print("text    {:8.2f} MB   load {:7.3f} s".format(text_bytes / 1e6, text_seconds))
+    print("object  {:8.2f} MB   load {:7.3f} s   ({:.0%} of the size, {:.1f}x faster)"
+          .format(object_bytes / 1e6, object_seconds, object_bytes / text_bytes,
+                  text_seconds / object_seconds))
+
+
+# sha256 of the code of baseline_programs() written by the compiler before ir.IRCode existed
+BASELINE_DIGEST = "bbdab33ae565f4fbcd6958dc05ccb265d8d39ca506eb9ddadfc98468fa20526e"
+
+
+def baseline_programs():
+    return [generate_program(200, seed, max_depth=3) for seed in range(40)] + [generate_nested(200)]
+
+
+def bench_baseline(args):
+    """
+    Regression check rather than a benchmark: the -O0 code of the generated programs has to be
+    byte for byte the code written before the IR, whose digest is BASELINE_DIGEST.
+    """
+    import hashlib
+    from kompilator import CompilerSession
+    session = CompilerSession(optimization=0)
+    digest = hashlib.sha256()
+    instructions = 0
+    for text in baseline_programs():
+        result = session.compile_source(text)
+        assert result.ok, result.diagnostics
+        digest.update(result.code.encode())
+        instructions += len(result.instructions)
+    assert digest.hexdigest() == BASELINE_DIGEST, "-O0 code differs from the baseline"
+    print("-O0 code of {} programs ({} instructions) equals the baseline"
+          .format(len(baseline_programs()), instructions))
+
+
+def bench_passes(args):
+    """
+    Compile time of one big program at every optimization level, with the time of every pass.
+    """
+    from kompilator import CompilerSession, print_pass_stats
+    from passes import OPTIMIZATION_LEVELS
+    text = generate_program(args.statements, seed=2)
+    for level in OPTIMIZATION_LEVELS:
+        session = CompilerSession(optimization=level)
+        times = []
+        for _ in range(max(1, args.repeat // 4)):
+            result = session.compile_source(text)
+            assert result.ok, result.diagnostics
+            times.append(result.stats["compile_seconds"])
+        print("-O{}  codegen min {:6.3f} s  {} instructions"
+              .format(level, min(times), result.stats["instructions"]))
+        print_pass_stats(result.stats, sys.stdout)
+
+
+# name -> source, input of the virtual machine
+VM_PROGRAMS = {
+    "gcd": ("""DECLARE a, b, r
+BEGIN
+  READ a; READ b;
+  WHILE b > 0 DO
+    r := a % b;
+    a := b;
+    b := r;
+  ENDWHILE
+  WRITE a;
+END
+""", "1234567890 987654321"),
+    "base": ("""DECLARE n, b, q, d
+BEGIN
+  READ n; READ b;
+  REPEAT
+    q := n / b;
+    d := n % b;
+    WRITE d;
+    n := q;
+  UNTIL n = 0;
+END
+""", "1000000007 7"),
+    "sieve": ("""DECLARE n, j, t(2:100)
+BEGIN
+  n := 100;
+  FOR i FROM n DOWNTO 2 DO
+    t(i) := 1;
+  ENDFOR
+  FOR i FROM 2 TO n DO
+    IF t(i) != 0 THEN
+      j := i + i;
+      WHILE j <= n DO
+        t(j) := 0;
+        j := j + i;
+      ENDWHILE
+      WRITE i;
+    ENDIF
+  ENDFOR
+END
+""", ""),
+    "collatz": ("""DECLARE n, steps, h
+BEGIN
+  READ n;
+  steps := 0;
+  WHILE n != 1 DO
+    h := n % 2;
+    IF h = 0 THEN
+      n := n / 2;
+    ELSE
+      n := 3 * n;
+      n := n + 1;
+    ENDIF
+    steps := steps + 1;
+  ENDWHILE
+  WRITE steps;
+END
+""", "837799"),
+    "constants": ("""DECLARE size, half, step, x, s, t(0:9)
+BEGIN
+  size := 10;
+  half := size / 2;
+  step := half - 3;
+  READ x;
+  t(half) := x * 4;
+  s := 0;
+  FOR i FROM 0 TO 9 DO
+    s := s + i;
+  ENDFOR
+  WRITE s;
+  x := t(half) / step;
+  WRITE x;
+  IF half > step THEN
+    WRITE half;
+  ELSE
+    WRITE step;
+  ENDIF
+END
+""", "21"),
+    "products": ("""DECLARE x, s, p
+BEGIN
+  READ x;
+  s := 0;
+  FOR i FROM 1 TO 20 DO
+    FOR j FROM i TO 20 DO
+      p := i * j;
+      s := s + p;
+    ENDFOR
+    p := x * 1000003;
+    s := s + p;
+  ENDFOR
+  WRITE s;
+END
+""", "12345"),
+    "shared": ("""DECLARE a, b, n, s, q, r, t(0:15)
+BEGIN
+  READ a; READ b; READ n;
+  s := 0;
+  FOR i FROM 0 TO 15 DO
+    t(i) := a * b;
+    q := a * b;
+    t(i) := q + i;
+    r := t(i);
+    s := s + r;
+  ENDFOR
+  WHILE n > 0 DO
+    q := s % 16;
+    r := t(q);
+    s := s - r;
+    q := s * n;
+    r := s * n;
+    s := q - r;
+    s := s + q;
+    n := n - 1;
+  ENDWHILE
+  WRITE s;
+END
+""", "1234\n567\n9"),
+}
+
+
+def run_vm(code, stdin):
+    """
+    :param code: machine code as text
+    :param stdin: input of the program
+    :return: list of written numbers, cost of the run
+    """
+    import re
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "program.mr")
+        with open(path, "w") as f:
+            f.write(code)
+        out = subprocess.run([os.path.join(HERE, "maszyna-wirtualna"), path], input=stdin,
+                             capture_output=True, text=True, check=True).stdout
+    out = re.sub(r"\x1b\[[0-9;]*m", "", out)
+    return re.findall(r"> (-?\d+)", out), int(re.search(r"koszt: (\d+)", out).group(1))
+
+
+def bench_vm(args):
+    """
+    Quality of the generated code rather than speed of the compiler: cost of running sample
+    programs on the virtual machine at every optimization level. Every level has to write the
+    same numbers as -O0.
+    """
+    from kompilator import CompilerSession
+    from passes import OPTIMIZATION_LEVELS
+    sessions = [CompilerSession(optimization=level) for level in OPTIMIZATION_LEVELS]
+    print("{:12}".format("program") + "".join("{:>12}".format("-O{}".format(level))
+                                              for level in OPTIMIZATION_LEVELS))
+    totals = [0] * len(sessions)
+    for name, (text, stdin) in VM_PROGRAMS.items():
+        costs = []
+        reference = None
+        for session in sessions:
+            result = session.compile_source(text)
+            assert result.ok, result.diagnostics
+            written, cost = run_vm(result.code, stdin)
+            if reference is None:
+                reference = written
+            assert written == reference, "{} writes other numbers at -O{}".format(
+                name, session.options["optimization"])
+            costs.append(cost)
+        totals = [total + cost for total, cost in zip(totals, costs)]
+        print("{:12}".format(name) + "".join("{:12}".format(cost) for cost in costs))
+    print("{:12}".format("total") + "".join("{:12}".format(total) for total in totals))
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "throughput": bench_throughput,
+    "lexer": bench_lexer,
+    "ast": bench_ast,
+    "stream": bench_stream,
+    "nesting": bench_nesting,
+    "expressions": bench_expressions,
+    "labels": bench_labels,
+    "object": bench_object,
+    "output": bench_output,
+    "baseline": bench_baseline,
+    "passes": bench_passes,
+    "vm": bench_vm,
+}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Compiler benchmarks")
+    arg_parser.add_argument("name", choices=sorted(BENCHMARKS))
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    arg_parser.add_argument("--programs", type=int, default=200)
+    arg_parser.add_argument("--statements", type=int, default=100000)
+    arg_parser.add_argument("--depth", type=int, default=10000)
+    args = arg_parser.parse_args()
+    BENCHMARKS[args.name](args)
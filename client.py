@@ -0,0 +1,37 @@
+"""
+Thin client of the compile server, takes the same arguments as kompilator.py.
+Usage: python client.py [-O LEVEL] input_file output_file
+The server socket is taken from KOMPILATOR_SOCKET (default /tmp/kompilator.sock).
+"""
+import socket
+import sys
+
+from socket_protocol import DEFAULT_SOCKET, send_message, recv_message
+
+
+def compile_remote(text, socket_path=DEFAULT_SOCKET, optimization=0):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        send_message(sock, {"source": text, "optimization": optimization})
+        return recv_message(sock)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    optimization = 0
+    if args and args[0].startswith("-O"):
+        optimization = int(args.pop(0)[2:] or args.pop(0))
+    input_file, output_file = args
+    with open(input_file, "r") as f:
+        text = f.read()
+    try:
+        result = compile_remote(text, optimization=optimization)
+    except OSError as e:
+        print("Can't connect to compile server at {}: {}".format(DEFAULT_SOCKET, e),
+              file=sys.stderr)
+        sys.exit(2)
+    sys.stdout.write(result["stdout"])
+    sys.stderr.write(result["stderr"])
+    if result["code"] is not None:
+        with open(output_file, "w") as f:
+            f.write(result["code"])
@@ -0,0 +1,120 @@
+import glob
+import hashlib
+import json
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# bump when the layout of cache entries changes
+CACHE_FORMAT = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_compiler_version = None
+
+
+def compiler_version():
+    """
+    Hash of the compiler sources. Any edit of a module gives new keys, so stale entries are
+    never returned, just evicted with time.
+    """
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+        for path in sorted(glob.glob(os.path.join(HERE, "*.py"))):
+            with open(path, "rb") as f:
+                digest.update(os.path.basename(path).encode())
+                digest.update(f.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+
+class CompileCache(object):
+    """
+    On-disk cache of compilation results, content addressed by source text, compiler version
+    and code generation options. Entries are written atomically (temporary file + rename), so
+    any number of processes can share one directory. The least recently used entries are
+    removed when the directory grows over max_bytes.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size_estimate = None
+
+    def key(self, text, options=None):
+        digest = hashlib.sha256(compiler_version().encode())
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        digest.update(text.encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """
+        :return: dict stored by put or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            # mtime is the LRU clock, atime is not reliable (noatime mounts)
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, evicted meanwhile by another process or damaged
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        path = self._path(key)
+        data = json.dumps(entry).encode()
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        if self._size_estimate is None:
+            self._size_estimate = self.size()
+        else:
+            self._size_estimate += len(data)
+        if self._size_estimate > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for path in glob.glob(os.path.join(self.directory, "*", "*.json")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache takes at most 3/4 of max_bytes.
+        Other processes may remove the same files at the same time, that's fine.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * 3 // 4
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._size_estimate = total
@@ -0,0 +1,226 @@
+"""
+Common subexpression elimination, a pass of the "ast" stage. An arithmetic operation or a read
+of a table element at a variable index is available after it's computed, until a command assigns
+one of its operands. A repeated one is replaced by a variable holding its value:
+- the variable the first one was assigned to, while that isn't assigned again,
+- otherwise, for operations running the loops of Compiler.mul, div and mod, a temporary cell the
+  first one is computed to just before its command.
+The code between is straight-line: availability goes on into the arms of an IF (its condition is
+computed once, before them) but not into loop bodies, and after an IF or a loop only what none of
+their commands changed stays available.
+"""
+from ast_nodes import (NUM, INT, TAB, ADD, SUB, MUL, DIV, MOD, ASSIGN, READ, WRITE, IF, IF_ELSE,
+                       WHILE, REPEAT, FOR_TO, FOR_DT, Identifier, Assign, walk)
+from fusion import reads, temporary_identifier
+
+ARITHMETIC_KINDS = (ADD, SUB, MUL, DIV, MOD)
+COMMUTATIVE = (ADD, MUL)
+
+
+def expression_key(ast_node):
+    """
+    :return: key equal for equal values of an arithmetic operation or a table element
+    """
+    if ast_node.kind == TAB:
+        return ast_node.key()
+    left, right = ast_node.left.key(), ast_node.right.key()
+    if ast_node.kind in COMMUTATIVE and right < left:
+        left, right = right, left
+    return ast_node.kind, left, right
+
+
+def loops(ast_node):
+    """
+    :return: whether the code of an arithmetic operation is a loop (see Compiler.mul, div, mod)
+    """
+    return ast_node.kind in (MUL, DIV, MOD) and ast_node.left.kind != NUM \
+        and ast_node.right.kind != NUM
+
+
+class Available(object):
+    """
+    A computed value. holder - Identifier of the variable holding it or None if it was assigned
+    again, command and place (node, attribute) - where it was computed first, for a temporary.
+    """
+    __slots__ = ('expression', 'holder', 'command', 'place')
+
+    def __init__(self, expression, holder, command, place):
+        self.expression = expression
+        self.holder = holder
+        self.command = command
+        self.place = place
+
+
+class CommonSubexpressions(object):
+    """
+    The pass, temporaries come from variables, the VariableManager of the compiler.
+    """
+    def __init__(self, variables):
+        self.variables = variables
+        self.available = {}  # key -> Available
+        self.saved = []  # availability before the open IFs and loops
+        self.insertions = {}  # id of a command -> assignments of temporaries before it
+        self.counts = {}
+        self.operation = {
+            ASSIGN: self.assign,
+            WRITE: self.write,
+            READ: self.read,
+            IF: self.if_endif,
+            IF_ELSE: self.if_else_endif,
+            WHILE: self.loop,
+            REPEAT: self.loop,
+            FOR_TO: self.for_loop,
+            FOR_DT: self.for_loop,
+        }
+
+    def __call__(self, commands):
+        """
+        :param commands: list of commands, annotated by SemanticAnalyzer
+        :return: dict of counters
+        """
+        self.counts = {"expressions": 0, "temporaries": 0}
+        self.available = {}
+        self.saved = []
+        walk(commands, self.operation)
+        if self.insertions:
+            self.insert(commands)
+        self.insertions = {}
+        return self.counts
+
+    def insert(self, commands):
+        insertions = self.insertions
+        stack = [commands]
+        while stack:
+            commands = stack.pop()
+            if any(id(ast_node) in insertions for ast_node in commands):
+                inserted = []
+                for ast_node in commands:
+                    inserted += insertions.get(id(ast_node), ())
+                    inserted.append(ast_node)
+                commands[:] = inserted
+            for ast_node in commands:
+                if ast_node.kind in (IF, IF_ELSE, WHILE, REPEAT, FOR_TO, FOR_DT):
+                    stack.append(ast_node.commands)
+                    if ast_node.kind == IF_ELSE:
+                        stack.append(ast_node.else_commands)
+
+    # AVAILABILITY
+
+    def kill(self, lvalue):
+        """
+        Forgets values which an assignment to lvalue changes, here and before the open IFs and
+        loops. A value whose variable is assigned is kept for a temporary if it's worth one.
+        """
+        for available in [self.available] + self.saved:
+            for key, value in list(available.items()):
+                expression = value.expression
+                if expression.kind == TAB:
+                    changed = reads(expression, lvalue)
+                else:
+                    changed = reads(expression.left, lvalue) or reads(expression.right, lvalue)
+                if changed:
+                    del available[key]
+                elif value.holder is not None and reads(value.holder, lvalue):
+                    if loops(expression):
+                        value.holder = None
+                    else:
+                        del available[key]
+
+    def reuse(self, ast_node):
+        """
+        :param ast_node: arithmetic operation or value
+        :return: Identifier replacing ast_node, None if its value isn't available
+        """
+        if ast_node.kind not in ARITHMETIC_KINDS and not (
+                ast_node.kind == TAB and ast_node.index_value.kind == INT):
+            return None
+        available = self.available.get(expression_key(ast_node))
+        if available is None:
+            return None
+        if available.holder is None:
+            self.make_temporary(available)
+        self.counts["expressions"] += 1
+        holder = available.holder
+        identifier = Identifier(holder.name, ast_node.lineno, ast_node.index, ast_node.end)
+        identifier.var = holder.var
+        return identifier
+
+    def make_temporary(self, available):
+        """
+        Computes the value of available to a temporary before its first command.
+        """
+        expression = available.expression
+        temporary = self.variables.new_temporary(expression.lineno)
+        command = available.command
+        assignment = Assign(temporary_identifier(temporary, expression), expression,
+                            command.lineno, command.index, command.end)
+        self.insertions.setdefault(id(command), []).append(assignment)
+        node, attribute = available.place
+        setattr(node, attribute, temporary_identifier(temporary, expression))
+        available.holder = temporary_identifier(temporary, expression)
+        self.counts["temporaries"] += 1
+
+    def value(self, node, attribute):
+        """
+        Replaces the value getattr(node, attribute) by a variable holding it.
+        """
+        ast_node = getattr(node, attribute)
+        if ast_node.kind == TAB:
+            identifier = self.reuse(ast_node)
+            if identifier is not None:
+                setattr(node, attribute, identifier)
+
+    # COMMANDS
+
+    def assign(self, ast_node):
+        rvalue = ast_node.rvalue
+        if rvalue.kind in ARITHMETIC_KINDS:
+            self.value(rvalue, "left")
+            self.value(rvalue, "right")
+        identifier = self.reuse(rvalue)
+        if identifier is not None:
+            ast_node.rvalue = rvalue = identifier
+        lvalue = ast_node.lvalue
+        self.kill(lvalue)
+        if rvalue.kind in ARITHMETIC_KINDS or rvalue.kind == TAB and \
+                rvalue.index_value.kind == INT:
+            operands = (rvalue,) if rvalue.kind == TAB else (rvalue.left, rvalue.right)
+            if any(reads(operand, lvalue) for operand in operands):
+                return
+            holder = lvalue if lvalue.kind == INT else None
+            if holder is not None or loops(rvalue):
+                self.available[expression_key(rvalue)] = Available(rvalue, holder, ast_node,
+                                                                   (ast_node, "rvalue"))
+
+    def read(self, ast_node):
+        self.kill(ast_node.lvalue)
+
+    def write(self, ast_node):
+        self.value(ast_node, "value")
+
+    def if_endif(self, ast_node):
+        self.value(ast_node.condition, "left")
+        self.value(ast_node.condition, "right")
+        self.saved.append(dict(self.available))
+        yield ast_node.commands
+        self.available = self.saved.pop()
+
+    def if_else_endif(self, ast_node):
+        self.value(ast_node.condition, "left")
+        self.value(ast_node.condition, "right")
+        self.saved.append(dict(self.available))
+        yield ast_node.commands
+        self.available = dict(self.saved[-1])
+        yield ast_node.else_commands
+        self.available = self.saved.pop()
+
+    def loop(self, ast_node):
+        self.saved.append(self.available)
+        self.available = {}
+        yield ast_node.commands
+        self.available = self.saved.pop()
+
+    def for_loop(self, ast_node):
+        self.value(ast_node, "start")
+        self.value(ast_node, "stop")
+        return self.loop(ast_node)
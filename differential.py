@@ -0,0 +1,227 @@
+"""
+Differential check of the optimization passes: programs compiled at every optimization level have
+to write the same numbers on the virtual machine as at -O0. The programs are PROGRAMS, the sample
+programs of benchmark.py and random programs storing to tables in IFs and loops.
+Usage: python differential.py [--programs N] [--seed SEED]
+"""
+import argparse
+import random
+import sys
+
+from benchmark import RELATIONS, VM_PROGRAMS, run_vm
+
+# name -> source, input of the virtual machine
+PROGRAMS = {
+    # a store at a variable index may change any known element of the table
+    "store at a variable index": ("""DECLARE i, a, t(0:9)
+BEGIN
+  t(3) := 7;
+  READ i;
+  t(i) := 9;
+  a := t(3);
+  WRITE a;
+END
+""", "3"),
+    "store at a variable index in IF": ("""DECLARE i, a, t(0:9)
+BEGIN
+  READ i;
+  t(3) := 7;
+  IF i > 1 THEN
+    t(i) := 2;
+  ENDIF
+  a := t(3);
+  WRITE a;
+END
+""", "3"),
+    "stores in loops": ("""DECLARE a, n, q, s, t(0:9)
+BEGIN
+  READ a; READ n;
+  t(2) := 5;
+  t(4) := 6;
+  q := a;
+  WHILE q < n DO
+    t(q) := q;
+    q := q + 3;
+  ENDWHILE
+  s := t(2);
+  WRITE s;
+  REPEAT
+    q := q - 1;
+    t(q) := s;
+  UNTIL q <= 4;
+  s := t(4);
+  WRITE s;
+  FOR i FROM a TO n DO
+    t(i) := i * 7;
+  ENDFOR
+  FOR i FROM 0 TO 9 DO
+    WRITE t(i);
+  ENDFOR
+END
+""", "1\n8"),
+    "stores in IF ELSE": ("""DECLARE a, b, c, t(0:9)
+BEGIN
+  READ a; READ b;
+  t(1) := 10;
+  t(5) := 50;
+  IF a < b THEN
+    t(a) := 11;
+  ELSE
+    t(b) := 12;
+    READ t(a);
+  ENDIF
+  c := t(1);
+  WRITE c;
+  c := t(5);
+  WRITE c;
+  c := a * b;
+  t(b) := c;
+  c := a * b;
+  c := c + t(b);
+  WRITE c;
+END
+""", "5\n1\n33"),
+    "stores in nested loops": ("""DECLARE a, b, c, d, t(0:9)
+BEGIN
+  READ a; READ b;
+  FOR i FROM 0 TO 9 DO
+    t(i) := 0;
+  ENDFOR
+  FOR i FROM 1 TO 4 DO
+    c := a * b;
+    d := t(a);
+    FOR j FROM i DOWNTO 1 DO
+      t(j) := t(j) + c;
+      t(a) := d + j;
+    ENDFOR
+    c := a / i;
+    d := a % i;
+    t(d) := t(d) + c;
+  ENDFOR
+  FOR i FROM 0 TO 9 DO
+    WRITE t(i);
+  ENDFOR
+END
+""", "3\n7"),
+}
+
+
+def generate_tables(statements, seed=0, max_depth=2):
+    """
+    Random valid program storing to a table at number and variable indices, inside IFs and
+    loops, and writing all of its variables at the end. The table is small, so stores at
+    variable indices often change elements known before. Variable indices are taken modulo its
+    size and products modulo 1000, so the numbers stay small.
+    :param statements: number of statements
+    :param seed: random seed
+    :param max_depth: maximal nesting of IF, WHILE and FOR
+    :return: source code and input of the virtual machine
+    """
+    rng = random.Random(seed)
+    variables = "abcd"
+    lines = ["DECLARE a, b, c, d, q, wa, wb, wc, t(0:3)", "BEGIN", "READ a; READ b;",
+             "c := 3; d := 7;", "FOR i FROM 0 TO 3 DO t(i) := i; ENDFOR"]
+
+    def value(iterators):
+        kind = rng.randrange(5)
+        if kind == 0:
+            return str(rng.randrange(20))
+        if kind == 1:
+            return "t({})".format(rng.randrange(4))
+        if kind == 2 and iterators:
+            return "t({})".format(rng.choice(iterators))
+        return rng.choice(variables + "".join(iterators))
+
+    def block(count, depth, iterators):
+        result = []
+        while count > 0:
+            kind = rng.randrange(0 if depth < max_depth else 3, 10)
+            inner = rng.randint(1, max(1, count // 2))
+            if kind == 0:
+                cond = "{} {} {}".format(value(iterators), rng.choice(RELATIONS), value(iterators))
+                result += ["IF {} THEN".format(cond)] + block(inner, depth + 1, iterators)
+                if rng.randrange(2):
+                    result += ["ELSE"] + block(inner, depth + 1, iterators)
+                result.append("ENDIF")
+                count -= inner
+            elif kind == 1:
+                iterator = "ijk"[depth]
+                result.append("FOR {} FROM {} {} {} DO".format(
+                    iterator, rng.randrange(4), rng.choice(["TO", "DOWNTO"]), rng.randrange(4)))
+                result += block(inner, depth + 1, iterators + [iterator]) + ["ENDFOR"]
+                count -= inner
+            elif kind == 2:
+                counter = "w" + "abc"[depth]
+                result += ["{} := 0;".format(counter), "WHILE {} < 3 DO".format(counter)]
+                result += block(inner, depth + 1, iterators)
+                result += ["{0} := {0} + 1;".format(counter), "ENDWHILE"]
+                count -= inner
+            elif kind in (3, 4):
+                # a store at a variable index, then a read of an element known before it
+                result.append("q := {} % 4;".format(rng.choice(variables)))
+                stored = rng.choice([str(rng.randrange(20)), value(iterators)])
+                result.append("t(q) := {};".format(stored))
+                result.append("{0} := t({1}) + {0};".format(rng.choice(variables),
+                                                            rng.randrange(4)))
+                count -= 1
+            elif kind == 5:
+                result.append("t({}) := {};".format(rng.randrange(4), rng.randrange(20)))
+                count -= 1
+            elif kind == 6:
+                result.append("WRITE {};".format(value(iterators)))
+                count -= 1
+            else:
+                target = rng.choice(variables)
+                operator = rng.choice("+-*/%")
+                result.append("{} := {} {} {};".format(target, value(iterators), operator,
+                                                       value(iterators)))
+                if operator == "*":
+                    result.append("{0} := {0} % 1000;".format(target))
+                count -= 1
+        return result
+
+    lines += block(statements, 0, [])
+    lines += ["WRITE a; WRITE b; WRITE c; WRITE d;", "FOR i FROM 0 TO 3 DO WRITE t(i); ENDFOR",
+              "END"]
+    return "\n".join(lines) + "\n", "{}\n{}".format(rng.randrange(100), rng.randrange(100))
+
+
+def check(programs):
+    """
+    :param programs: dict name -> source, input of the virtual machine
+    :return: list of the names of the programs writing other numbers than at -O0
+    """
+    from kompilator import CompilerSession
+    from passes import OPTIMIZATION_LEVELS
+    sessions = [CompilerSession(optimization=level) for level in OPTIMIZATION_LEVELS]
+    differing = []
+    for name, (text, stdin) in programs.items():
+        reference = None
+        for session in sessions:
+            result = session.compile_source(text)
+            assert result.ok, result.diagnostics
+            written, _ = run_vm(result.code, stdin)
+            if reference is None:
+                reference = written
+            elif written != reference:
+                print("Error! {} writes {} at -O{}, {} at -O0".format(
+                    name, " ".join(written), session.options["optimization"],
+                    " ".join(reference)), file=sys.stderr)
+                differing.append(name)
+                break
+    return differing
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Compare optimized code with -O0 on the VM")
+    arg_parser.add_argument("--programs", type=int, default=100, help="random programs")
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed of the first one")
+    args = arg_parser.parse_args()
+    programs = dict(PROGRAMS)
+    programs.update(VM_PROGRAMS)
+    for seed in range(args.seed, args.seed + args.programs):
+        programs["random program {}".format(seed)] = generate_tables(30, seed)
+    differing = check(programs)
+    print("{} of {} programs write the same numbers at every level"
+          .format(len(programs) - len(differing), len(programs)))
+    sys.exit(1 if differing else 0)
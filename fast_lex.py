@@ -0,0 +1,119 @@
+import re
+
+from lex import _Lexer
+
+
+class Token(object):
+    """
+    Same fields as sly.lex.Token, filled in one constructor call.
+    """
+    __slots__ = ('type', 'value', 'lineno', 'index', 'end')
+
+    def __init__(self, _type, value, lineno, index, end):
+        self.type = _type
+        self.value = value
+        self.lineno = lineno
+        self.index = index
+        self.end = end
+
+    def __repr__(self):
+        return (f'Token(type={self.type!r}, value={self.value!r}, lineno={self.lineno}, '
+                f'index={self.index}, end={self.end})')
+
+
+def _literal_tokens():
+    """
+    Splits fixed-text rules of _Lexer into keywords and operators. Every literal is checked
+    against the sly master pattern, so a rule added to lex.py which can't be handled by a simple
+    lookup stops the import instead of silently changing tokens.
+    """
+    keywords, operators = {}, {}
+    for name, value in _Lexer._rules:
+        if name.startswith("ignore_") or name in ("PIDENTIFIER", "NUM"):
+            continue
+        literal = re.sub(r"\\(.)", r"\1", value)
+        m = _Lexer._master_re.match(literal)
+        if m is None or m.lastgroup != name or m.end() != len(literal):
+            raise ValueError("token {} can't be handled by _FastLexer".format(name))
+        if literal.isalpha() and literal.isupper():
+            keywords[literal] = name
+        else:
+            operators[literal] = name
+    return keywords, operators
+
+
+class _FastLexer(object):
+    """
+    Alternative to _Lexer for big sources. Produces exactly the same tokens and line numbers,
+    but scans the text with re.finditer over a pattern whose alternatives differ in the first
+    character, skips blanks as a part of the next match and does not call Python methods for
+    newlines and comments. Keywords and operators are recognised with a dict lookup.
+    """
+    keywords, operators = _literal_tokens()
+    master_re = re.compile(
+        r"[{ignore}]*(?:"
+        r"(?P<PIDENTIFIER>{pidentifier})"
+        r"|(?P<operator>{operators})"
+        r"|(?P<NUM>{num})"
+        r"|(?P<word>[A-Z]+)"
+        r"|(?P<newline>\n[{ignore}\n]*)"
+        r"|(?P<comment>{comment})"
+        r"|(?P<error>[^{ignore}]))".format(
+            ignore=re.escape(_Lexer.ignore),
+            pidentifier=_Lexer.PIDENTIFIER,
+            operators="|".join(re.escape(op) for op in sorted(operators, key=len, reverse=True)),
+            num=_Lexer.NUM,
+            comment=_Lexer.ignore_comment.pattern,
+        ),
+        re.DOTALL)
+    tokens = _Lexer.tokens
+
+    def __init__(self):
+        self.lineno = 1
+        self.index = 0
+
+    def tokenize(self, text, lineno=1, index=0):
+        keywords, operators = self.keywords, self.operators
+        for m in self.master_re.finditer(text, index):
+            kind = m.lastgroup
+            if kind == "PIDENTIFIER" or kind == "NUM":
+                yield Token(kind, m.group(kind), lineno, m.start(kind), m.end())
+            elif kind == "operator":
+                value = m.group(kind)
+                yield Token(operators[value], value, lineno, m.start(kind), m.end())
+            elif kind == "word":
+                value = m.group(kind)
+                if value in keywords:
+                    yield Token(keywords[value], value, lineno, m.start(kind), m.end())
+                else:
+                    # glued keywords or garbage, let the sly rules split it
+                    yield from self._split_word(text, m.start(kind), m.end(), lineno)
+            elif kind == "newline":
+                lineno += m.group(kind).count("\n")
+            elif kind == "error":
+                self._error(text, m.start(kind), lineno)
+            # comment: nothing to do, comments don't count lines in _Lexer
+        self.lineno = lineno
+        self.index = len(text)
+
+    def _split_word(self, text, start, end, lineno):
+        index = start
+        while index < end:
+            m = _Lexer._master_re.match(text, index)
+            if m is None:
+                self._error(text, index, lineno)
+                index += 1
+            else:
+                yield Token(m.lastgroup, m.group(), lineno, index, m.end())
+                index = m.end()
+
+    def _error(self, text, index, lineno):
+        # same message as _Lexer, which gets the rest of the text as token value
+        self.lineno, self.index = lineno, index
+        _Lexer.error(self, Token("ERROR", text[index:], lineno, index, None))
+
+
+LEXERS = {
+    "sly": _Lexer,
+    "fast": _FastLexer,
+}
@@ -0,0 +1,439 @@
+"""
+Constant folding and constant propagation, a pass of the "ast" stage (see passes.py).
+Arithmetic and conditions on numbers are evaluated like the virtual machine does it, on natural
+numbers. Values of Int variables and of table elements with a constant index are followed through
+the program: they are known after an assignment of a number, an IF joins the values known after
+both of its branches and a loop forgets everything assigned anywhere in it. A known value
+replaces a variable wherever generating the number is cheaper than loading the variable.
+
+Statically decided control flow is removed: an IF whose condition is known is replaced by the arm
+it takes, a WHILE or FOR which never runs its body disappears, a FOR running it once and a REPEAT
+UNTIL a true condition become the body itself.
+"""
+from ast_nodes import (NUM, INT, TAB, ADD, SUB, MUL, DIV, MOD, EQ, NEQ, LT, GT, LEQ, GEQ, ASSIGN,
+                       IF, IF_ELSE, WHILE, REPEAT, FOR_TO, FOR_DT, READ, WRITE, Num, Identifier,
+                       BinaryOperation, Assign, walk)
+from ir import const_cost
+from machine_instructions import COSTS, LOAD
+
+# results from this on aren't folded, the machine computes them on 64 bits
+WORD_LIMIT = 1 << 63
+
+
+def evaluate(kind, left, right):
+    """
+    :param kind: arithmetic operation or condition
+    :param left: number
+    :param right: number
+    :return: number, True or False for a condition
+    """
+    if kind == ADD:
+        return left + right
+    elif kind == SUB:
+        return max(left - right, 0)
+    elif kind == MUL:
+        return left * right
+    elif kind == DIV:
+        return left // right if right else 0
+    elif kind == MOD:
+        return left % right if right else 0
+    elif kind == EQ:
+        return left == right
+    elif kind == NEQ:
+        return left != right
+    elif kind == LT:
+        return left < right
+    elif kind == GT:
+        return left > right
+    elif kind == LEQ:
+        return left <= right
+    elif kind == GEQ:
+        return left >= right
+    raise ValueError("No operation {}".format(kind))
+
+
+def simplify(kind, left, right):
+    """
+    Algebraic identities with one known operand: x + 0, x - 0, x * 1, x / 1 are x; x * 0, 0 / x,
+    x % 1, 0 % x and 0 - x are 0.
+    :param kind: arithmetic operation
+    :param left: AST node of the left operand
+    :param right: AST node of the right operand
+    :return: AST node of the result or None
+    """
+    left_value = left.value if left.kind == NUM else None
+    right_value = right.value if right.kind == NUM else None
+    if right_value == 0 and kind in (ADD, SUB) or right_value == 1 and kind in (MUL, DIV):
+        return left
+    if left_value == 0 and kind == ADD or left_value == 1 and kind == MUL:
+        return right
+    if (left_value == 0 and kind in (SUB, MUL, DIV, MOD)
+            or right_value == 0 and kind == MUL or right_value == 1 and kind == MOD):
+        return Num(0, left.lineno, left.index, right.end)
+    return None
+
+
+def condition_value(condition):
+    """
+    :param condition: condition node
+    :return: True or False if it compares two numbers, None otherwise
+    """
+    left, right = condition.left, condition.right
+    if left.kind == right.kind == NUM and left.value < WORD_LIMIT and right.value < WORD_LIMIT:
+        return evaluate(condition.kind, left.value, right.value)
+    return None
+
+
+def constant_condition(truth, node):
+    """
+    The cheapest condition with the given value: 1 > 0 or 0 > 0.
+    """
+    return BinaryOperation(GT, Num(1 if truth else 0, node.lineno, node.index, node.end),
+                           Num(0, node.lineno, node.index, node.end),
+                           node.lineno, node.index, node.end)
+
+
+def _assigned_key(lvalue):
+    """
+    :return: what an assignment to lvalue changes: Int, (Tab, index) or the whole Tab
+    """
+    if lvalue.kind == INT:
+        return lvalue.var
+    index = lvalue.index_value
+    if index.kind == NUM:
+        return lvalue.var, index.value
+    return lvalue.var
+
+
+class ConstantFolder(object):
+    """
+    The pass. It keeps the known values between calls, so a program compiled command by command
+    (Compiler.stream_command) gets the same code as a whole one; clear forgets them.
+    ints - dict Int -> value, elements - dict Tab -> dict index -> value
+    """
+    def __init__(self):
+        self.ints = {}
+        self.elements = {}
+        self.assigned = {}  # id of a loop -> keys assigned in it, see _assigned_key
+        self.replacements = {}  # id of a command -> list of commands replacing it
+        self.counts = {}
+        self.operation = {
+            ASSIGN: self.assign,
+            WRITE: self.write,
+            READ: self.read,
+            IF: self.if_endif,
+            IF_ELSE: self.if_else_endif,
+            WHILE: self.loop,
+            REPEAT: self.repeat_until_loop,
+            FOR_TO: self.for_loop,
+            FOR_DT: self.for_loop,
+        }
+
+    def clear(self):
+        self.ints = {}
+        self.elements = {}
+
+    def __call__(self, commands):
+        """
+        :param commands: list of commands, annotated by SemanticAnalyzer
+        :return: dict of counters
+        """
+        self.counts = {"folded": 0, "propagated": 0, "branches": 0, "loops": 0}
+        self.collect_assigned(commands)
+        walk(commands, self.operation)
+        if self.replacements:
+            self.splice(commands)
+        self.assigned = {}
+        self.replacements = {}
+        return self.counts
+
+    # STATE
+
+    def collect_assigned(self, commands):
+        """
+        Fills self.assigned for every loop in commands, in one walk.
+        """
+        stack = []
+
+        def assignment(ast_node):
+            if stack:
+                stack[-1].add(_assigned_key(ast_node.lvalue))
+
+        def body(ast_node):
+            yield ast_node.commands
+            if ast_node.kind == IF_ELSE:
+                yield ast_node.else_commands
+
+        def loop(ast_node):
+            stack.append(set())
+            yield ast_node.commands
+            keys = stack.pop()
+            self.assigned[id(ast_node)] = keys
+            if stack:
+                stack[-1] |= keys
+
+        walk(commands, {ASSIGN: assignment, READ: assignment, WRITE: lambda ast_node: None,
+                        IF: body, IF_ELSE: body, WHILE: loop, REPEAT: loop, FOR_TO: loop,
+                        FOR_DT: loop})
+
+    def splice(self, commands):
+        """
+        Puts the replacements in place of the commands in all the lists of commands, which are
+        changed in place.
+        """
+        replacements = self.replacements
+        stack = [commands]
+        while stack:
+            commands = stack.pop()
+            if any(id(ast_node) in replacements for ast_node in commands):
+                spliced = []
+                pending = commands[::-1]
+                while pending:
+                    ast_node = pending.pop()
+                    replacement = replacements.get(id(ast_node))
+                    if replacement is None:
+                        spliced.append(ast_node)
+                    else:
+                        pending.extend(replacement[::-1])
+                commands[:] = spliced
+            for ast_node in commands:
+                if ast_node.kind in (IF, IF_ELSE, WHILE, REPEAT, FOR_TO, FOR_DT):
+                    stack.append(ast_node.commands)
+                    if ast_node.kind == IF_ELSE:
+                        stack.append(ast_node.else_commands)
+
+    def state(self):
+        return dict(self.ints), dict((tab, dict(values)) for tab, values in self.elements.items())
+
+    def restore(self, state):
+        self.ints, self.elements = state
+
+    def join(self, state):
+        """
+        Keeps the values which are the same in the current state and in the given one.
+        """
+        ints, elements = state
+        self.ints = dict((var, value) for var, value in self.ints.items()
+                         if var in ints and ints[var] == value)
+        joined = {}
+        for tab, values in self.elements.items():
+            other = elements.get(tab)
+            if other:
+                common = dict((index, value) for index, value in values.items()
+                              if index in other and other[index] == value)
+                if common:
+                    joined[tab] = common
+        self.elements = joined
+
+    def forget(self, keys):
+        for key in keys:
+            if isinstance(key, tuple):
+                values = self.elements.get(key[0])
+                if values is not None:
+                    values.pop(key[1], None)
+            elif key.type == "tab":
+                self.elements.pop(key, None)
+            else:
+                self.ints.pop(key, None)
+
+    def set_value(self, lvalue, value):
+        """
+        :param lvalue: Identifier or TabElement
+        :param value: its new value or None if it isn't known
+        """
+        key = _assigned_key(lvalue)
+        if value is None or lvalue.kind == TAB and not isinstance(key, tuple):
+            # an element at an unknown index may be any of the known ones
+            self.forget((key,))
+        elif isinstance(key, tuple):
+            self.elements.setdefault(key[0], {})[key[1]] = value
+        else:
+            self.ints[key] = value
+
+    def known_value(self, ast_node):
+        """
+        :return: value of a Num, Identifier or TabElement, None if it isn't known
+        """
+        if ast_node.kind == NUM:
+            return ast_node.value
+        if ast_node.kind == INT:
+            return self.ints.get(ast_node.var)
+        index = self.known_value(ast_node.index_value)
+        if index is None:
+            return None
+        return self.elements.get(ast_node.var, {}).get(index)
+
+    # REWRITING
+
+    def fold_index(self, ast_node):
+        """
+        Makes the index of a table element a number if it's known and inside the table.
+        """
+        if ast_node.kind != TAB or ast_node.index_value.kind != INT:
+            return
+        index = self.ints.get(ast_node.index_value.var)
+        tab = ast_node.var
+        if index is not None and tab.start_index <= index <= tab.end_index:
+            old = ast_node.index_value
+            ast_node.index_value = Num(index, old.lineno, old.index, old.end)
+            self.counts["propagated"] += 1
+
+    def fold_value(self, ast_node):
+        """
+        :param ast_node: Num, Identifier or TabElement
+        :return: the node or a Num of its value, if the number is cheaper than the load
+        """
+        if ast_node.kind == NUM:
+            return ast_node
+        self.fold_index(ast_node)
+        value = self.known_value(ast_node)
+        if value is None:
+            return ast_node
+        if ast_node.kind == INT:
+            address = ast_node.var.address
+        elif ast_node.index_value.kind == NUM:
+            address = ast_node.var.get_element_address(ast_node.index_value.value)
+        else:
+            return ast_node
+        if const_cost(value) > const_cost(address) + COSTS[LOAD]:
+            return ast_node
+        self.counts["propagated"] += 1
+        return Num(value, ast_node.lineno, ast_node.index, ast_node.end)
+
+    def fold_expression(self, ast_node):
+        """
+        :param ast_node: value or arithmetic operation
+        :return: the node, a simpler one or a Num
+        """
+        if ast_node.kind in (NUM, INT, TAB):
+            return self.fold_value(ast_node)
+        left, right = ast_node.left, ast_node.right
+        self.fold_index(left)
+        self.fold_index(right)
+        left_value, right_value = self.known_value(left), self.known_value(right)
+        if left_value is not None and right_value is not None \
+                and left_value < WORD_LIMIT and right_value < WORD_LIMIT:
+            value = evaluate(ast_node.kind, left_value, right_value)
+            if value < WORD_LIMIT:
+                self.counts["folded"] += 1
+                return Num(value, ast_node.lineno, ast_node.index, ast_node.end)
+        ast_node.left, ast_node.right = self.fold_value(left), self.fold_value(right)
+        simpler = simplify(ast_node.kind, ast_node.left, ast_node.right)
+        if simpler is not None:
+            self.counts["folded"] += 1
+            return simpler
+        return ast_node
+
+    def decide(self, condition):
+        """
+        :return: True or False if the condition is known in the current state, None otherwise
+        """
+        left_value = self.known_value(condition.left)
+        right_value = self.known_value(condition.right)
+        if left_value is not None and right_value is not None \
+                and left_value < WORD_LIMIT and right_value < WORD_LIMIT:
+            return evaluate(condition.kind, left_value, right_value)
+        return None
+
+    def fold_condition(self, ast_node):
+        """
+        :param ast_node: IF, loop with a condition
+        :return: value of the condition, None if it isn't known
+        """
+        condition = ast_node.condition
+        self.fold_index(condition.left)
+        self.fold_index(condition.right)
+        truth = self.decide(condition)
+        if truth is not None:
+            ast_node.condition = constant_condition(truth, condition)
+            self.counts["folded"] += 1
+        else:
+            condition.left = self.fold_value(condition.left)
+            condition.right = self.fold_value(condition.right)
+        return truth
+
+    def replace(self, ast_node, commands, counter):
+        self.replacements[id(ast_node)] = commands
+        self.counts[counter] += 1
+
+    # COMMANDS
+
+    def assign(self, ast_node):
+        self.fold_index(ast_node.lvalue)
+        ast_node.rvalue = self.fold_expression(ast_node.rvalue)
+        rvalue = ast_node.rvalue
+        self.set_value(ast_node.lvalue, rvalue.value if rvalue.kind == NUM else None)
+
+    def read(self, ast_node):
+        self.fold_index(ast_node.lvalue)
+        self.set_value(ast_node.lvalue, None)
+
+    def write(self, ast_node):
+        # a variable is written straight from its cell, a number has to be stored first
+        self.fold_index(ast_node.value)
+
+    def if_endif(self, ast_node):
+        truth = self.fold_condition(ast_node)
+        if truth is not None:
+            self.replace(ast_node, ast_node.commands if truth else [], "branches")
+            if truth:
+                yield ast_node.commands
+            return
+        before = self.state()
+        yield ast_node.commands
+        self.join(before)
+
+    def if_else_endif(self, ast_node):
+        truth = self.fold_condition(ast_node)
+        if truth is not None:
+            taken = ast_node.commands if truth else ast_node.else_commands
+            self.replace(ast_node, taken, "branches")
+            yield taken
+            return
+        before = self.state()
+        yield ast_node.commands
+        after_if = self.state()
+        self.restore(before)
+        yield ast_node.else_commands
+        self.join(after_if)
+
+    def loop(self, ast_node):
+        if self.decide(ast_node.condition) is False:
+            self.replace(ast_node, [], "loops")
+            return
+        self.forget(self.assigned[id(ast_node)])
+        self.fold_condition(ast_node)
+        entry = self.state()
+        yield ast_node.commands
+        self.restore(entry)  # the loop is left from its condition
+
+    def repeat_until_loop(self, ast_node):
+        self.forget(self.assigned[id(ast_node)])
+        yield ast_node.commands
+        if self.fold_condition(ast_node):
+            self.replace(ast_node, ast_node.commands, "loops")
+
+    def for_loop(self, ast_node):
+        start, stop = self.known_value(ast_node.start), self.known_value(ast_node.stop)
+        if start is not None and stop is not None and start < WORD_LIMIT and stop < WORD_LIMIT:
+            if ast_node.kind == FOR_TO and start > stop or ast_node.kind == FOR_DT and start < stop:
+                self.replace(ast_node, [], "loops")
+                return
+            if start == stop:
+                iterator = Identifier(ast_node.iterator, ast_node.lineno, ast_node.index,
+                                      ast_node.end)
+                iterator.var = ast_node.iterator_var
+                number = Num(start, ast_node.lineno, ast_node.index, ast_node.end)
+                self.replace(ast_node, [Assign(iterator, number, ast_node.lineno, ast_node.index,
+                                               ast_node.end)] + ast_node.commands, "loops")
+                self.ints[ast_node.iterator_var] = start
+                yield ast_node.commands
+                self.ints.pop(ast_node.iterator_var, None)
+                return
+        ast_node.start = self.fold_value(ast_node.start)
+        ast_node.stop = self.fold_value(ast_node.stop)
+        self.forget(self.assigned[id(ast_node)])
+        self.ints.pop(ast_node.iterator_var, None)
+        entry = self.state()
+        yield ast_node.commands
+        self.restore(entry)
@@ -0,0 +1,97 @@
+"""
+Fusion of divisions: the loop of Compiler.div computes both the quotient and the remainder, so of
+a := x / y and later b := x % y (or the other way round) in one straight-line list of commands,
+with x and y not changed in between, the first one is a FusedDivision which also stores the
+other result to a temporary cell and the second one only loads it. A pass of the "ast" stage.
+"""
+from ast_nodes import (NUM, INT, TAB, DIV, MOD, ASSIGN, READ, IF, IF_ELSE, WHILE, REPEAT, FOR_TO,
+                       FOR_DT, Identifier, FusedDivision)
+from arithmetic import power_of_two
+
+COMPOUND = (IF, IF_ELSE, WHILE, REPEAT, FOR_TO, FOR_DT)
+
+
+def temporary_identifier(temporary, ast_node):
+    """
+    :param temporary: Int from VariableManager.new_temporary
+    :param ast_node: node whose position the identifier gets
+    :return: Identifier of the temporary, with a name no source can have
+    """
+    identifier = Identifier("temporary{}".format(temporary.address), ast_node.lineno,
+                            ast_node.index, ast_node.end)
+    identifier.var = temporary
+    return identifier
+
+
+def reads(ast_value, lvalue):
+    """
+    :param ast_value: Num, Identifier or TabElement
+    :param lvalue: Identifier or TabElement assigned
+    :return: whether the value may change with the assignment
+    """
+    if ast_value.kind == NUM:
+        return False
+    if lvalue.kind == TAB:
+        return ast_value.kind == TAB and ast_value.name == lvalue.name
+    if ast_value.kind == INT:
+        return ast_value.name == lvalue.name
+    return ast_value.index_value.kind == INT and ast_value.index_value.name == lvalue.name
+
+
+class DivisionFusion(object):
+    """
+    The pass, temporaries come from variables, the VariableManager of the compiler.
+    """
+    def __init__(self, variables):
+        self.variables = variables
+
+    def __call__(self, commands):
+        fused = 0
+        stack = [commands]
+        while stack:
+            commands = stack.pop()
+            divisions = {}  # keys of operands -> Assign of the division
+            for i, ast_node in enumerate(commands):
+                if ast_node.kind in COMPOUND:
+                    divisions.clear()
+                    stack.append(ast_node.commands)
+                    if ast_node.kind == IF_ELSE:
+                        stack.append(ast_node.else_commands)
+                    continue
+                if ast_node.kind == ASSIGN and self.fusible(ast_node.rvalue):
+                    rvalue = ast_node.rvalue
+                    key = rvalue.left.key(), rvalue.right.key()
+                    first = divisions.pop(key, None)
+                    if first is not None and first.rvalue.kind != rvalue.kind:
+                        self.fuse(first, ast_node)
+                        fused += 1
+                    else:
+                        divisions[key] = ast_node
+                if ast_node.kind in (ASSIGN, READ):
+                    lvalue = ast_node.lvalue
+                    for key, division in list(divisions.items()):
+                        operation = division.rvalue
+                        if reads(operation.left, lvalue) or reads(operation.right, lvalue):
+                            del divisions[key]
+        return {"fused": fused}
+
+    @staticmethod
+    def fusible(rvalue):
+        """
+        :return: whether the division loop computes rvalue, which is not a number already
+        """
+        if rvalue.kind not in (DIV, MOD) or rvalue.left.kind == NUM:
+            return False
+        right = rvalue.right
+        return right.kind != NUM or right.value and power_of_two(right.value) is None
+
+    def fuse(self, first, second):
+        """
+        :param first: Assign computing both results
+        :param second: Assign of the other result, later in the same list
+        """
+        operation = first.rvalue
+        temporary = self.variables.new_temporary(operation.lineno)
+        first.rvalue = FusedDivision(operation.kind, operation.left, operation.right, temporary,
+                                     operation.lineno, operation.index, operation.end)
+        second.rvalue = temporary_identifier(temporary, second.rvalue)
@@ -0,0 +1,319 @@
+"""
+Intermediate representation between Compiler and MachineInstructions: machine code in basic
+blocks with a control flow graph, where optimization passes (see passes.py) can change it before
+it's lowered to the final instructions.
+
+An instruction is encoded like in machine_instructions (encode, decode), with one more opcode,
+CONST x n, which sets register x to n and is lowered to RESET, INC and SHL. A number too big for
+the operand is kept in IRCode.big_values, its CONST has BIG in place of register y and the index
+of the number as the operand (see IRCode.const_value). Loads and stores are
+explicit, their addresses usually come from a CONST. A jump ends its block, its operand is a label
+and every label starts a block, so the successors of a block are the blocks of the labels of its
+last instruction and the next block, if the last one can fall through.
+
+There are no virtual registers: registers are the six machine registers chosen by the handlers
+of Compiler, which use all of them inside one command (div needs five besides the result), and
+no value is kept in a register from one command to the next. Lowering is then a plain copy, so
+the code at -O0 is exactly the code of the handlers. Passes which keep values longer find the
+registers a stretch of code leaves alone by scanning it, or keep the values in memory cells.
+"""
+from array import array
+
+from machine_instructions import (X, Y, GET, PUT, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL,
+                                  JUMP, JZERO, JODD, HALT, X_SHIFT, Y_SHIFT, OPERAND_SHIFT)
+
+CONST = 15
+BIG = 7 << Y_SHIFT
+CONST_LIMIT = 1 << 63 - OPERAND_SHIFT  # CONSTs of bigger numbers are BIG
+GENERATING = " (generating {})"
+REGISTER_NAMES = "ABCDEF"
+
+
+class Block(object):
+    """
+    Basic block. label - label starting the block or None, code - array of encoded instructions,
+    lines - flat pairs: index of an instruction in code, source line of the code from it onwards,
+    consts - indexes of the CONST instructions in code. A pass changing code gives the new code
+    to set_code, which keeps them right.
+    """
+    __slots__ = ('label', 'code', 'lines', 'consts')
+
+    def __init__(self, label=None):
+        self.label = label
+        self.code = array('q')
+        self.lines = array('q')
+        self.consts = array('q')
+
+    def set_code(self, code, lines):
+        """
+        :param code: array of encoded instructions
+        :param lines: array of flat pairs like lines, with indexes in the new code
+        :return:
+        """
+        self.code = code
+        self.lines = lines
+        self.consts = array('q', [i for i, instruction in enumerate(code)
+                                  if instruction & 15 == CONST])
+
+    def last(self):
+        """
+        :return: opcode of the last instruction or None if the block is empty
+        """
+        return self.code[-1] & 15 if self.code else None
+
+    def falls_through(self):
+        return self.last() not in (JUMP, HALT)
+
+
+class IRCode(object):
+    """
+    Blocks of the code being compiled, in the order of the output. It has the emitting methods of
+    MachineInstructions, so the handlers of Compiler use it the same way.
+    """
+    def __init__(self):
+        self.blocks = [Block()]
+        self.current = self.blocks[0]
+        self.label_count = 0
+        self.label_blocks = {}  # label -> Block
+        self.big_values = []
+
+    def clear(self):
+        self.blocks = [Block()]
+        self.current = self.blocks[0]
+        self.label_count = 0
+        self.label_blocks = {}
+        self.big_values = []
+
+    def __len__(self):
+        return sum(len(block.code) for block in self.blocks)
+
+    # BUILDING
+
+    def _new_block(self, label=None):
+        self.current = Block(label)
+        self.blocks.append(self.current)
+
+    def new_label(self):
+        self.label_count += 1
+        return self.label_count - 1
+
+    def put_label(self, label):
+        if not self.current.code and self.current.label is None:
+            self.current.label = label  # a block after a jump
+        else:
+            self._new_block(label)
+        self.label_blocks[label] = self.current
+
+    def mark_line(self, line):
+        lines = self.current.lines
+        if not lines or lines[-1] != line:
+            lines.extend((len(self.current.code), line))
+
+    def const(self, x, value):
+        code = self.current.code
+        self.current.consts.append(len(code))
+        if value < CONST_LIMIT:
+            code.append(CONST | X[x] | value << OPERAND_SHIFT)
+        else:
+            code.append(CONST | X[x] | BIG | len(self.big_values) << OPERAND_SHIFT)
+            self.big_values.append(value)
+
+    def const_value(self, instruction):
+        """
+        :param instruction: encoded CONST
+        :return: the number it sets
+        """
+        if instruction & BIG == BIG:
+            return self.big_values[instruction >> OPERAND_SHIFT]
+        return instruction >> OPERAND_SHIFT
+
+    def get(self, x):
+        self.current.code.append(GET | X[x])
+
+    def put(self, x):
+        self.current.code.append(PUT | X[x])
+
+    def load(self, x, y):
+        self.current.code.append(LOAD | X[x] | Y[y])
+
+    def store(self, x, y):
+        self.current.code.append(STORE | X[x] | Y[y])
+
+    def add(self, x, y):
+        self.current.code.append(ADD | X[x] | Y[y])
+
+    def sub(self, x, y):
+        self.current.code.append(SUB | X[x] | Y[y])
+
+    def reset(self, x):
+        self.current.code.append(RESET | X[x])
+
+    def inc(self, x):
+        self.current.code.append(INC | X[x])
+
+    def dec(self, x):
+        self.current.code.append(DEC | X[x])
+
+    def shr(self, x):
+        self.current.code.append(SHR | X[x])
+
+    def shl(self, x):
+        self.current.code.append(SHL | X[x])
+
+    def jump(self, j):
+        self.current.code.append(JUMP | j << OPERAND_SHIFT)
+        self._new_block()
+
+    def jzero(self, x, j):
+        self.current.code.append(JZERO | X[x] | j << OPERAND_SHIFT)
+        self._new_block()
+
+    def jodd(self, x, j):
+        self.current.code.append(JODD | X[x] | j << OPERAND_SHIFT)
+        self._new_block()
+
+    def halt(self):
+        self.current.code.append(HALT)
+        self._new_block()
+
+    def move_code(self, start, position):
+        """
+        Moves the code emitted from blocks[start] on before blocks[position], for code laid out
+        before code emitted earlier. The current block, which is empty, stays the last one.
+        """
+        moved = self.blocks[start:-1]
+        del self.blocks[start:-1]
+        self.blocks[position:position] = moved
+
+    def registers(self, start=0):
+        """
+        :param start: index of the first block of the stretch of code
+        :return: set of names of the registers which the code of blocks[start:] uses
+        """
+        used = 0
+        for block in self.blocks[start:]:
+            for instruction in block.code:
+                used |= 1 << (instruction >> X_SHIFT & 7)
+                if LOAD <= instruction & 15 <= SUB:
+                    used |= 1 << (instruction >> Y_SHIFT & 7)
+        return set(name for name in REGISTER_NAMES if used >> (X[name] >> X_SHIFT) & 1)
+
+    # CONTROL FLOW GRAPH
+
+    def successors(self):
+        """
+        :return: list of successors of every block, by indexes in blocks
+        """
+        blocks = self.blocks
+        position = dict((id(block), i) for i, block in enumerate(blocks))
+        label_position = dict((label, position[id(block)])
+                              for label, block in self.label_blocks.items())
+        successors = []
+        append = successors.append
+        last_index = len(blocks) - 1
+        for i, block in enumerate(blocks):
+            code = block.code
+            last = code[-1] & 15 if code else None
+            if last is None or last < JUMP or last == CONST:
+                append((i + 1,) if i < last_index else ())
+            elif last == HALT:
+                append(())
+            elif last == JUMP:
+                append((label_position[code[-1] >> OPERAND_SHIFT],))
+            else:
+                target = label_position[code[-1] >> OPERAND_SHIFT]
+                append((target, i + 1) if i < last_index else (target,))
+        return successors
+
+    def control_flow_graph(self):
+        """
+        :return: lists of successors and of predecessors of every block, by indexes in blocks
+        """
+        successors = self.successors()
+        predecessors = [[] for _ in self.blocks]
+        for i, following in enumerate(successors):
+            for j in following:
+                predecessors[j].append(i)
+        return successors, predecessors
+
+    # LOWERING
+
+    def lower(self, instructions):
+        """
+        Appends the code to MachineInstructions, with CONSTs expanded and the labels kept.
+        :param instructions: MachineInstructions
+        :return:
+        """
+        code, debug, jumps = instructions.code, instructions.debug, instructions.jumps
+        labels = instructions.labels
+        labels.extend([-1] * (self.label_count - len(labels)))
+        expansions = {}
+        mark_line = instructions.mark_line
+        extend = code.extend
+        for block in self.blocks:
+            if block.label is not None:
+                labels[block.label] = len(code)
+            block_code, marks, consts = block.code, block.lines, block.consts
+            end = len(block_code)
+            if not end:
+                for m in range(1, len(marks), 2):
+                    mark_line(marks[m])
+                continue
+            if not marks and not consts:
+                extend(block_code)
+            else:
+                # code between CONSTs and line marks is copied as it is
+                marks_end, consts_end = len(marks), len(consts)
+                start = m = c = 0
+                while True:
+                    next_mark = marks[m] if m < marks_end else end
+                    next_const = consts[c] if c < consts_end else end
+                    if next_mark <= next_const:
+                        extend(block_code[start:next_mark])
+                        if m == marks_end:
+                            break
+                        mark_line(marks[m + 1])
+                        start = next_mark
+                        m += 2
+                    else:
+                        extend(block_code[start:next_const])
+                        instruction = block_code[next_const]
+                        try:
+                            expansion, comment = expansions[instruction]
+                        except KeyError:
+                            expansion, comment = expansions[instruction] = _expand(
+                                instruction, self.const_value(instruction))
+                        debug[len(code)] = comment
+                        extend(expansion)
+                        start = next_const + 1
+                        c += 1
+            if JUMP <= block_code[-1] & 15 <= JODD:
+                jumps.append(len(code) - 1)
+
+
+def const_cost(value):
+    """
+    :return: cost of the instructions a CONST of the value is lowered to, see _expand
+    """
+    if value == 0:
+        return 1
+    return value.bit_length() + bin(value).count("1")
+
+
+def _expand(instruction, value):
+    """
+    Instructions generating a number in a register, by left shifts and incrementations according
+    to its binary representation.
+    :param instruction: encoded CONST
+    :param value: the number
+    :return: array of encoded instructions and the debug comment of the first one
+    """
+    register = instruction & 7 << X_SHIFT
+    expansion = array('q', [RESET | register])
+    if value >= 1:
+        expansion.append(INC | register)
+        for bit in bin(value)[3:]:  # strip '0b' and first '1' - it's added already!
+            expansion.append(SHL | register)
+            if bit == "1":
+                expansion.append(INC | register)
+    return expansion, GENERATING.format(value)
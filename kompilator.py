@@ -1,39 +1,107 @@
+import argparse
+import contextlib
+import gc
+import io
+import os
+import shutil
 import sys
+import tempfile
+import time
+import traceback
 
 from registers import Register, RegisterManager
-from machine_instructions import MachineInstructions
+from machine_instructions import MachineInstructions, write_lines
+from ir import IRCode
+from passes import OPTIMIZATION_LEVELS, default_passes
+from folding import WORD_LIMIT, condition_value
+from arithmetic import DRIVER_BOUND, power_of_two, multiplier_digits
 from variable_types import Int, Tab, VariableManager
+from semantic import SemanticAnalyzer
+from ast_nodes import (NUM, INT, TAB, ADD, SUB, MUL, DIV, MOD, EQ, NEQ, LT, GT, LEQ, GEQ, ASSIGN,
+                       IF, IF_ELSE, WHILE, REPEAT, FOR_TO, FOR_DT, READ, WRITE, INT_DECLARATION,
+                       TAB_DECLARATION, ARITHMETIC, SYMBOLS, walk)
 from parser import _Parser
-from lex import _Lexer
+from fast_lex import LEXERS
+from compile_cache import CompileCache
+from object_format import assemble, dump
+
+ARITHMETIC_KINDS = frozenset(ARITHMETIC.values())
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Code generation makes no reference cycles, but it makes an IR block for every jump and label.
+    With the garbage collector on, these allocations start collections which go through the
+    whole AST again and again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
 class Compiler(object):
-    def __init__(self, ast, output):
+    def __init__(self, ast=None, output=None, optimization=0):
+        """
+        :param ast: Program node
+        :param output: path of the output file or None
+        :param optimization: optimization level, see passes.default_passes
+        """
         self.ast = ast
         self.output_file = output
         self.nesting = {}
         self.error = False
+        self.stream = None
+        self.declared = False
         self.Registers = RegisterManager()
+        self.bounds = {}  # Int of an iterator -> bound of its values, see bound
         self.Variables = VariableManager()
         self.Instructions = MachineInstructions()
+        self.IR = IRCode()
+        self.passes = default_passes(optimization, self.Variables)
+        self.Analyzer = SemanticAnalyzer(self.Variables)
         self.operation = {
-            'ASSIGN': self.assign,
-            'WRITE': self.write,
-            'READ': self.read,
-            'IF': self.if_endif,
-            'IF_ELSE': self.if_else_endif,
-            'WHILE': self.while_loop,
-            'REPEAT': self.repeat_until_loop,
-            'FOR_TO': self.for_to_loop,
-            'FOR_DT': self.for_downto_loop,
+            ASSIGN: self.assign,
+            WRITE: self.write,
+            READ: self.read,
+            IF: self.if_endif,
+            IF_ELSE: self.if_else_endif,
+            WHILE: self.rotated_loop if self.passes.level else self.while_loop,
+            REPEAT: self.repeat_until_loop,
+            FOR_TO: self.counted_loop if self.passes.level else self.for_to_loop,
+            FOR_DT: self.counted_loop if self.passes.level else self.for_downto_loop,
         }
+        self.loaded = set()  # Ints whose values the code reads, see counted_loop
 
     """
     BASIC COMPILER FUNCTIONS ######################################################################
     """
 
     def check_errors(self):
-        return bool(self.error + self.Variables.error)
+        return bool(self.error + self.Variables.error + self.Analyzer.error)
+
+    def reset(self, ast=None, output=None):
+        """
+        Brings the compiler back to its initial state, so one object can compile many programs.
+        """
+        self.ast = ast
+        self.output_file = output
+        self.nesting.clear()
+        self.error = False
+        self.stream = None
+        self.declared = False
+        self.Registers.clear()
+        self.bounds.clear()
+        self.loaded.clear()
+        self.Variables.clear()
+        self.Analyzer.clear()
+        self.IR.clear()
+        self.passes.clear()
+        self.Instructions.clear()
 
     def compile(self, ast):
         if ast is None:
@@ -42,78 +110,148 @@ class Compiler(object):
         # PROGRAM token is redundant now
 
         # fetch declarations and instructions
-        declarations = ast[1]
-        ast_instructions = ast[2]
+        declarations = ast.declarations
+        ast_instructions = ast.commands
 
         self.run_preprocessor(ast_instructions)
         # handle declarations if there are any
         if declarations:
             self.make_declarations(declarations)
-        if ast_instructions:
-            self.make_instructions(ast_instructions)
-        self.Instructions.halt()
-        self.Instructions.remove_labels()
-        if not self.check_errors():
-            with open(self.output_file, 'w') as f:
-                for instr in self.Instructions.instructions:
-                    print(instr, file=f)
+        # the code is generated only from a valid, annotated AST
+        with gc_paused():
+            if ast_instructions and self.Analyzer.analyze(ast_instructions) \
+                    and not self.check_errors():
+                self.passes.run("ast", ast_instructions)
+                self.make_instructions(ast_instructions)
+            self.IR.halt()
+            self.lower()
+            self.Instructions.resolve_labels()
+        if not self.check_errors() and self.output_file is not None:
+            with open(self.output_file, 'wb') as f:
+                self.Instructions.write(f)
 
     def check_nesting(self, ast_instructions, nesting=0):
-        for ast_instr in ast_instructions:
-            instr_type = ast_instr[0]
-            if instr_type in ['FOR_TO', 'FOR_DT']:
-                nesting += 1
-                nesting += self.check_nesting(ast_instr[4])
+        stack = [ast_instructions]
+        while stack:
+            for ast_instr in stack.pop():
+                if ast_instr.kind in (FOR_TO, FOR_DT):
+                    nesting += 1
+                    stack.append(ast_instr.commands)
         return nesting
 
     def run_preprocessor(self, ast_instructions):
         for i, ast_instr in enumerate(ast_instructions):
-            instr_type = ast_instr[0]
-            if instr_type in ['FOR_TO', 'FOR_DT']:
-                self.nesting[i] = self.check_nesting(ast_instr[4])
+            if ast_instr.kind in (FOR_TO, FOR_DT):
+                self.nesting[i] = self.check_nesting(ast_instr.commands)
+        self.reserve_iterator_cells()
+
+    def scan_nesting(self, tokens):
+        """
+        Fills self.nesting with the same numbers as run_preprocessor, but from tokens instead of
+        the AST, so iterator cells can be reserved before the first command is parsed. Like
+        check_nesting, only loops reached from a top-level FOR through other FOR loops count.
+        :param tokens: tokens of the whole program
+        :return:
+        """
+        blocks = []  # open FOR, IF, WHILE and REPEAT
+        other_blocks = 0  # how many of them are not FOR
+        for token in tokens:
+            kind = token.type
+            if kind in ('FOR', 'IF', 'WHILE', 'REPEAT'):
+                if kind != 'FOR':
+                    other_blocks += 1
+                elif not blocks:
+                    self.nesting[len(self.nesting)] = 0
+                elif not other_blocks:
+                    self.nesting[len(self.nesting) - 1] += 1
+                blocks.append(kind)
+            elif kind in ('ENDFOR', 'ENDIF', 'ENDWHILE', 'UNTIL') and blocks:
+                if blocks.pop() != 'FOR':
+                    other_blocks -= 1
+        self.reserve_iterator_cells()
+
+    def reserve_iterator_cells(self):
         if self.nesting:
             max_iterators = 2 * (1 + max([self.nesting[k] for k in self.nesting.keys()]))
             self.Variables.Memory.iterators_cells = max_iterators
             self.Variables.Memory.memory += [max_iterators + 2]
 
     """
-    ITERATOR FUNCTIONS ############################################################################
+    STREAMING FUNCTIONS ###########################################################################
     """
 
-    def declare_iterator(self, name, ast_init_rvalue, line, register="A", buffer2="F"):
+    def start_stream(self, stream, tokens):
         """
-        Creates new int iterator variable with given name. Checks if init value is valid. Generates
-        instructions which store the iterator and its value. In the end the value of iterator
-        remains in :register: and its address remains in :buffer2:.
-        :param name: Name of given iterator
-        :param ast_init_rvalue: AST tuple with initial value info for iterator
-        :param line: line number
-        :param register: register in which the init value will be stored
-        :param buffer2: register in which the iterators address will be stored
+        Starts a compilation in which top-level commands are compiled one by one, as soon as the
+        parser reduces them (stream_command is the _Parser.command_handler). Code of a finished
+        command has all its labels inside, so it is resolved and written to the stream right away
+        and only the biggest top-level command is kept in memory.
+        Iterator cells are reserved from a scan of the tokens, the code is the same as from
+        compile() up to -O1. Passes of -O2 see one top-level command at a time, so they don't
+        combine code of two of them.
+        :param stream: text or binary file for the machine code, nothing more is written after an
+                       error
+        :param tokens: tokens of the whole program for scan_nesting
         :return:
         """
-        self.check_rvalue(ast_init_rvalue)
-        self.Variables.new_iterator(name, line)
-        iterator = self.Variables[name]
-        if not iterator.is_iterator:
-            raise Exception("NOT AN ITERATOR")
-        address = self.Variables.get_iterator_address(name)
-        self.store_value_in_reg(ast_init_rvalue, register=register, buffer=buffer2)
-        self.generate_value(buffer2, address)
-        self.Instructions.store(register, buffer2)  # iterator starting value remains in register
+        self.reset()
+        self.stream = stream
+        self.declared = False
+        self.scan_nesting(tokens)
+
+    def stream_command(self, declarations, command):
+        if not self.declared:
+            if declarations:
+                self.make_declarations(declarations)
+            self.declared = True
+        # after the first error commands are only checked, for the messages
+        commands = [command]
+        if self.Analyzer.analyze(commands) and not self.check_errors():
+            self.passes.run("ast", commands)
+            self.make_instructions(commands)
+        self.flush_stream()
+
+    def flush_stream(self):
+        if not self.check_errors():
+            self.lower()
+            self.Instructions.resolve_labels()
+            self.Instructions.write(self.stream)
+        self.IR.clear()
+        self.Instructions.clear()
 
-    def delete_iterator(self, name):
+    def finish_stream(self):
+        """
+        :return: True if the whole program was compiled without errors
         """
-        Undeclares iterator with given name
-        :param name: iterator name
+        self.IR.halt()
+        self.flush_stream()
+        ok = not self.check_errors()
+        self.reset()
+        return ok
+
+    """
+    ITERATOR FUNCTIONS ############################################################################
+    """
+
+    def declare_iterator(self, iterator, ast_init_rvalue, register="A", buffer2="F"):
+        """
+        Generates instructions which store the iterator and its init value. The iterator itself is
+        declared by SemanticAnalyzer. In the end the value of iterator remains in :register: and
+        its address remains in :buffer2:.
+        :param iterator: Int of the iterator
+        :param ast_init_rvalue: AST node with initial value info for iterator
+        :param register: register in which the init value will be stored
+        :param buffer2: register in which the iterators address will be stored
         :return:
         """
-        self.Variables.delete_iterator(name)
+        self.store_value_in_reg(ast_init_rvalue, register=register, buffer=buffer2)
+        self.generate_value(buffer2, iterator.address)
+        self.IR.store(register, buffer2)  # iterator starting value remains in register
 
     def make_declarations(self, declarations):
         """
         Declares variables from the beginning of the source code.
-        :param declarations: list of tuples - AST fragment
+        :param declarations: list of IntDeclaration and TabDeclaration nodes
         :return:
         """
         ints = []
@@ -121,11 +259,11 @@ class Compiler(object):
         # tabs_lengths = {}
 
         for d in declarations:
-            var_type = d[0]
+            var_type = d.kind
 
-            if var_type == "int":
+            if var_type == INT_DECLARATION:
                 ints.append(d)
-            elif var_type == "tab":
+            elif var_type == TAB_DECLARATION:
                 tabs.append(d)
                 # tab_elements = int(d[3]) - int(d[2]) TODO: sorting
                 # tabs_lengths[name] = tab_elements
@@ -140,24 +278,40 @@ class Compiler(object):
                 raise Exception("No such type as ", var_type)
 
         for d in ints:
-            name, line = d[1], int(d[-1])
+            name, line = d.name, d.lineno
             self.Variables.new_variable(name, "int", line)
 
         for t in tabs:
-            name, line, start, end = t[1], int(t[-1]), int(t[2]), int(t[3])
+            name, line, start, end = t.name, t.lineno, t.start_index, t.end_index
             self.Variables.new_variable(name, "tab", line,
                                         start_index=start,
                                         end_index=end)
 
+    def lower(self):
+        """
+        Runs the IR passes and appends the code to the machine instructions.
+        """
+        self.passes.run("ir", self.IR)
+        self.IR.lower(self.Instructions)
+        self.IR.clear()
+
     def make_instructions(self, instructions):
         """
-        Driver function which performs instructions.
-        :param instructions: list of AST fragments with instructions. list of tuples.
+        Driver function which performs instructions, already checked and annotated by
+        SemanticAnalyzer. Handlers of IF, loops etc. are generators which yield lists of commands
+        of their bodies, see ast_nodes.walk, so the nesting depth isn't limited by Python's
+        recursion.
+        :param instructions: list of AST nodes with instructions.
         :return:
         """
-        for inst_ast in instructions:
-            inst_type = inst_ast[0]
-            self.operation[inst_type](inst_ast)
+        walk(instructions, self.operation, self.mark_line)
+
+    def mark_line(self, ast_node):
+        """
+        Source line table of the code, every command marks its line. Code after a body (jumps
+        back, FOR steps) stays with the last command of the body.
+        """
+        self.IR.mark_line(ast_node.lineno)
 
     def copy_reg(self, register1, register2):
         """
@@ -167,110 +321,78 @@ class Compiler(object):
         :return:
         """
         # reg1 <- reg2
-        self.Instructions.reset(register1)
-        self.Instructions.add(register1, register2)
+        self.IR.reset(register1)
+        self.IR.add(register1, register2)
 
     def generate_value(self, reg_name, value):
         """
-        Generates number in given register according to its binary representation
-        by left shifts and incrementation operations.
+        Generates number in given register, a CONST lowered to left shifts and incrementation
+        operations according to its binary representation (see ir._expand).
         :param reg_name: Capital letter A-F - register symbol
         :param value: Decimal value, which will be generated in a register
         :return:
         """
-        self.Instructions.reset(reg_name, debug=" (generating {})".format(value))
-        if value >= 1:
-            self.Instructions.inc(reg_name)
-            binary = bin(value)[3:]  # strip '0b' and first '1' - it's added already!
-            for bit in binary:
-                if bit == "1":
-                    self.Instructions.shl(reg_name)
-                    self.Instructions.inc(reg_name)
-                else:  # if bit == "0"
-                    self.Instructions.shl(reg_name)
+        self.IR.const(reg_name, value)
         self.Registers.set_reg(reg_name, value)
 
     def assign(self, ast_node, buffer="B", buffer2="A", buffer3="F"):
         """
         Handles assigment in code. In the end - value of buffer is lvalue address and value of
         buffer2 is rvalue
-        :param ast_node: ast tuple with assign info
+        :param ast_node: Assign node
         :param buffer:
         :param buffer2:
         :param buffer3:
         :return:
         """
         # unpack
-        lvalue = ast_node[1]
-        rvalue = ast_node[2]
-        var_type = lvalue[0]
-        var_name = lvalue[1]
-
-        # check if left and right hand side are valid
-        if not self.check_lvalue(lvalue) or not self.check_rvalue(rvalue):
-            return
-        else:
-            lvalue = self.Variables[var_name]
-            self.store_value_in_reg(rvalue, register=buffer2,
-                                    buffer=buffer)  # rvalue value in buffer2
-            # at this moment - RESERVED: C, FREE: A,B,D,E,F
-            # handle lvalue and get its address
-            if var_type == 'int':
-                address = lvalue.address
-                self.generate_value(buffer, address)
-                lvalue.is_initialized = True
-            elif var_type == 'tab':
-                ast_lvalue = ast_node[1]
-                self.load_tab_element_address(ast_lvalue, register=buffer, buffer=buffer3,
-                                              initialization=True)
-            self.Instructions.store(buffer2, buffer)
+        ast_lvalue = ast_node.lvalue
+        rvalue = ast_node.rvalue
+        var_type = ast_lvalue.kind
+
+        self.store_value_in_reg(rvalue, register=buffer2, buffer=buffer)  # rvalue value in buffer2
+        # at this moment - RESERVED: C, FREE: A,B,D,E,F
+        # handle lvalue and get its address
+        if var_type == INT:
+            self.generate_value(buffer, ast_lvalue.var.address)
+        elif var_type == TAB:
+            self.load_tab_element_address(ast_lvalue, register=buffer, buffer=buffer3)
+        self.IR.store(buffer2, buffer)
 
     def read(self, ast_node, buffer="B", buffer2="C"):
-        var_ast = ast_node[1]
-        var_type = var_ast[0]
-        var_name = var_ast[1]
-        if not self.check_lvalue(var_ast):
-            return
-        lvalue = self.Variables[var_name]
-
-        if var_type == 'int':
-            address = lvalue.address
-            self.generate_value(buffer, address)
-            lvalue.is_initialized = True
-        elif var_type == 'tab':
-            ast_lvalue = ast_node[1]
-            self.load_tab_element_address(ast_lvalue, register=buffer, buffer=buffer2,
-                                          initialization=True)
-        self.Instructions.get(buffer)
+        ast_lvalue = ast_node.lvalue
+        var_type = ast_lvalue.kind
 
-    def write(self, ast_node, buffer="B", buffer2="C"):
-        ast_value = ast_node[1]
-        if not self.check_rvalue(ast_value):
-            return
+        if var_type == INT:
+            self.generate_value(buffer, ast_lvalue.var.address)
+        elif var_type == TAB:
+            self.load_tab_element_address(ast_lvalue, register=buffer, buffer=buffer2)
+        self.IR.get(buffer)
 
-        value_type = ast_value[0]
-        if value_type == "NUM":
-            value = int(ast_value[1])
+    def write(self, ast_node, buffer="B", buffer2="C"):
+        ast_value = ast_node.value
+        value_type = ast_value.kind
+        if value_type == NUM:
+            value = ast_value.value
             self.generate_value(buffer, value)
             self.generate_value(buffer2, 1)
-            self.Instructions.store(buffer, buffer2)
-            self.Instructions.put(buffer2)
-        elif value_type == "tab":
+            self.IR.store(buffer, buffer2)
+            self.IR.put(buffer2)
+        elif value_type == TAB:
             self.load_tab_element_address(ast_value, register=buffer, buffer=buffer2)
-            self.Instructions.put(buffer)
-        elif value_type == "int":
-            int_name = ast_value[1]
-            rvalue = self.Variables[int_name]
-            self.generate_value(buffer, rvalue.address)
-            self.Instructions.put(buffer)
+            self.IR.put(buffer)
+        elif value_type == INT:
+            self.loaded.add(ast_value.var)
+            self.generate_value(buffer, ast_value.var.address)
+            self.IR.put(buffer)
         else:  # + - / * %
-            self.do_arithmetics(ast_node, register=buffer, buffer=buffer2)
-            self.Instructions.put(buffer)
+            self.do_arithmetics(ast_value, register=buffer, buffer=buffer2)
+            self.IR.put(buffer)
 
     def store_value_in_reg(self, ast_node, register="B", buffer="F"):
         """
-        Checks value in ast_node and generates it in register, no matter whether it is number, int,
-        tab value or arithmetic operation
+        Generates value of ast_node in register, no matter whether it is number, int, tab value or
+        arithmetic operation
         :param ast_node:
         :param register:
         :param buffer:
@@ -278,34 +400,16 @@ class Compiler(object):
         """
         if register == buffer:
             raise Exception("use two different registers")
-        node_type = ast_node[0]
-        if node_type == "NUM":
-            value = int(ast_node[1])
+        node_type = ast_node.kind
+        if node_type == NUM:
+            value = ast_node.value
             self.generate_value(register, value)
-        elif node_type in ["+", "-", "*", "/", "%"]:
+        elif node_type in ARITHMETIC_KINDS:
             self.do_arithmetics(ast_node, register=register, buffer=buffer)
-        elif node_type == "int":
-            var_name = ast_node[1]
-            try:
-                int_var = self.Variables[var_name]
-                self.load_int(int_var, register)
-            except KeyError:
-                self.error = True
-                print("Error! line {}\n"
-                      "Variable '{}' was not declared\n"
-                      .format(ast_node[-1], var_name), file=sys.stderr)
-
-        elif node_type == "tab":
-            var_name = ast_node[1]
-            index = ast_node[2]
-            try:
-                tab_var = self.Variables[var_name]
-                self.load_tab(tab_var, index, register=register, buffer=buffer)
-            except KeyError:
-                self.error = True
-                print("Error! line {}\n"
-                      "Variable '{}' was not declared\n"
-                      .format(ast_node[-1], var_name), file=sys.stderr)
+        elif node_type == INT:
+            self.load_int(ast_node.var, register)
+        elif node_type == TAB:
+            self.load_tab(ast_node.var, ast_node.index_value, register=register, buffer=buffer)
 
     def load_int(self, _int, register="A"):
         """
@@ -314,9 +418,10 @@ class Compiler(object):
         :param register:
         :return:
         """
+        self.loaded.add(_int)
         address = _int.address
         self.generate_value(register, address)
-        self.Instructions.load(register, register)
+        self.IR.load(register, register)
 
     def load_tab(self, _tab, index_ast_node, register="A", buffer="F"):
         """
@@ -327,524 +432,874 @@ class Compiler(object):
         :param buffer:
         :return:
         """
-        index_type = index_ast_node[0]
-        if index_type == "NUM":
-            index = int(index_ast_node[1])
+        index_type = index_ast_node.kind
+        if index_type == NUM:
+            index = index_ast_node.value
             element_address = _tab.get_element_address(index)
             self.generate_value(buffer, element_address)
-            self.Instructions.load(register, buffer)
-        elif index_type == "int":
-            var_name = index_ast_node[1]
-            _int = self.Variables[var_name]
+            self.IR.load(register, buffer)
+        elif index_type == INT:
             self.generate_value(buffer, _tab.start_index)  # store tab starting index in buffer
-            self.load_int(_int, register)  # load and store int variable value in register ("A")
-            self.Instructions.sub(register, buffer)  # "A" = index - start_index (offset)
+            # load and store int variable value in register ("A")
+            self.load_int(index_ast_node.var, register)
+            self.IR.sub(register, buffer)  # "A" = index - start_index (offset)
             self.generate_value(buffer, _tab.address)  # "F" = address
-            self.Instructions.add(buffer, register)  # "F" = address + offset (elem_addr)
-            self.Instructions.load(register, buffer)  # "A" = load  from address elem_addr
+            self.IR.add(buffer, register)  # "F" = address + offset (elem_addr)
+            self.IR.load(register, buffer)  # "A" = load  from address elem_addr
 
-    def load_tab_element_address(self, tab_ast_node, register="A", buffer="F",
-                                 initialization=False):
+    def load_tab_element_address(self, tab_ast_node, register="A", buffer="F"):
         """
         loads tab's element address to a given register
         :param tab_ast_node:
         :param register:
         :param buffer:
-        :param initialization:
         :return:
         """
-        tab_name = tab_ast_node[1]
-        _tab = self.Variables[tab_name]
-        index_ast_node = tab_ast_node[2]
-        index_type = index_ast_node[0]
-
-        if not self.check_rvalue(index_ast_node):
-            return
+        _tab = tab_ast_node.var
+        index_ast_node = tab_ast_node.index_value
+        index_type = index_ast_node.kind
 
-        if index_type == "NUM":
-            index = int(index_ast_node[1])
+        if index_type == NUM:
+            index = index_ast_node.value
             element_address = _tab.get_element_address(index)
             self.generate_value(register, element_address)
-            if initialization:
-                _tab.initialize_element(index)
-        elif index_type == "int":
-            var_name = index_ast_node[1]
-            _int = self.Variables[var_name]
+        elif index_type == INT:
             self.generate_value(buffer, _tab.start_index)  # store tab starting index in buffer
-            self.load_int(_int, register)  # load and store int variable value in register ("A")
-            self.Instructions.sub(register, buffer)  # "A" = index - start_index (offset)
+            # load and store int variable value in register ("A")
+            self.load_int(index_ast_node.var, register)
+            self.IR.sub(register, buffer)  # "A" = index - start_index (offset)
             self.generate_value(buffer, _tab.address)  # "F" = address
-            self.Instructions.add(register, buffer)  # "F" = address + offset (elem_addr)
+            self.IR.add(register, buffer)  # "F" = address + offset (elem_addr)
 
     # CONTROL FLOW
 
     def if_endif(self, ast_node, buffer1="B", buffer2="C", buffer3="D"):
-        ast_condition, ast_operations = ast_node[1], ast_node[2]
-        cond_var1, cond_var2 = ast_condition[1], ast_condition[2]
-        if not self.check_rvalue(cond_var1) or not self.check_rvalue(cond_var2):
-            return
-        label1 = self.Instructions.new_label()
+        ast_condition, ast_operations = ast_node.condition, ast_node.commands
+        cond_var1, cond_var2 = ast_condition.left, ast_condition.right
+        label1 = self.IR.new_label()
         self.store_value_in_reg(cond_var1, register=buffer1, buffer=buffer3)
         self.store_value_in_reg(cond_var2, register=buffer2, buffer=buffer3)
         self.check_condition(ast_condition, buffer1, buffer2, buffer3)
-        self.Instructions.jzero(buffer1, label1)
-        self.make_instructions(ast_operations)
-        self.Instructions.put_label(label1)
+        self.IR.jzero(buffer1, label1)
+        yield ast_operations
+        self.IR.put_label(label1)
 
     def if_else_endif(self, ast_node, buffer1="B", buffer2="C", buffer3="D"):
-        ast_condition, ast_if_ops, ast_else_ops = ast_node[1], ast_node[2], ast_node[3]
-        cond_var1, cond_var2 = ast_condition[1], ast_condition[2]
-        if not self.check_rvalue(cond_var1) or not self.check_rvalue(cond_var2):
-            return
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
+        ast_condition, ast_if_ops, ast_else_ops = (ast_node.condition, ast_node.commands,
+                                                   ast_node.else_commands)
+        cond_var1, cond_var2 = ast_condition.left, ast_condition.right
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
         self.store_value_in_reg(cond_var1, register=buffer1, buffer=buffer3)
         self.store_value_in_reg(cond_var2, register=buffer2, buffer=buffer3)
         self.check_condition(ast_condition, buffer1, buffer2, buffer3)
-        self.Instructions.jzero(buffer1, label1)
-        self.make_instructions(ast_if_ops)
-        self.Instructions.jump(label2)
-        self.Instructions.put_label(label1)
-        self.make_instructions(ast_else_ops)
-        self.Instructions.put_label(label2)
+        self.IR.jzero(buffer1, label1)
+        yield ast_if_ops
+        self.IR.jump(label2)
+        self.IR.put_label(label1)
+        yield ast_else_ops
+        self.IR.put_label(label2)
 
     def while_loop(self, ast_node, buffer1="B", buffer2="C", buffer3="D"):
-        ast_condition, ast_operations = ast_node[1], ast_node[2]
-        cond_var1, cond_var2 = ast_condition[1], ast_condition[2]
-        if not self.check_rvalue(cond_var1) or not self.check_rvalue(cond_var2):
+        ast_condition, ast_operations = ast_node.condition, ast_node.commands
+        cond_var1, cond_var2 = ast_condition.left, ast_condition.right
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
+        self.IR.put_label(label1)
+        if self.known_condition(ast_condition) is not True:
+            self.store_value_in_reg(cond_var1, register=buffer1, buffer=buffer3)
+            self.store_value_in_reg(cond_var2, register=buffer2, buffer=buffer3)
+            self.check_condition(ast_condition, buffer1, buffer2, buffer3)
+            self.IR.jzero(buffer1, label2)
+        yield ast_operations
+        self.IR.jump(label1)
+        self.IR.put_label(label2)
+
+    def rotated_loop(self, ast_node, buffer1="B", buffer2="C", buffer3="D"):
+        """
+        WHILE of the optimized code, tested before the first iteration and then at the bottom of
+        the body, by a value which is 0 when the loop goes on (see check_complement):
+            condition, JZERO end
+            loop: body
+            complement of the condition, JZERO loop
+            end:
+        so an iteration makes one jump, and the test follows the body in one basic block, where
+        the peephole pass finds the values the body left in registers.
+        """
+        ast_condition, ast_operations = ast_node.condition, ast_node.commands
+        cond_var1, cond_var2 = ast_condition.left, ast_condition.right
+        if self.known_condition(ast_condition) is True:
+            yield from self.while_loop(ast_node, buffer1, buffer2, buffer3)
             return
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
-        self.Instructions.put_label(label1)
+        loop = self.IR.new_label()
+        end = self.IR.new_label()
         self.store_value_in_reg(cond_var1, register=buffer1, buffer=buffer3)
         self.store_value_in_reg(cond_var2, register=buffer2, buffer=buffer3)
         self.check_condition(ast_condition, buffer1, buffer2, buffer3)
-        self.Instructions.jzero(buffer1, label2)
-        self.make_instructions(ast_operations)
-        self.Instructions.jump(label1)
-        self.Instructions.put_label(label2)
+        self.IR.jzero(buffer1, end)
+        self.IR.put_label(loop)
+        yield ast_operations
+        self.store_value_in_reg(cond_var1, register=buffer1, buffer=buffer3)
+        self.store_value_in_reg(cond_var2, register=buffer2, buffer=buffer3)
+        self.IR.jzero(self.check_complement(ast_condition, buffer1, buffer2, buffer3), loop)
+        self.IR.put_label(end)
 
     def repeat_until_loop(self, ast_node, buffer1="B", buffer2="C", buffer3="D"):
-        ast_condition, ast_operations = ast_node[1], ast_node[2]
-        cond_var1, cond_var2 = ast_condition[1], ast_condition[2]
-        if not self.check_rvalue(cond_var1) or not self.check_rvalue(cond_var2):
+        ast_condition, ast_operations = ast_node.condition, ast_node.commands
+        cond_var1, cond_var2 = ast_condition.left, ast_condition.right
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
+        self.IR.put_label(label1)
+        yield ast_operations
+        if self.known_condition(ast_condition) is False:
+            self.IR.jump(label1)
             return
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
-        self.Instructions.put_label(label1)
-        self.make_instructions(ast_operations)
         self.store_value_in_reg(cond_var1, register=buffer1, buffer=buffer3)
         self.store_value_in_reg(cond_var2, register=buffer2, buffer=buffer3)
         self.check_condition(ast_condition, buffer1, buffer2, buffer3)
-        self.Instructions.jzero(buffer1, label1)
+        self.IR.jzero(buffer1, label1)
 
     def for_to_loop(self, ast_node, buffer1="B", buffer2="C", buffer3="D"):
-        list_ast_operations, iterator_name = ast_node[4], ast_node[1]
-        ast_init_value, ast_to_value, line = ast_node[2], ast_node[3], ast_node[-1]
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
-        endfor_name = iterator_name + "TO"
-        self.declare_iterator(endfor_name, ast_to_value, line, register=buffer2, buffer2=buffer3)
-        self.declare_iterator(iterator_name, ast_init_value, line, register=buffer1,
+        list_ast_operations = ast_node.commands
+        ast_init_value, ast_to_value = ast_node.start, ast_node.stop
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
+        endfor = ast_node.bound_var
+        self.declare_iterator(endfor, ast_to_value, register=buffer2, buffer2=buffer3)
+        self.declare_iterator(ast_node.iterator_var, ast_init_value, register=buffer1,
                               buffer2=buffer3)
-        endfor = self.Variables[endfor_name]
-        self.Instructions.put_label(label1)
+        self.IR.put_label(label1)
         self.leq(register1=buffer1, register2=buffer2)
-        self.Instructions.jzero(buffer1, label2)
+        self.IR.jzero(buffer1, label2)
 
-        self.make_instructions(list_ast_operations)
+        if ast_to_value.kind == NUM:
+            self.bounds[ast_node.iterator_var] = ast_to_value.value + 1
+        yield list_ast_operations
 
-        self.generate_value(buffer3, self.Variables.get_iterator_address(iterator_name))
-        self.Instructions.load(buffer1, buffer3)
-        self.Instructions.inc(buffer1)
-        self.Instructions.store(buffer1, buffer3)
+        self.generate_value(buffer3, ast_node.step_address)
+        self.IR.load(buffer1, buffer3)
+        self.IR.inc(buffer1)
+        self.IR.store(buffer1, buffer3)
         self.load_int(endfor, buffer2)
-        self.Instructions.jump(label1)
-        self.Instructions.put_label(label2)
-        self.delete_iterator(iterator_name)
-        self.delete_iterator(endfor_name)
+        self.IR.jump(label1)
+        self.IR.put_label(label2)
 
     def for_downto_loop(self, ast_node,
                         buffer1="B", buffer2="C", buffer3="D", buffer4="E", buffer5="F"):
-        list_ast_operations, iterator_name = ast_node[4], ast_node[1]
-        ast_init_value, ast_downto_value, line = ast_node[2], ast_node[3], ast_node[-1]
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
-        label3 = self.Instructions.new_label()
-        endfor_name = iterator_name + "DOWNTO"
-        self.declare_iterator(endfor_name, ast_downto_value, line, register=buffer2,
+        list_ast_operations = ast_node.commands
+        ast_init_value, ast_downto_value = ast_node.start, ast_node.stop
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
+        label3 = self.IR.new_label()
+        endfor = ast_node.bound_var
+        self.declare_iterator(endfor, ast_downto_value, register=buffer2, buffer2=buffer3)
+        self.declare_iterator(ast_node.iterator_var, ast_init_value, register=buffer1,
                               buffer2=buffer3)
-        self.declare_iterator(iterator_name, ast_init_value, line, register=buffer1,
-                              buffer2=buffer3)
-        endfor = self.Variables[endfor_name]
 
         self.copy_reg(buffer4, buffer1)  # buffer4 <- i = i - 1
         self.copy_reg(buffer5, buffer2)
         self.geq(register1=buffer4, register2=buffer5)
-        self.Instructions.jzero(buffer4, label2)  # dont do the loop
+        self.IR.jzero(buffer4, label2)  # dont do the loop
 
-        self.Instructions.put_label(label1)  # LOOP #################
+        self.IR.put_label(label1)  # LOOP #################
         self.neq(buffer1, buffer2, buffer=buffer3)
-        self.Instructions.jzero(buffer1, label3)  # last iteration ->>>> OUT OF LOOP
+        self.IR.jzero(buffer1, label3)  # last iteration ->>>> OUT OF LOOP
 
-        self.make_instructions(list_ast_operations)
+        if ast_init_value.kind == NUM:
+            self.bounds[ast_node.iterator_var] = ast_init_value.value + 1
+        yield list_ast_operations
 
-        self.generate_value(buffer3, self.Variables.get_iterator_address(iterator_name))
-        self.Instructions.load(buffer1, buffer3)
-        self.Instructions.dec(buffer1)
-        self.Instructions.store(buffer1, buffer3)  # buffer1 <- i = i - 1
+        self.generate_value(buffer3, ast_node.step_address)
+        self.IR.load(buffer1, buffer3)
+        self.IR.dec(buffer1)
+        self.IR.store(buffer1, buffer3)  # buffer1 <- i = i - 1
         self.load_int(endfor, buffer2)             # buffer2 <- endfor value
         # self.copy_reg(buffer4, buffer1)            # buffer4 <- i = i - 1
         # self.copy_reg(buffer5, buffer2)            # buffer5 <- endfor value
-        self.Instructions.jump(label1)     # LOOP ################
+        self.IR.jump(label1)     # LOOP ################
+
+        self.IR.put_label(label3)  # LAST ITER
+        yield list_ast_operations
 
-        self.Instructions.put_label(label3)  # LAST ITER
-        self.make_instructions(list_ast_operations)
-        self.delete_iterator(iterator_name)
-        self.delete_iterator(endfor_name)
+        self.IR.put_label(label2)  # DONT DO THE LOOP
 
-        self.Instructions.put_label(label2)  # DONT DO THE LOOP
+    def counted_loop(self, ast_node):
+        """
+        FOR TO and FOR DOWNTO of the optimized code, with one copy of the body. The number of
+        iterations is computed once, before the first one, and counted down in a register the body
+        leaves alone, found by scanning the code of the body, so the code before the body is
+        emitted after it and moved:
+            iterator = start, counter = stop + 1 - start (start + 1 - stop), JZERO counter end
+            loop: body
+            DEC counter, JZERO counter end
+            iterator + 1 (- 1)
+            JUMP loop
+            end:
+        A DOWNTO iterator isn't decremented after the last iteration, so it never goes below 0.
+        The iterator is kept in memory only if the body reads it, in a free register if there is
+        one, with its address in another one. With no free register the counter is in the cell of
+        the bound.
+        """
+        iterator, counter_cell = ast_node.iterator_var, ast_node.bound_var
+        loop, end = self.IR.new_label(), self.IR.new_label()
+        self.IR.put_label(loop)
+        body = len(self.IR.blocks) - 1
+        downto = ast_node.kind == FOR_DT
+        highest = ast_node.start if downto else ast_node.stop
+        if highest.kind == NUM:
+            self.bounds[iterator] = highest.value + 1
+        yield ast_node.commands
+
+        reads_iterator = iterator in self.loaded
+        free = [r for r in "EDCFBA" if r not in self.IR.registers(body)]
+        in_memory = not free
+        counter = free.pop(0) if free else "B"
+        kept = free.pop(0) if free and reads_iterator else None  # the iterator
+        address = free.pop(0) if free and kept else None  # of the iterator
+        scratch = [r for r in "BCDEFA" if r not in (counter, kept, address)]
+
+        if in_memory:
+            self.generate_value(scratch[0], counter_cell.address)
+            self.IR.load(counter, scratch[0])
+            self.IR.dec(counter)
+            self.IR.store(counter, scratch[0])
+        else:
+            self.IR.dec(counter)
+        self.IR.jzero(counter, end)
+        if reads_iterator:
+            if kept is None:
+                self.generate_value(scratch[0], iterator.address)
+                self.IR.load(scratch[1], scratch[0])
+                self.step(scratch[1], downto)
+                self.IR.store(scratch[1], scratch[0])
+            else:
+                self.step(kept, downto)
+                if address is None:
+                    self.generate_value(scratch[0], iterator.address)
+                    self.IR.store(kept, scratch[0])
+                else:
+                    self.IR.store(kept, address)
+        self.IR.jump(loop)
+
+        setup = len(self.IR.blocks) - 1
+        self.IR.mark_line(ast_node.lineno)
+        start = kept or scratch[1]
+        self.store_value_in_reg(ast_node.start, register=start, buffer=scratch[0])
+        if reads_iterator:
+            if address is None:
+                self.generate_value(scratch[0], iterator.address)
+                self.IR.store(start, scratch[0])
+            else:
+                self.generate_value(address, iterator.address)
+                self.IR.store(start, address)
+        if downto:
+            self.store_value_in_reg(ast_node.stop, register=scratch[2], buffer=scratch[0])
+            self.copy_reg(counter, start)
+            self.IR.inc(counter)
+            self.IR.sub(counter, scratch[2])
+        else:
+            self.store_value_in_reg(ast_node.stop, register=counter, buffer=scratch[0])
+            self.IR.inc(counter)
+            self.IR.sub(counter, start)
+        if in_memory:
+            self.generate_value(scratch[0], counter_cell.address)
+            self.IR.store(counter, scratch[0])
+        self.IR.jzero(counter, end)
+        self.IR.move_code(setup, body)
+        self.IR.put_label(end)
+
+    def step(self, register, downto):
+        if downto:
+            self.IR.dec(register)
+        else:
+            self.IR.inc(register)
+
+    def known_condition(self, ast_condition):
+        """
+        :return: True or False if the condition compares two numbers and the code is optimized,
+                 None otherwise
+        """
+        if self.passes.level:
+            return condition_value(ast_condition)
+        return None
 
     def check_condition(self, ast_node, register1, register2, buffer="A"):
-        condition = ast_node[0]
-        if condition == '>':
+        condition = ast_node.kind
+        if condition == GT:
             self.gt(register1, register2)
-        elif condition == '<':
+        elif condition == LT:
             self.lt(register1, register2)
-        elif condition == '>=':
+        elif condition == GEQ:
             self.geq(register1, register2)
-        elif condition == '<=':
+        elif condition == LEQ:
             self.leq(register1, register2)
-        elif condition == '=':
+        elif condition == EQ:
             self.eq(register1, register2, buffer)
-        elif condition == '!=':
+        elif condition == NEQ:
             self.neq(register1, register2, buffer)
         else:
-            print("No logical operator such as ", condition, file=sys.stderr)
+            print("No logical operator such as ", SYMBOLS.get(condition, condition),
+                  file=sys.stderr)
             self.error = True
 
+    def check_complement(self, ast_node, register1, register2, buffer="A"):
+        """
+        Generates a value which is 0 exactly when the condition holds, for a jump which is taken
+        when it holds. It isn't always in register1, e.g. for a > b it is b + 1 - a in register2.
+        :return: register with the value
+        """
+        condition = ast_node.kind
+        if condition == GT:
+            self.IR.inc(register2)
+            self.IR.sub(register2, register1)
+            return register2
+        if condition == LT:
+            self.IR.inc(register1)
+            self.IR.sub(register1, register2)
+            return register1
+        if condition == GEQ:
+            self.IR.sub(register2, register1)
+            return register2
+        if condition == LEQ:
+            self.IR.sub(register1, register2)
+            return register1
+        if condition == EQ:
+            self.neq(register1, register2, buffer)
+        else:
+            self.eq(register1, register2, buffer)
+        return register1
+
     def gt(self, register1, register2):
-        self.Instructions.sub(register1, register2)
+        self.IR.sub(register1, register2)
 
     def lt(self, register1, register2):
-        self.Instructions.sub(register2, register1)
+        self.IR.sub(register2, register1)
         self.copy_reg(register1, register2)
 
     def geq(self, register1, register2):
-        self.Instructions.inc(register1)
-        self.Instructions.sub(register1, register2)
+        self.IR.inc(register1)
+        self.IR.sub(register1, register2)
 
     def leq(self, register1, register2):
-        self.Instructions.inc(register2)
-        self.Instructions.sub(register2, register1)
+        self.IR.inc(register2)
+        self.IR.sub(register2, register1)
         self.copy_reg(register1, register2)
 
     def eq(self, register1, register2, buffer):
         # reg1 >= reg2 AND reg2 >= reg1 --> reg1 == reg2
-        label1 = self.Instructions.new_label()
+        label1 = self.IR.new_label()
         self.copy_reg(buffer, register1)
-        self.Instructions.inc(buffer)
-        self.Instructions.sub(buffer, register2)  # check reg1 >= reg2
+        self.IR.inc(buffer)
+        self.IR.sub(buffer, register2)  # check reg1 >= reg2
         # now if buffer =/= 0, then ok. Note that register1,2 stay unchanged
-        self.Instructions.inc(register2)
-        self.Instructions.sub(register2, register1)  # check reg2 >= reg1
+        self.IR.inc(register2)
+        self.IR.sub(register2, register1)  # check reg2 >= reg1
         # now if register2 =/= 0, then ok. register2 value was changed
-        self.Instructions.reset(register1)  # register1 <- 0
+        self.IR.reset(register1)  # register1 <- 0
         # quit with reg1==0 if buffer==0 or register2==0
-        self.Instructions.jzero(buffer, label1)
-        self.Instructions.jzero(register2, label1)
+        self.IR.jzero(buffer, label1)
+        self.IR.jzero(register2, label1)
         # if we are here, it means that reg1==reg2, so increase reg1 value
-        self.Instructions.inc(register1)
-        self.Instructions.put_label(label1)
+        self.IR.inc(register1)
+        self.IR.put_label(label1)
 
     def neq(self, register1, register2, buffer):
         # if reg1 > reg2 OR reg 2 > reg 1
         self.copy_reg(buffer, register2)
-        self.Instructions.sub(buffer, register1)  # r1 - r2, =0 if r1 <= r2
-        self.Instructions.sub(register1, register2)  # r2 - r1, =0 if r1 >= r2
-        self.Instructions.add(register1, buffer)  # sum be > 0 if r1 > r2 or r2 > r1
+        self.IR.sub(buffer, register1)  # r1 - r2, =0 if r1 <= r2
+        self.IR.sub(register1, register2)  # r2 - r1, =0 if r1 >= r2
+        self.IR.add(register1, buffer)  # sum be > 0 if r1 > r2 or r2 > r1
 
     def do_arithmetics(self, ast_node, register="B",
                        buffer="C", buffer1="D", buffer2="E", buffer3="F", buffer4="A"):
-        operation = ast_node[0]
-        if operation not in ["+", "-", "*", "/", "%"]:
+        operation = ast_node.kind
+        if operation not in ARITHMETIC_KINDS:
             return  # TODO: print error
 
-        if operation == "+":
+        if operation == ADD:
             self.add(ast_node, register, buffer, buffer1)
-        elif operation == "-":
+        elif operation == SUB:
             self.sub(ast_node, register, buffer, buffer1)
-        elif operation == "*":
+        elif operation == MUL:
             self.mul(ast_node, register, buffer, buffer1)
-        elif operation == "/":
+        elif operation == DIV:
             self.div(ast_node, register)  # buffer, buffer1, buffer2, buffer3)
-        elif operation == "%":
+        elif operation == MOD:
             self.mod(ast_node, register)
 
     def add(self, ast_node, register="B", buffer="C", buffer2="D"):
-        left_op = ast_node[1]
-        right_op = ast_node[2]
-        self.check_rvalue(left_op)
-        self.check_rvalue(right_op)
+        left_op = ast_node.left
+        right_op = ast_node.right
 
         self.store_value_in_reg(left_op, register=register, buffer=buffer)
         self.store_value_in_reg(right_op, buffer, buffer=buffer2)
-        self.Instructions.add(register, buffer)
+        self.IR.add(register, buffer)
 
     def sub(self, ast_node, register="B", buffer="C", buffer2="D"):
-        left_op = ast_node[1]
-        right_op = ast_node[2]
-        self.check_rvalue(left_op)
-        self.check_rvalue(right_op)
+        left_op = ast_node.left
+        right_op = ast_node.right
 
         self.store_value_in_reg(left_op, register=register, buffer=buffer)
         self.store_value_in_reg(right_op, buffer, buffer=buffer2)
-        self.Instructions.sub(register, buffer)
+        self.IR.sub(register, buffer)
 
     def mul(self, ast_node, register="B", buffer="C", buffer1="D", buffer2="E", buffer3="F"):
-        left_op = ast_node[1]
-        right_op = ast_node[2]
-        self.check_rvalue(left_op)
-        self.check_rvalue(right_op)
-
-        if left_op[0] == right_op[0] == 'NUM' and int(left_op[1]) < int(right_op[1]):
+        left_op = ast_node.left
+        right_op = ast_node.right
+
+        ordered = False  # right_op is known to be the smaller one
+        if self.passes.level:
+            numbers = [op for op in (left_op, right_op) if op.kind == NUM and op.value < WORD_LIMIT]
+            if numbers:
+                number = min(numbers, key=lambda op: op.value)
+                self.mul_by_number(right_op if number is left_op else left_op, number.value,
+                                   register, buffer)
+                return
+            left_bound, right_bound = self.bound(left_op), self.bound(right_op)
+            if left_bound < right_bound:
+                left_op, right_op = right_op, left_op
+            ordered = min(left_bound, right_bound) < DRIVER_BOUND
+
+        if left_op.kind == right_op.kind == NUM and left_op.value < right_op.value:
             left_op, right_op = right_op, left_op
 
-        label0 = self.Instructions.new_label()
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
-        label3 = self.Instructions.new_label()
-        label4 = self.Instructions.new_label()
+        label0 = self.IR.new_label()
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
+        label3 = self.IR.new_label()
+        label4 = self.IR.new_label()
         self.store_value_in_reg(left_op, register=buffer, buffer=register)
         self.store_value_in_reg(right_op, register=buffer1, buffer=register)
 
-        self.copy_reg(buffer2, buffer)  # left op in buffer2
-        self.copy_reg(buffer3, buffer1)  # right op in buffer3
-
-        self.Instructions.sub(buffer3, buffer2)  # a * b more efficient when a > b
-        self.Instructions.jzero(buffer3, label0)
-        self.copy_reg(register, buffer)
-        self.copy_reg(buffer, buffer1)
-        self.copy_reg(buffer1, register)
-
-        self.Instructions.put_label(label0)
-        self.Instructions.reset(register)
-        self.Instructions.put_label(label1)
-        self.Instructions.jzero(buffer1, label4)
-        self.Instructions.jodd(buffer1, label3)
-        self.Instructions.put_label(label2)
-        self.Instructions.shr(buffer1)
-        self.Instructions.shl(buffer)
-        self.Instructions.jump(label1)
-        self.Instructions.put_label(label3)
-        self.Instructions.add(register, buffer)
-        self.Instructions.jump(label2)
-        self.Instructions.put_label(label4)
+        if not ordered:
+            self.copy_reg(buffer2, buffer)  # left op in buffer2
+            self.copy_reg(buffer3, buffer1)  # right op in buffer3
+
+            self.IR.sub(buffer3, buffer2)  # a * b more efficient when a > b
+            self.IR.jzero(buffer3, label0)
+            self.copy_reg(register, buffer)
+            self.copy_reg(buffer, buffer1)
+            self.copy_reg(buffer1, register)
+
+        self.IR.put_label(label0)
+        self.IR.reset(register)
+        self.IR.put_label(label1)
+        self.IR.jzero(buffer1, label4)
+        self.IR.jodd(buffer1, label3)
+        self.IR.put_label(label2)
+        self.IR.shr(buffer1)
+        self.IR.shl(buffer)
+        self.IR.jump(label1)
+        self.IR.put_label(label3)
+        self.IR.add(register, buffer)
+        self.IR.jump(label2)
+        self.IR.put_label(label4)
+
+    def bound(self, ast_value):
+        """
+        :param ast_value: Identifier or TabElement
+        :return: a number the value is known to be below, WORD_LIMIT if there is none
+        """
+        if ast_value.kind == INT:
+            return self.bounds.get(ast_value.var, WORD_LIMIT)
+        return WORD_LIMIT
+
+    def mul_by_number(self, ast_value, number, register="B", buffer="C"):
+        """
+        Straight-line multiplication by a number, see arithmetic.
+        :param ast_value: Identifier or TabElement, the multiplicand
+        :param number: the multiplier
+        :param register: register of the product
+        :param buffer: register of the multiplicand
+        :return:
+        """
+        if number == 0:
+            self.IR.reset(register)
+            return
+        self.store_value_in_reg(ast_value, register=register, buffer=buffer)
+        shifts = power_of_two(number)
+        if shifts is not None:
+            for _ in range(shifts):
+                self.IR.shl(register)
+            return
+        digits = multiplier_digits(number)
+        self.copy_reg(buffer, register)
+        for digit in digits[1:]:
+            self.IR.shl(register)
+            if digit == 1:
+                self.IR.add(register, buffer)
+            elif digit == -1:
+                self.IR.sub(register, buffer)
+
+    def divisor_number(self, ast_node):
+        """
+        :return: value of the right operand if it's a number, the left one isn't and the code is
+                 optimized, None otherwise
+        """
+        if self.passes.level and ast_node.right.kind == NUM and ast_node.left.kind != NUM:
+            return ast_node.right.value
+        return None
 
     def div(self, ast_node, register="B",
             buffer="C", buffer1="D", buffer2="E", buffer3="F"):
-        left_op = ast_node[1]
-        right_op = ast_node[2]
-        self.check_rvalue(left_op)
-        self.check_rvalue(right_op)
-
-        label1 = self.Instructions.new_label()
-        label2 = self.Instructions.new_label()
-        label3 = self.Instructions.new_label()
-        label4 = self.Instructions.new_label()
-        label5 = self.Instructions.new_label()
+        left_op = ast_node.left
+        right_op = ast_node.right
+
+        number = self.divisor_number(ast_node)
+        if number == 0:
+            self.IR.reset(register)
+            return
+        shifts = power_of_two(number) if number is not None else None
+        if shifts is not None:
+            self.store_value_in_reg(left_op, register=register, buffer=buffer)
+            for _ in range(shifts):
+                self.IR.shr(register)
+            return
+
+        label1 = self.IR.new_label()
+        label2 = self.IR.new_label()
+        label3 = self.IR.new_label()
+        label4 = self.IR.new_label()
+        label5 = self.IR.new_label()
         # C         D       E       F
         module, divisor, counter, tmp = buffer, buffer1, buffer2, buffer3
         self.store_value_in_reg(left_op, module, buffer=tmp)
         self.store_value_in_reg(right_op, divisor, tmp)
-        self.Instructions.reset(register)
-        self.Instructions.jzero(divisor, label5)
-        self.Instructions.reset(counter)
-        self.Instructions.inc(counter)
-        self.Instructions.put_label(label1)
+        self.IR.reset(register)
+        self.IR.jzero(divisor, label5)
+        self.IR.reset(counter)
+        self.IR.inc(counter)
+        self.IR.put_label(label1)
         self.copy_reg(tmp, module)
-        self.Instructions.inc(tmp)
-        self.Instructions.sub(tmp, divisor)
-        self.Instructions.jzero(tmp, label2)
-        self.Instructions.shl(divisor)
-        self.Instructions.shl(counter)
-        self.Instructions.jump(label1)
-        self.Instructions.put_label(label2)
-        self.Instructions.jzero(counter, label4)
+        self.IR.inc(tmp)
+        self.IR.sub(tmp, divisor)
+        self.IR.jzero(tmp, label2)
+        self.IR.shl(divisor)
+        self.IR.shl(counter)
+        self.IR.jump(label1)
+        self.IR.put_label(label2)
+        self.IR.jzero(counter, label4)
         self.copy_reg(tmp, module)
-        self.Instructions.inc(tmp)
-        self.Instructions.sub(tmp, divisor)
-        self.Instructions.jzero(tmp, label3)
-        self.Instructions.add(register, counter)
-        self.Instructions.sub(module, divisor)
-        self.Instructions.put_label(label3)
-        self.Instructions.shr(counter)
-        self.Instructions.shr(divisor)
-        self.Instructions.jump(label2)
-        self.Instructions.put_label(label5)
-        self.Instructions.reset(module)
-        self.Instructions.put_label(label4)
+        self.IR.inc(tmp)
+        self.IR.sub(tmp, divisor)
+        self.IR.jzero(tmp, label3)
+        self.IR.add(register, counter)
+        self.IR.sub(module, divisor)
+        self.IR.put_label(label3)
+        self.IR.shr(counter)
+        self.IR.shr(divisor)
+        self.IR.jump(label2)
+        self.IR.put_label(label5)
+        self.IR.reset(module)
+        self.IR.put_label(label4)
+        if ast_node.other_result is not None:
+            # the remainder of a division, the quotient of a modulo (see mod)
+            other = module if ast_node.kind == DIV else register
+            self.generate_value(tmp, ast_node.other_result.address)
+            self.IR.store(other, tmp)
 
     def mod(self, ast_node, register="B",
             buffer="C", buffer1="D", buffer2="E", buffer3="F"):
-        self.div(ast_node, register=buffer, buffer=register)
+        number = self.divisor_number(ast_node)
+        shifts = power_of_two(number) if number is not None else None
+        if number in (0, 1):
+            self.IR.reset(register)
+        elif shifts == 1:
+            # the parity, by JODD
+            label1 = self.IR.new_label()
+            label2 = self.IR.new_label()
+            self.store_value_in_reg(ast_node.left, register=register, buffer=buffer)
+            self.IR.jodd(register, label1)
+            self.IR.reset(register)
+            self.IR.jump(label2)
+            self.IR.put_label(label1)
+            self.IR.reset(register)
+            self.IR.inc(register)
+            self.IR.put_label(label2)
+        elif shifts is not None:
+            # x - (x >> k << k), the lowest k bits
+            self.store_value_in_reg(ast_node.left, register=register, buffer=buffer)
+            self.copy_reg(buffer, register)
+            for _ in range(shifts):
+                self.IR.shr(buffer)
+            for _ in range(shifts):
+                self.IR.shl(buffer)
+            self.IR.sub(register, buffer)
+        else:
+            self.div(ast_node, register=buffer, buffer=register)
 
-    def check_lvalue(self, var_info):
+
+class CompileResult(object):
+    """
+    Outcome of an in-memory compilation.
+    instructions - list of machine instructions, None if the program has errors
+    stdout, stderr - everything the compiler printed during the compilation
+    stats - dict with sizes and timings of the compilation phases
+    source_lines - flat list of pairs: instruction number, source line of the code from it on
+    """
+    def __init__(self, instructions, stdout, stderr, stats, source_lines=None):
+        self.instructions = instructions
+        self.stdout = stdout
+        self.stderr = stderr
+        self.stats = stats
+        self.source_lines = source_lines
+
+    @property
+    def ok(self):
+        return self.instructions is not None
+
+    @property
+    def code(self):
         """
-        Checks if a thing described in ast var_info can be a variable, which can be updated.
-        :param var_info:
-        :return:
+        Machine code as it would be written to the output file.
         """
-        var_type = var_info[0]
-        var_name = var_info[1]
-        line = var_info[-1]
+        if self.instructions is None:
+            return None
+        return "".join(instr + "\n" for instr in self.instructions)
 
-        try:
-            lvalue = self.Variables[var_name]
-        except KeyError:
-            self.error = True
-            print("Error! line {}\n"
-                  "Variable '{}' was not declared\n"
-                  .format(line, var_name), file=sys.stderr)
-            return False
-
-        if var_type == "tab":
-            # unpack the rest
-            index = var_info[2]
-            index_type = index[0]
-
-            if lvalue.type == "int":
-                self.error = True
-                print("Error! line {}\n"
-                      "Type of '{}' is 'int'."
-                      "Can't refer to an element od int.\n"
-                      .format(line, var_name), file=sys.stderr)
-                return False
-
-            if index_type == "NUM":
-                num = int(index[1])
-                if not self.Variables.check_if_in_bounds(var_name, num, line):
-                    return False
-            elif index_type == "int":
-                lvalue.initialize_all()
-                int_name = index[1]
-                try:
-                    int_var = self.Variables[int_name]
-                except KeyError:
-                    self.error = True
-                    print("Error! line {}\n"
-                          "Variable '{}' was not declared\n"
-                          .format(line, int_name), file=sys.stderr)
-                    return False
-                if not int_var.is_initialized:
-                    self.error = True
-                    print("Error! line {}\n"
-                          "Variable '{}' was not initialized\n"
-                          .format(line, int_name), file=sys.stderr)
-                    return False
-
-        elif var_type == "int":
-            if lvalue.type == "tab":
-                self.error = True
-                print("Error! line {}\n"
-                      "Type of '{}' is 'tab'."
-                      " One can only refer to a single element of a table using tab(n).\n"
-                      .format(line, var_name), file=sys.stderr)
-                return False
-            elif lvalue.is_iterator:
-                self.error = True
-                print("Error! line {}\n"
-                      "{} is an iterator. "
-                      "Cannot change iterator value inside a loop\n"
-                      .format(line, var_name), file=sys.stderr)
-        else:
-            return False
-
-        return True
+    def write(self, stream):
+        """
+        Writes the machine code in big chunks.
+        :param stream: text or binary file object
+        :return: number of written instructions
+        """
+        return write_lines(self.instructions, stream)
 
-    def check_rvalue(self, ast_node):
+    def write_object(self, stream):
         """
-        Checks if a thing described in ast_node is a existing valid value.
-        :param ast_node:
+        Writes the machine code in the object format, see object_format.
+        :param stream: binary file object
         :return:
         """
-        node_type = ast_node[0]
-        line = ast_node[-1]
-        if node_type == "NUM":
-            return True
-        elif node_type in ["+", "-", "*", "/", "%"]:
-            left_op, right_op = ast_node[1], ast_node[2]
-            return self.check_rvalue(left_op) and self.check_rvalue(right_op)
-        elif node_type in ["tab", "int"]:
-            var_type = node_type
-            var_name = ast_node[1]
+        code, debug = assemble(self.instructions)
+        dump(code, debug, stream, self.source_lines)
 
+    @property
+    def diagnostics(self):
+        """
+        Separate messages printed by the lexer, parser and compiler.
+        """
+        messages = []
+        for text in (self.stdout, self.stderr):
+            for message in text.split("\n\n"):
+                if message.strip():
+                    messages.append(message.strip())
+        return messages
+
+
+class CompilerSession(object):
+    """
+    Keeps one lexer, parser and compiler and reuses them for every compiled program.
+    Not thread safe - printed diagnostics are captured by redirecting sys.stdout and sys.stderr.
+    """
+    def __init__(self, cache=None, lexer="sly", optimization=0):
+        """
+        :param cache: CompileCache or None
+        :param lexer: name of the tokenizer backend from fast_lex.LEXERS
+        :param optimization: optimization level, one of passes.OPTIMIZATION_LEVELS
+        """
+        self.lexer = LEXERS[lexer]()
+        self.parser = _Parser()
+        self.compiler = Compiler(optimization=optimization)
+        self.cache = cache
+        # settings which change the generated code, they are a part of the cache key
+        self.options = {"optimization": optimization}
+
+    def compile_source(self, text, capture=True):
+        """
+        Compiles a program without touching the file system. With a cache, a hit returns the
+        stored result without lexing, parsing and generating code.
+        :param text: source code
+        :param capture: collect printed diagnostics in the result instead of printing them.
+                        Exceptions of the compiler are then reported as diagnostics too.
+        :return: CompileResult
+        """
+        if self.cache is None:
+            if not capture:
+                return self._compile(text)
+            return self._compile_captured(text)
+
+        key = self.cache.key(text, self.options)
+        entry = self.cache.get(key)
+        if entry is not None:
+            result = CompileResult(entry["instructions"], entry["stdout"], entry["stderr"],
+                                   dict(entry["stats"], cache="hit"), entry.get("source_lines"))
+        else:
+            result = self._compile_captured(text)
+            self.cache.put(key, {"instructions": result.instructions, "stdout": result.stdout,
+                                 "stderr": result.stderr, "stats": result.stats,
+                                 "source_lines": result.source_lines})
+            result.stats["cache"] = "miss"
+        if not capture:
+            sys.stdout.write(result.stdout)
+            sys.stderr.write(result.stderr)
+        return result
+
+    def compile_to_file(self, text, output_file):
+        """
+        Streaming compilation for very big programs: top-level commands are compiled while the
+        parser reduces them and their code is written out at once, so neither the AST nor the
+        machine code of the whole program is kept in memory. The source is tokenized twice, the
+        first pass only reserves iterator cells (see Compiler.start_stream). Up to -O1 the code is
+        the same as from compile_source. The cache isn't used and diagnostics are printed.
+        Semantic errors of the commands before a syntax error are reported too.
+        :param text: source code
+        :param output_file: written only if the program has no errors, like in compile_source
+        :return: True if the program was compiled without errors
+        """
+        tmp_file = "{}.{}.tmp".format(output_file, os.getpid())
+        try:
+            with open(tmp_file, "wb") as f:
+                # lexer errors are printed once, by the parsing pass
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.compiler.start_stream(f, self.lexer.tokenize(text))
+                self.parser.command_handler = self.compiler.stream_command
+                try:
+                    ast = self.parser.parse(self.lexer.tokenize(text))
+                finally:
+                    self.parser.command_handler = None
+                ok = self.compiler.finish_stream() and ast is not None
+            if ok:
+                os.replace(tmp_file, output_file)
+        finally:
+            self.compiler.reset()
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return ok
+
+    def _compile_captured(self, text):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
             try:
-                var = self.Variables[var_name]
-            except KeyError:
-                self.error = True
-                print("Error! line {}\n"
-                      "Variable '{}' was not declared\n"
-                      .format(line, var_name), file=sys.stderr)
-                return False
-
-            if var_type == "tab":
-                index = ast_node[2]
-                index_type = index[0]
-
-                if index_type == "NUM":
-                    num = int(index[1])
-                    if not self.Variables.check_if_in_bounds(var_name, num, line):
-                        return False
-                    if not self.Variables[var_name].is_initialized(num):
-                        self.error = True
-                        print("Error! line {}\n"
-                              "{} element of tab {} is not initialized\n"
-                              .format(line, num, var_name), file=sys.stderr)
-                        return False
-
-                elif index_type == "int":
-                    int_name = index[1]
-                    try:
-                        int_var = self.Variables[int_name]
-                    except KeyError:
-                        self.error = True
-                        print("Error! line {}\n"
-                              "Variable '{}' was not declared\n"
-                              .format(line, int_name), file=sys.stderr)
-                        return False
-                    if not int_var.is_initialized:
-                        self.error = True
-                        print("Error! line {}\n"
-                              "Variable '{}' was not initialized\n"
-                              .format(line, int_name), file=sys.stderr)
-                        return False
-            elif var_type == "int":
-                if var.type == "tab":
-                    self.error = True
-                    print("Error! line {}\n"
-                          "Type of '{}' is 'tab'."
-                          " One can only refer to a single element of a table using tab(n).\n"
-                          .format(line, var_name), file=sys.stderr)
-                    return False
-                elif not var.is_initialized:
-                    self.error = True
-                    print("Error! line {}\n"
-                          "Variable '{}' was not initialized\n"
-                          .format(line, var_name), file=sys.stderr)
-                    return False
-        return True
+                result = self._compile(text)
+            except Exception:
+                traceback.print_exc()
+                result = CompileResult(None, "", "", {"source_chars": len(text)})
+        result.stdout = stdout.getvalue()
+        result.stderr = stderr.getvalue()
+        return result
+
+    def _compile(self, text):
+        stats = {"source_chars": len(text)}
+        start = time.perf_counter()
+        ast = self.parser.parse(self.lexer.tokenize(text))
+        stats["parse_seconds"] = time.perf_counter() - start
+        if ast is None:
+            return CompileResult(None, "", "", stats)
+
+        start = time.perf_counter()
+        self.compiler.reset(ast)
+        self.compiler.compile(ast)
+        instructions = source_lines = None
+        if not self.compiler.check_errors():
+            instructions = self.compiler.Instructions.render()
+            source_lines = self.compiler.Instructions.source_lines.tolist()
+            stats["instructions"] = len(instructions)
+        stats["compile_seconds"] = time.perf_counter() - start
+        stats["pass_seconds"] = dict(self.compiler.passes.seconds)
+        stats["pass_counts"] = dict(self.compiler.passes.counts)
+
+        # drop references to the program, the session may live for a long time
+        self.compiler.reset()
+        return CompileResult(instructions, "", "", stats, source_lines)
+
+
+_sessions = {}  # optimization level -> CompilerSession
+
+
+def get_session(optimization=0):
+    """
+    :param optimization: optimization level, one of passes.OPTIMIZATION_LEVELS
+    :return: the module-wide CompilerSession of the level, created on the first call
+    """
+    if optimization not in _sessions:
+        _sessions[optimization] = CompilerSession(optimization=optimization)
+    return _sessions[optimization]
+
+
+def compile_source(text, capture=True, optimization=0):
+    """
+    Compiles source text in memory with a module-wide CompilerSession per optimization level.
+    :param text: source code
+    :param capture: see CompilerSession.compile_source
+    :param optimization: optimization level, one of passes.OPTIMIZATION_LEVELS
+    :return: CompileResult
+    """
+    return get_session(optimization).compile_source(text, capture)
+
+
+def print_pass_stats(stats, stream=sys.stderr):
+    """
+    Prints the time of every pass and its counters, e.g. of removed instructions.
+    :param stats: CompileResult.stats
+    :param stream: text file object
+    :return:
+    """
+    for name, seconds in stats.get("pass_seconds", {}).items():
+        counts = stats.get("pass_counts", {}).get(name, {})
+        print("{:24} {:9.3f} ms  {}".format(name, 1000 * seconds, ", ".join(
+            "{} {}".format(counter, value) for counter, value in sorted(counts.items()))),
+            file=stream)
 
 
 if __name__ == '__main__':
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    p = _Parser()
-    l = _Lexer()
-    text = open(input_file, "r")
-    text = text.read()
-    ast = p.parse(l.tokenize(text))
-    if ast is not None:
-        c = Compiler(ast, output_file)
-        c.compile(ast)
+    arg_parser = argparse.ArgumentParser(description="Compiles a program to the machine code")
+    arg_parser.add_argument("input_file")
+    arg_parser.add_argument("output_file", help="'-' writes the code to stdout")
+    arg_parser.add_argument("--cache", metavar="DIR", help="directory of the compile cache")
+    arg_parser.add_argument("--cache-size", type=int, default=256, metavar="MB",
+                            help="size limit of the compile cache")
+    arg_parser.add_argument("--cache-stats", action="store_true",
+                            help="print cache hits and misses to stderr")
+    arg_parser.add_argument("--lexer", choices=sorted(LEXERS), default="sly",
+                            help="tokenizer backend, 'fast' is meant for very big sources")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="write the code of every top-level command as soon as it is "
+                                 "parsed, for programs too big to keep in memory")
+    arg_parser.add_argument("--binary", action="store_true",
+                            help="write the code in the object format (see object_format.py)")
+    arg_parser.add_argument("-O", dest="optimization", type=int, choices=OPTIMIZATION_LEVELS,
+                            default=0, help="optimization level, -O0 (default) writes the code "
+                                            "exactly as generated by the handlers")
+    arg_parser.add_argument("--pass-stats", action="store_true",
+                            help="print the time and the counters of every pass to stderr")
+    args = arg_parser.parse_args()
+    if args.stream and args.cache:
+        arg_parser.error("--stream doesn't use the cache")
+    if args.stream and args.binary:
+        arg_parser.error("--stream writes only the text code")
+    if args.stream and args.pass_stats:
+        arg_parser.error("--stream doesn't collect the pass statistics")
+
+    cache = None
+    if args.cache:
+        cache = CompileCache(args.cache, args.cache_size * 1024 * 1024)
+    with open(args.input_file, "r") as f:
+        text = f.read()
+    to_stdout = args.output_file == "-"
+    session = CompilerSession(cache, args.lexer, args.optimization)
+    if args.stream:
+        if not to_stdout:
+            session.compile_to_file(text, args.output_file)
+            sys.exit()
+        # stdout can't be taken back after an error, the code goes through a temporary file
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = os.path.join(tmp, "out.mr")
+            if session.compile_to_file(text, output_file):
+                with open(output_file, "rb") as f:
+                    shutil.copyfileobj(f, sys.stdout.buffer)
+        sys.exit()
+    result = session.compile_source(text, capture=False)
+    if result.ok:
+        write = result.write_object if args.binary else result.write
+        if to_stdout:
+            write(sys.stdout.buffer)
+            sys.stdout.flush()
+        else:
+            with open(args.output_file, "wb") as f:
+                write(f)
+    if cache is not None and args.cache_stats:
+        print("cache: {} hits, {} misses".format(cache.hits, cache.misses), file=sys.stderr)
+    if args.pass_stats:
+        print_pass_stats(result.stats)
 
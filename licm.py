@@ -0,0 +1,144 @@
+"""
+Loop-invariant code motion, a pass of the "ast" stage. An arithmetic operation or a read of a
+table element at a variable index, inside a WHILE, REPEAT or FOR loop (its body, a WHILE or REPEAT
+condition, the bounds of an inner FOR), whose variables no command of the loop assigns, is
+computed once to a temporary cell before the loop and only loaded in it. The machine has no traps,
+so the value may be computed even if the loop or the branch reading it never runs.
+Loops are handled from the outermost one, so a value goes out of all the loops it's invariant in.
+"""
+from ast_nodes import (NUM, INT, TAB, ADD, SUB, ASSIGN, READ, WRITE, IF, IF_ELSE,
+                       WHILE, REPEAT, FOR_TO, FOR_DT, Assign)
+from arithmetic import power_of_two
+from cse import ARITHMETIC_KINDS, expression_key
+from fusion import COMPOUND, temporary_identifier
+
+LOOPS = (WHILE, REPEAT, FOR_TO, FOR_DT)
+
+
+def assigned_names(ast_node):
+    """
+    :param ast_node: loop
+    :return: sets of names of the int variables (with iterators) and of the tables the loop
+             assigns
+    """
+    ints, tabs = set(), set()
+    stack = [ast_node]
+    while stack:
+        ast_node = stack.pop()
+        if ast_node.kind in (ASSIGN, READ):
+            lvalue = ast_node.lvalue
+            (ints if lvalue.kind == INT else tabs).add(lvalue.name)
+        elif ast_node.kind in COMPOUND:
+            if ast_node.kind in (FOR_TO, FOR_DT):
+                ints.add(ast_node.iterator)
+            stack.extend(ast_node.commands)
+            if ast_node.kind == IF_ELSE:
+                stack.extend(ast_node.else_commands)
+    return ints, tabs
+
+
+def worth_hoisting(ast_node):
+    """
+    :return: whether loading a value from a cell is cheaper than computing it
+    """
+    if ast_node.kind == TAB:
+        return ast_node.index_value.kind == INT
+    if ast_node.kind not in ARITHMETIC_KINDS:
+        return False
+    numbers = [operand.value for operand in (ast_node.left, ast_node.right)
+               if operand.kind == NUM]
+    if not numbers:
+        return True
+    if ast_node.kind in (ADD, SUB):
+        return False
+    # shifts for a power of two, see Compiler.mul, div and mod
+    return all(power_of_two(number) is None for number in numbers)
+
+
+class LoopInvariants(object):
+    """
+    The pass, temporaries come from variables, the VariableManager of the compiler.
+    """
+    def __init__(self, variables):
+        self.variables = variables
+        self.counts = {}
+
+    def __call__(self, commands):
+        """
+        :param commands: list of commands, annotated by SemanticAnalyzer
+        :return: dict of counters
+        """
+        self.counts = {"hoisted": 0, "temporaries": 0}
+        stack = [commands]
+        while stack:
+            commands = stack.pop()
+            if any(ast_node.kind in LOOPS for ast_node in commands):
+                hoisted = []
+                for ast_node in commands:
+                    if ast_node.kind in LOOPS:
+                        hoisted += self.loop(ast_node)
+                    hoisted.append(ast_node)
+                commands[:] = hoisted
+            for ast_node in commands:
+                if ast_node.kind in COMPOUND:
+                    stack.append(ast_node.commands)
+                    if ast_node.kind == IF_ELSE:
+                        stack.append(ast_node.else_commands)
+        return self.counts
+
+    def loop(self, loop):
+        """
+        Replaces the invariant values of the loop by temporaries.
+        :return: list of the assignments of the temporaries, to put before the loop
+        """
+        ints, tabs = assigned_names(loop)
+        temporaries = {}  # key of a value -> its temporary
+        preheader = []
+
+        def invariant(ast_value):
+            if ast_value.kind == NUM:
+                return True
+            if ast_value.kind == INT:
+                return ast_value.name not in ints
+            if ast_value.kind == TAB:
+                return ast_value.name not in tabs and invariant(ast_value.index_value)
+            return invariant(ast_value.left) and invariant(ast_value.right)
+
+        def hoist(node, attribute):
+            ast_value = getattr(node, attribute)
+            if worth_hoisting(ast_value) and invariant(ast_value):
+                key = expression_key(ast_value)
+                temporary = temporaries.get(key)
+                if temporary is None:
+                    temporary = self.variables.new_temporary(ast_value.lineno)
+                    temporaries[key] = temporary
+                    preheader.append(Assign(temporary_identifier(temporary, ast_value), ast_value,
+                                            loop.lineno, loop.index, loop.end))
+                    self.counts["temporaries"] += 1
+                setattr(node, attribute, temporary_identifier(temporary, ast_value))
+                self.counts["hoisted"] += 1
+            elif ast_value.kind in ARITHMETIC_KINDS:
+                hoist(ast_value, "left")
+                hoist(ast_value, "right")
+
+        if loop.kind in (WHILE, REPEAT):
+            hoist(loop.condition, "left")
+            hoist(loop.condition, "right")
+        stack = loop.commands[::-1]
+        while stack:
+            ast_node = stack.pop()
+            if ast_node.kind == ASSIGN:
+                hoist(ast_node, "rvalue")
+            elif ast_node.kind == WRITE:
+                hoist(ast_node, "value")
+            elif ast_node.kind in (IF, IF_ELSE, WHILE, REPEAT):
+                hoist(ast_node.condition, "left")
+                hoist(ast_node.condition, "right")
+            elif ast_node.kind in (FOR_TO, FOR_DT):
+                hoist(ast_node, "start")
+                hoist(ast_node, "stop")
+            if ast_node.kind == IF_ELSE:
+                stack.extend(ast_node.else_commands[::-1])
+            if ast_node.kind in COMPOUND:
+                stack.extend(ast_node.commands[::-1])
+        return preheader
@@ -1,79 +1,229 @@
+import io
+from array import array
+from bisect import bisect_left
+
+
 def divide(module, divisor):
     temp = divisor
     while temp < module:
         temp *= 2
 
 
+# opcodes of the virtual machine
+GET = 0
+PUT = 1
+LOAD = 2
+STORE = 3
+ADD = 4
+SUB = 5
+RESET = 6
+INC = 7
+DEC = 8
+SHR = 9
+SHL = 10
+JUMP = 11
+JZERO = 12
+JODD = 13
+HALT = 14
+OPCODES = ("GET", "PUT", "LOAD", "STORE", "ADD", "SUB", "RESET", "INC", "DEC", "SHR", "SHL",
+           "JUMP", "JZERO", "JODD", "HALT")
+# cost of executing an instruction on the virtual machine, by opcode
+COSTS = (100, 100, 20, 20, 5, 5, 1, 1, 1, 1, 1, 1, 1, 1, 0)
+
+REGISTERS = "abcdef"
+REGISTER_IDS = dict([(r, i) for i, r in enumerate(REGISTERS)] +
+                    [(r.upper(), i) for i, r in enumerate(REGISTERS)])
+NO_REGISTER = -1
+
+# An instruction is one integer: opcode in the lowest 4 bits, then register x and register y
+# (3 bits each, register id + 1, 0 if there is none) and above them the operand, which is a label
+# number of a jump until resolve_labels makes it a relative offset.
+X_SHIFT = 4
+Y_SHIFT = 7
+OPERAND_SHIFT = 10
+FORM_MASK = (1 << OPERAND_SHIFT) - 1
+X = dict((name, (i + 1) << X_SHIFT) for name, i in REGISTER_IDS.items())
+Y = dict((name, (i + 1) << Y_SHIFT) for name, i in REGISTER_IDS.items())
+
+
+def encode(opcode, x=NO_REGISTER, y=NO_REGISTER, operand=0):
+    return opcode | (x + 1) << X_SHIFT | (y + 1) << Y_SHIFT | operand << OPERAND_SHIFT
+
+
+def decode(instruction):
+    """
+    :return: opcode, register x, register y and operand of an encoded instruction
+    """
+    return (instruction & 15, (instruction >> X_SHIFT & 7) - 1, (instruction >> Y_SHIFT & 7) - 1,
+            instruction >> OPERAND_SHIFT)
+
+
+def _text(form):
+    opcode, x, y, _ = decode(form)
+    if opcode >= len(OPCODES) or x >= len(REGISTERS) or y >= len(REGISTERS):
+        return None
+    text = OPCODES[opcode]
+    for register in (x, y):
+        if register != NO_REGISTER:
+            text += " " + REGISTERS[register]
+    if JUMP <= opcode <= JODD:
+        text += " "  # the offset follows
+    return text
+
+
+# text of every opcode and registers combination
+TEXT = [_text(form) for form in range(FORM_MASK + 1)]
+# instructions joined into one write call of the output
+WRITE_CHUNK = 1 << 16
+
+
+def render(code, debug, start=0, stop=None, commented=None):
+    """
+    :param code: sequence of encoded instructions with resolved labels
+    :param debug: dict instruction number -> comment
+    :param start: number of the first instruction
+    :param stop: number after the last instruction, by default the end of code
+    :param commented: sorted numbers of instructions with debug comments, if already known
+    :return: list of instructions as text, without new lines
+    """
+    if stop is None:
+        stop = len(code)
+    text = TEXT
+    lines = []
+    append = lines.append
+    for instruction in code[start:stop]:
+        line = text[instruction & FORM_MASK]
+        if line[-1] == " ":
+            line += str(instruction >> OPERAND_SHIFT)
+        append(line)
+    if commented is None:
+        commented = sorted(debug)
+    for number in commented[bisect_left(commented, start):bisect_left(commented, stop)]:
+        lines[number - start] += debug[number]
+    return lines
+
+
+def write_lines(lines, stream):
+    """
+    Writes instructions, WRITE_CHUNK of them per write call.
+    :param lines: list of instructions as text, without new lines
+    :param stream: text or binary file object
+    :return: number of written instructions
+    """
+    binary = not isinstance(stream, io.TextIOBase)
+    for start in range(0, len(lines), WRITE_CHUNK):
+        chunk = "\n".join(lines[start:start + WRITE_CHUNK]) + "\n"
+        stream.write(chunk.encode("ascii") if binary else chunk)
+    return len(lines)
+
+
 class MachineInstructions(object):
+    """
+    Emitted code as an array of encoded instructions (see encode) and labels as an array of
+    instruction numbers. Jumps keep a label number until resolve_labels turns it into a relative
+    offset, the text is made only by render. Debug comments are kept apart, by instruction number.
+    source_lines has pairs: number of an instruction, source line of the code from it onwards.
+    """
     def __init__(self):
-        self.instructions = []
-        self.labels_counter = 0
+        self.code = array('q')
+        self.labels = array('q')
+        self.jumps = array('q')  # positions in code of jumps with unresolved labels
+        self.debug = {}
+        self.source_lines = array('q')
+
+    def clear(self):
+        # new arrays, a flushed stream starts small again
+        self.code = array('q')
+        self.labels = array('q')
+        self.jumps = array('q')
+        self.debug = {}
+        self.source_lines = array('q')
+
+    def __len__(self):
+        return len(self.code)
+
+    def mark_line(self, line):
+        """
+        Code emitted from now on comes from the given source line.
+        """
+        source_lines = self.source_lines
+        if source_lines and source_lines[-1] == line:
+            return
+        if source_lines and source_lines[-2] == len(self.code):
+            source_lines[-1] = line  # nothing was emitted for the previous line
+        else:
+            source_lines.extend((len(self.code), line))
 
     def new_label(self):
-        label = "LABEL" + str(self.labels_counter)
-        self.labels_counter += 1
-        return label
+        self.labels.append(-1)
+        return len(self.labels) - 1
 
     def put_label(self, label):
-        self.instructions.append(label)
-
-    def remove_labels(self):
-        labels = {}
-        i = 0
-        while len(self.instructions) > i:
-            instr = self.instructions[i]
-            if instr[0:5] == "LABEL":
-                labels[instr] = i
-                self.instructions.remove(instr)
-            else:
-                i += 1
-        i = 0
-        for instr in self.instructions:
-            if 'LABEL' in instr:
-                label = instr[instr.index("LABEL"):]
-                offset = labels[label] - i
-                self.instructions[i] = instr.replace(label, str(offset)).strip()
-            i += 1
+        self.labels[label] = len(self.code)
+
+    def resolve_labels(self):
+        """
+        Replaces labels of jumps with offsets, in one pass over the jumps.
+        """
+        code, labels = self.code, self.labels
+        for position in self.jumps:
+            instruction = code[position]
+            offset = labels[instruction >> OPERAND_SHIFT] - position
+            code[position] = instruction & FORM_MASK | offset << OPERAND_SHIFT
+        self.jumps = array('q')
+
+    def render(self, start=0, stop=None, commented=None):
+        """
+        :return: list of instructions as text, without new lines, see render
+        """
+        return render(self.code, self.debug, start, stop, commented)
+
+    def write(self, stream):
+        """
+        Writes the resolved code, rendered and written WRITE_CHUNK instructions at a time, so its
+        whole text is never in memory.
+        :param stream: text or binary file object
+        :return: number of written instructions
+        """
+        commented = list(self.debug)  # comments are added in the order of instructions
+        for start in range(0, len(self.code), WRITE_CHUNK):
+            write_lines(self.render(start, start + WRITE_CHUNK, commented), stream)
+        return len(self.code)
+
+    def _debug(self, debug):
+        if debug:
+            self.debug[len(self.code)] = debug
 
     def get(self, x, debug=""):
-        x = x.lower()
-        self.instructions.append("GET " + x + debug)
+        self._debug(debug)
+        self.code.append(GET | X[x])
 
     def put(self, x):
-        x = x.lower()
-        self.instructions.append("PUT " + x)
+        self.code.append(PUT | X[x])
 
     def load(self, x, y, debug=""):
-        x = x.lower()
-        y = y.lower()
-        self.instructions.append("LOAD " + x + " " + y + debug)
+        self._debug(debug)
+        self.code.append(LOAD | X[x] | Y[y])
 
     def store(self, x, y, debug=""):
-        x = x.lower()
-        y = y.lower()
-        self.instructions.append("STORE " + x + " " + y + debug)
+        self._debug(debug)
+        self.code.append(STORE | X[x] | Y[y])
 
     def add(self, x, y):
-        x = x.lower()
-        y = y.lower()
-        self.instructions.append("ADD " + x + " " + y)
+        self.code.append(ADD | X[x] | Y[y])
 
     def sub(self, x, y):
-        x = x.lower()
-        y = y.lower()
-        self.instructions.append("SUB " + x + " " + y)
+        self.code.append(SUB | X[x] | Y[y])
 
     def reset(self, x, debug=""):
-        x = x.lower()
-        self.instructions.append("RESET " + x + debug)
+        self._debug(debug)
+        self.code.append(RESET | X[x])
 
     def inc(self, x):
-        x = x.lower()
-        self.instructions.append("INC " + x)
+        self.code.append(INC | X[x])
 
     def dec(self, x):
-        x = x.lower()
-        self.instructions.append("DEC " + x)
+        self.code.append(DEC | X[x])
 
     def shr(self, x):
         """
@@ -81,8 +231,7 @@ class MachineInstructions(object):
         :param x: register name
         :return:
         """
-        x = x.lower()
-        self.instructions.append("SHR " + x)
+        self.code.append(SHR | X[x])
 
     def shl(self, x):
         """
@@ -90,25 +239,22 @@ class MachineInstructions(object):
         :param x: register name
         :return:
         """
-        x = x.lower()
-        self.instructions.append("SHL " + x)
+        self.code.append(SHL | X[x])
 
     def jump(self, j):
-        self.instructions.append("JUMP " + j)
+        self.jumps.append(len(self.code))
+        self.code.append(JUMP | j << OPERAND_SHIFT)
 
     def jzero(self, x, j):
-        x = x.lower()
-        self.instructions.append("JZERO " + x + " " + j)
+        self.jumps.append(len(self.code))
+        self.code.append(JZERO | X[x] | j << OPERAND_SHIFT)
 
     def jodd(self, x, j):
-        x = x.lower()
-        self.instructions.append("JODD " + x + " " + j)
+        self.jumps.append(len(self.code))
+        self.code.append(JODD | X[x] | j << OPERAND_SHIFT)
 
     def halt(self):
-        self.instructions.append("HALT")
+        self.code.append(HALT)
 
     def generate_out_code(self):
-        output_code = ""
-        for inst in self.instructions:
-            output_code += inst + "\n"
-        return output_code
+        return "".join(inst + "\n" for inst in self.render())
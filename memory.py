@@ -1,14 +1,24 @@
+from bisect import bisect_left
+
+
 class MemoryManager(object):
     """
     class imitating memory cells. address is an integer.
     """
     def __init__(self):
-        # memory tab shows cells, that are already in use.
+        # memory tab shows cells, that are already in use. It is kept sorted.
         self.memory = [1]  # some of the first values are reserved
         self.big_tab_bounds = []  # (123431, 991344) means that cells in 123431-991344 are reserved
         self.iterators_cells = 0
+        self.iterators_end = 2  # cells from here on were never given to an iterator
         # 1 reserved for printing a number value
 
+    def clear(self):
+        self.memory[:] = [1]
+        self.big_tab_bounds.clear()
+        self.iterators_cells = 0
+        self.iterators_end = 2
+
     def check_big_tab_bounds(self, i):
         for bound in self.big_tab_bounds:
             lower = bound[0]
@@ -17,14 +27,14 @@ class MemoryManager(object):
                 return False, upper
         return True, i
 
-    def allocate(self, cells_number):
+    def allocate(self, cells_number, first_cell=None):
         if cells_number > 1000:
             address = self.memory[-1] + 1
             self.big_tab_bounds.append((address, address + cells_number))
             return address
 
-        address = self.find_free_space(cells_number)
-        index = self.memory.index(address - 1) + 1
+        address = self.find_free_space(cells_number, first_cell)
+        index = bisect_left(self.memory, address)
         self.memory[index:index] = [i for i in range(address, address + cells_number)]
         return address
         # TODO: alloc tab differently !!! IMPORTANT
@@ -33,6 +43,7 @@ class MemoryManager(object):
         address = self.find_free_space(1, first_cell=2)
         index = self.memory.index(address - 1) + 1
         self.memory[index:index] = [address]
+        self.iterators_end = max(self.iterators_end, address + 1)
         return address
 
     def deallocate(self, cell, cells_number):
@@ -80,14 +91,29 @@ class MemoryManager(object):
         if not outof_big_tab2:
             return False, bound2
 
-        for j in range(i, i + rng):
-            if i == self.memory[-1]:
-                return True, i + 1
-            if j in self.memory:
-                k = j + 1
-                while k in self.memory:
-                    k += 1
-                return False, k  # can't allocate next rng cells starting from i
+        if rng > 0 and i == self.memory[-1]:
+            return True, i + 1
+        # the first used cell from i on, binary search instead of checking cells one by one
+        first_used = bisect_left(self.memory, i)
+        if first_used < len(self.memory) and self.memory[first_used] < i + rng:
+            # can't allocate next rng cells starting from i
+            return False, self._end_of_used_cells(first_used)
         return True, i  # next rng cells counting from i are free. allocation from cell i available
 
+    def _end_of_used_cells(self, position):
+        """
+        :param position: index of a used cell in self.memory
+        :return: the first free cell after the block of consecutive used cells containing it
+        """
+        # memory[k] - k is constant inside a block of consecutive cells and grows after a gap
+        block = self.memory[position] - position
+        low, high = position, len(self.memory)
+        while low < high:
+            middle = (low + high) // 2
+            if self.memory[middle] - middle == block:
+                low = middle + 1
+            else:
+                high = middle
+        return self.memory[low - 1] + 1
+
 
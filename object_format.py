@@ -0,0 +1,279 @@
+"""
+Binary object format of compiled programs, a compact replacement of the text machine code.
+Usage: python object_format.py asm INPUT.mr OUTPUT.mro
+       python object_format.py dis INPUT.mro [OUTPUT.mr]   (stdout without OUTPUT)
+
+Layout, little endian:
+    header      magic, version, word size (4 or 8), number of instructions, sizes of the tables
+    code        one word per instruction, encoded as in machine_instructions (encode), jumps with
+                their relative offsets; 4 byte words unless an offset doesn't fit in 22 bits
+    debug       comments of instructions: varint delta of the instruction number, then kind 0 and
+                a varint n for ' (generating n)' or kind 1, varint length and UTF-8 text
+    lines       optional source line table: varint delta of the instruction number and zigzag
+                varint delta of the line, for every change of the line
+The code words are aligned, so the loader uses them straight from the memory-mapped file.
+"""
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+
+from machine_instructions import (OPCODES, REGISTERS, LOAD, STORE, ADD, SUB, JUMP, HALT, TEXT,
+                                  encode, render, write_lines)
+
+MAGIC = b"IMPO"
+VERSION = 1
+# magic, version, word size, reserved, instructions, debug table bytes, line table bytes
+HEADER = struct.Struct("<4sBBHQII")
+GENERATING = " (generating {})"
+WORD_TYPES = {4: 'i', 8: 'q'}
+# registers of an instruction, the other ones have one
+REGISTER_COUNT = {LOAD: 2, STORE: 2, ADD: 2, SUB: 2, JUMP: 0, HALT: 0}
+
+
+def _forms():
+    registers = range(len(REGISTERS))
+    for opcode in range(len(OPCODES)):
+        count = REGISTER_COUNT.get(opcode, 1)
+        if count == 0:
+            yield encode(opcode)
+        for x in registers:
+            if count == 1:
+                yield encode(opcode, x)
+            for y in registers if count == 2 else ():
+                yield encode(opcode, x, y)
+
+
+# encoded instruction without operand for every valid text of an instruction, with a trailing
+# space for jumps
+FORMS = dict((TEXT[form], form) for form in _forms())
+
+
+class ObjectFormatError(Exception):
+    pass
+
+
+def write_varint(out, value):
+    while value > 127:
+        out.append(value & 127 | 128)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, position):
+    """
+    :return: value and the position after it
+    """
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 127) << shift
+        if byte < 128:
+            return value, position
+        shift += 7
+
+
+def assemble(lines):
+    """
+    Encodes machine code from its text, the inverse of render.
+    :param lines: instructions as text, without new lines
+    :return: array of encoded instructions, dict instruction number -> debug comment
+    """
+    forms = FORMS
+    code = array('q')
+    append = code.append
+    debug = {}
+    for number, line in enumerate(lines):
+        form = forms.get(line)
+        if form is not None:
+            append(form)
+            continue
+        # a jump or an instruction with a comment
+        fields = line.split(" ")
+        for end in range(1, min(len(fields), 3) + 1):
+            text = " ".join(fields[:end])
+            if text in forms:
+                form = forms[text]
+                break
+            if text + " " in forms and end < len(fields):  # jump, the offset follows
+                offset = fields[end]
+                if offset.lstrip("-").isdecimal() and str(int(offset)) == offset:
+                    form = encode(forms[text + " "], operand=int(offset))
+                    end += 1
+                break
+        if form is None:
+            raise ObjectFormatError("line {}: not an instruction: {!r}".format(number + 1, line))
+        text = " ".join(fields[:end])
+        if len(line) > len(text):
+            debug[number] = line[len(text):]
+        append(form)
+    return code, debug
+
+
+def dump(code, debug, stream, source_lines=None):
+    """
+    Writes a program in the object format.
+    :param code: encoded instructions with resolved labels
+    :param debug: dict instruction number -> comment
+    :param stream: binary file object
+    :param source_lines: pairs (instruction number, source line) flattened, or None
+    :return:
+    """
+    try:
+        words = array('i', code)
+    except OverflowError:
+        words = array('q', code)
+    if sys.byteorder != "little":
+        words.byteswap()
+
+    debug_table = bytearray()
+    previous = 0
+    for number in sorted(debug):
+        comment = debug[number]
+        write_varint(debug_table, number - previous)
+        previous = number
+        value = comment[len(GENERATING) - 3:-1]
+        if value.isdecimal() and comment == GENERATING.format(int(value)):
+            debug_table.append(0)
+            write_varint(debug_table, int(value))
+        else:
+            text = comment.encode()
+            debug_table.append(1)
+            write_varint(debug_table, len(text))
+            debug_table += text
+
+    line_table = bytearray()
+    previous_number = previous_line = 0
+    for i in range(0, len(source_lines or ()), 2):
+        number, line = source_lines[i], source_lines[i + 1]
+        write_varint(line_table, number - previous_number)
+        delta = line - previous_line
+        write_varint(line_table, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+        previous_number, previous_line = number, line
+
+    stream.write(HEADER.pack(MAGIC, VERSION, words.itemsize, 0, len(words), len(debug_table),
+                             len(line_table)))
+    stream.write(words.tobytes())
+    stream.write(debug_table)
+    stream.write(line_table)
+
+
+class ObjectFile(object):
+    """
+    Program loaded from the object format. The file is memory-mapped and code is a view of its
+    words, only the debug and line tables are decoded.
+    code - sequence of encoded instructions
+    debug - dict instruction number -> comment
+    source_lines - list of pairs (instruction number, source line), empty without the table
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise ObjectFormatError("file too short")
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self):
+        data = self._map
+        if len(data) < HEADER.size:
+            raise ObjectFormatError("file too short")
+        magic, version, word_size, _, count, debug_size, lines_size = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or word_size not in WORD_TYPES:
+            raise ObjectFormatError("not an object file of version {}".format(VERSION))
+        start = HEADER.size
+        end = start + count * word_size
+        if len(data) != end + debug_size + lines_size:
+            raise ObjectFormatError("wrong file size")
+        self._view = memoryview(data)
+        self.code = self._view[start:end].cast(WORD_TYPES[word_size])
+        if sys.byteorder != "little":
+            words = array(WORD_TYPES[word_size], self.code)
+            words.byteswap()
+            self.code.release()
+            self.code = words
+
+        self.debug = {}
+        position, number = end, 0
+        while position < end + debug_size:
+            delta, position = read_varint(data, position)
+            number += delta
+            kind = data[position]
+            if kind == 0:
+                value, position = read_varint(data, position + 1)
+                self.debug[number] = GENERATING.format(value)
+            else:
+                length, position = read_varint(data, position + 1)
+                self.debug[number] = data[position:position + length].decode()
+                position += length
+
+        self.source_lines = []
+        number = line = 0
+        while position < len(data):
+            delta, position = read_varint(data, position)
+            number += delta
+            delta, position = read_varint(data, position)
+            line += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+            self.source_lines.append((number, line))
+
+    def __len__(self):
+        return len(self.code)
+
+    def disassemble(self):
+        """
+        :return: list of instructions as text, exactly as the compiler writes them
+        """
+        return render(self.code, self.debug)
+
+    def close(self):
+        if getattr(self, "code", None) is not None and isinstance(self.code, memoryview):
+            self.code.release()
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path):
+    return ObjectFile(path)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Object format of the machine code")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    asm = commands.add_parser("asm", help="text machine code to an object file")
+    asm.add_argument("input_file")
+    asm.add_argument("output_file")
+    dis = commands.add_parser("dis", help="object file to text machine code")
+    dis.add_argument("input_file")
+    dis.add_argument("output_file", nargs="?", default="-")
+    args = arg_parser.parse_args()
+
+    try:
+        if args.command == "asm":
+            with open(args.input_file, "r") as f:
+                code, debug = assemble(f.read().splitlines())
+            with open(args.output_file, "wb") as f:
+                dump(code, debug, f)
+        else:
+            with load(args.input_file) as obj:
+                lines = obj.disassemble()
+            if args.output_file == "-":
+                write_lines(lines, sys.stdout.buffer)
+            else:
+                with open(args.output_file, "wb") as f:
+                    write_lines(lines, f)
+    except ObjectFormatError as e:
+        print("Error! {}".format(e), file=sys.stderr)
+        sys.exit(1)
@@ -1,27 +1,94 @@
 import sys
 
 from sly import Parser
+from sly.yacc import LRTable, YaccError
 from lex import _Lexer
+from ast_nodes import (NUM, FOR_TO, FOR_DT, ARITHMETIC, RELATIONS, Num, Identifier, TabElement,
+                       BinaryOperation, Assign, If, IfElse, While, Repeat, For, Read, Write,
+                       IntDeclaration, TabDeclaration, Program)
+import parser_tables
+
+
+def _token(p, n):
+    """
+    n-th symbol of the production, for the position of a token which is not the first one.
+    """
+    return p._slice[n]
 
 
 class _Parser(Parser):
     tokens = _Lexer.tokens
+    # nodes keep their own spans, sly doesn't have to remember positions of every reduction
+    track_positions = False
 
     def __init__(self):
         self.variables = []
-
-    @_('DECLARE declarations BEGIN commands END')
+        # called with (declarations, command) for every top-level command instead of keeping it
+        # in the program, see top_commands
+        self.command_handler = None
+        # sly used to give every declaration the line of the first one, error messages keep it
+        self._declarations_lineno = None
+
+    def parse(self, tokens):
+        # the same parser object may be used for many programs
+        self.variables = []
+        return super().parse(tokens)
+
+    @classmethod
+    def _build(cls, definitions):
+        """
+        Replaces sly's table construction, so the LALR table can be read from parser_tables cache.
+        sly skips its own build for classes defining _build, hence the grammar steps are repeated
+        here through their name-mangled names, with its reports: the conflicts of a table built
+        now (a cached one was built from the same grammar, so they were reported then) and the
+        debugfile.
+        """
+        rules = cls._Parser__collect_rules(definitions)
+        if not cls._Parser__validate_specification():
+            raise YaccError('Invalid parser specification')
+        cls._Parser__build_grammar(rules)
+        cls._lrtable = parser_tables.get_lrtable(cls._grammar)
+        if isinstance(cls._lrtable, LRTable):
+            cls._report_conflicts(len(cls._lrtable.sr_conflicts), 'shift/reduce',
+                                  getattr(cls, 'expected_shift_reduce', None))
+            cls._report_conflicts(len(cls._lrtable.rr_conflicts), 'reduce/reduce',
+                                  getattr(cls, 'expected_reduce_reduce', None))
+
+        if cls.debugfile:
+            # a cached table has no states to describe
+            lrtable = cls._lrtable if isinstance(cls._lrtable, LRTable) else LRTable(cls._grammar)
+            with open(cls.debugfile, 'w') as f:
+                f.write(str(cls._grammar))
+                f.write('\n')
+                f.write(str(lrtable))
+            cls.log.info('Parser debugging for %s written to %s', cls.__qualname__, cls.debugfile)
+
+    @classmethod
+    def _report_conflicts(cls, number, kind, expected):
+        """
+        Warns like sly about the conflicts of one kind, unless there are as many as expected.
+        """
+        if number != expected:
+            if number == 1:
+                cls.log.warning('1 %s conflict', kind)
+            elif number > 1:
+                cls.log.warning('%d %s conflicts', number, kind)
+
+    @_('DECLARE declarations BEGIN top_commands END')
     def program(self, p):
-        return ("PROGRAM", p.declarations, p.commands)
+        return Program(p.declarations, p.top_commands, p.lineno, p.index, p.end)
 
-    @_('BEGIN commands END')
+    @_('BEGIN top_commands END')
     def program(self, p):
-        return ("PROGRAM", [], p.commands)
+        return Program([], p.top_commands, p.lineno, p.index, p.end)
 
     @_('declarations COMMA PIDENTIFIER LB NUM COL NUM RB')
     def declarations(self, p):
         if p.declarations is not None:
-            self.variables.append(("tab", p[2], p[4], p[6], p.lineno))
+            name = _token(p, 2)
+            self.variables.append(TabDeclaration(p[2], int(p[4]), int(p[6]),
+                                                 self._declarations_lineno or p.lineno,
+                                                 name.index, p.end))
             return p.declarations
         else:
             return
@@ -29,25 +96,50 @@ class _Parser(Parser):
     @_('declarations COMMA PIDENTIFIER')
     def declarations(self, p):
         if p.declarations is not None:
-            self.variables.append(("int", p[2], p.lineno))
+            self.variables.append(IntDeclaration(p[2], self._declarations_lineno or p.lineno,
+                                                 _token(p, 2).index, p.end))
             return p.declarations
         else:
             return
 
     @_('PIDENTIFIER LB NUM COL NUM RB')
     def declarations(self, p):
-        self.variables.append(("tab", p[0], p[2], p[4], p.lineno))
+        self._declarations_lineno = p.lineno
+        self.variables.append(TabDeclaration(p[0], int(p[2]), int(p[4]), p.lineno, p.index,
+                                             p.end))
         return self.variables
 
     @_('PIDENTIFIER')
     def declarations(self, p):
-        self.variables.append(("int", p[0], p.lineno))
+        self._declarations_lineno = p.lineno
+        self.variables.append(IntDeclaration(p[0], p.lineno, p.index, p.end))
         return self.variables
 
     @_('')
     def declarations(self, p):
+        self._declarations_lineno = None
         return self.variables
 
+    @_('top_commands command')
+    def top_commands(self, p):
+        return self.top_command(p.top_commands, p.command)
+
+    @_('command')
+    def top_commands(self, p):
+        return self.top_command([], p.command)
+
+    def top_command(self, cmds, command):
+        """
+        Commands of the program body are separated from the nested ones, so that a compiler can
+        take each of them as soon as it is reduced. With a command_handler the command is passed
+        on and the returned list stays empty.
+        """
+        if self.command_handler is not None:
+            self.command_handler(self.variables, command)
+        else:
+            cmds.append(command)
+        return cmds
+
     @_('commands command')
     def commands(self, p):
         cmds = p.commands
@@ -60,40 +152,40 @@ class _Parser(Parser):
 
     @_('identifier ASSIGN expression SEMICOL')
     def command(self, p):
-        # if p[0][1] in [v[1] for v in self.variables]:
-        return ("ASSIGN", p.identifier, p.expression, p.lineno)
+        lvalue = p.identifier
+        return Assign(lvalue, p.expression, lvalue.lineno, lvalue.index, p.end)
 
     @_('IF condition THEN commands ELSE commands ENDIF')
     def command(self, p):
-        return ("IF_ELSE", p.condition, p.commands0, p.commands1, p.lineno)
+        return IfElse(p.condition, p.commands0, p.commands1, p.lineno, p.index, p.end)
 
     @_('IF condition THEN commands ENDIF')
     def command(self, p):
-        return ("IF", p.condition, p.commands, p.lineno)
+        return If(p.condition, p.commands, p.lineno, p.index, p.end)
 
     @_('WHILE condition DO commands ENDWHILE')
     def command(self, p):
-        return ("WHILE", p.condition, p.commands, p.lineno)
+        return While(p.condition, p.commands, p.lineno, p.index, p.end)
 
     @_('REPEAT commands UNTIL condition SEMICOL')
     def command(self, p):
-        return ("REPEAT", p.condition, p.commands, p.lineno)
+        return Repeat(p.condition, p.commands, p.lineno, p.index, p.end)
 
     @_('FOR PIDENTIFIER FROM value TO value DO commands ENDFOR')
     def command(self, p):
-        return ("FOR_TO", p[1], p.value0, p.value1, p.commands, p.lineno)
+        return For(FOR_TO, p[1], p.value0, p.value1, p.commands, p.lineno, p.index, p.end)
 
     @_('FOR PIDENTIFIER FROM value DOWNTO value DO commands ENDFOR')
     def command(self, p):
-        return ("FOR_DT", p[1], p.value0, p.value1, p.commands, p.lineno)
+        return For(FOR_DT, p[1], p.value0, p.value1, p.commands, p.lineno, p.index, p.end)
 
     @_('READ identifier SEMICOL')
     def command(self, p):
-        return ("READ", p.identifier, p.lineno)
+        return Read(p.identifier, p.lineno, p.index, p.end)
 
     @_('WRITE value SEMICOL')
     def command(self, p):
-        return ("WRITE", p.value, p.lineno)
+        return Write(p.value, p.lineno, p.index, p.end)
 
     @_('value')
     def expression(self, p):
@@ -103,25 +195,27 @@ class _Parser(Parser):
        'value MUL value', 'value DIV value',
        'value MOD value')
     def expression(self, p):
-        if p.value0 == p.value1:
+        left, right = p.value0, p.value1
+        if left.key() == right.key():
             if p[1] == '-':
-                return ("NUM", "0", p.lineno)
+                return Num(0, left.lineno, left.index, right.end)
             elif p[1] == '%':
-                return ("NUM", "0", p.lineno)
+                return Num(0, left.lineno, left.index, right.end)
         elif p[1] == "*" or p[1] == "/":
-            if any(v[0] == "NUM" and v[1] == "0" for v in [p.value0, p.value1]):
-                return ("NUM", "0", p.lineno)
-        return (p[1], p.value0, p.value1, p.lineno)
+            if any(v.kind == NUM and v.value == 0 for v in [left, right]):
+                return Num(0, left.lineno, left.index, right.end)
+        return BinaryOperation(ARITHMETIC[p[1]], left, right, left.lineno, left.index, right.end)
 
     @_('value EQ value', 'value NEQ value',
        'value LT value', 'value GT value',
        'value LEQ value', 'value GEQ value')
     def condition(self, p):
-        return (p[1], p.value0, p.value1, p.lineno)
+        left, right = p.value0, p.value1
+        return BinaryOperation(RELATIONS[p[1]], left, right, left.lineno, left.index, right.end)
 
     @_('NUM')
     def value(self, p):
-        return ("NUM", p[0])
+        return Num(int(p[0]), p.lineno, p.index, p.end)
 
     @_('identifier')
     def value(self, p):
@@ -129,7 +223,7 @@ class _Parser(Parser):
 
     @_('PIDENTIFIER')
     def identifier(self, p):
-        return ("int", p[0], p.lineno)
+        return Identifier(p[0], p.lineno, p.index, p.end)
 
     @_('PIDENTIFIER LB PIDENTIFIER RB')
     def identifier(self, p):
@@ -139,11 +233,15 @@ class _Parser(Parser):
         #           " One can only refer to a single element of a table.\n"
         #           .format(p.lineno, p[2][1]), file=sys.stderr)
         #     raise KeyError
-        return ("tab", p[0], ("int", p[2], p.lineno), p.lineno)
+        index = _token(p, 2)
+        return TabElement(p[0], Identifier(p[2], p.lineno, index.index, index.end), p.lineno,
+                          p.index, p.end)
 
     @_('PIDENTIFIER LB NUM RB')
     def identifier(self, p):
-        return ("tab", p[0], ("NUM", p[2]), p.lineno)
+        index = _token(p, 2)
+        return TabElement(p[0], Num(int(p[2]), p.lineno, index.index, index.end), p.lineno,
+                          p.index, p.end)
 
 
 if __name__ == '__main__':
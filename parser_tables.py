@@ -0,0 +1,90 @@
+import hashlib
+import marshal
+import os
+
+import sly
+from sly.yacc import LRTable
+
+# bump whenever the layout of the cached file changes
+TABLES_VERSION = 1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+CACHE_FILE = os.path.join(CACHE_DIR, "parsetab.v{}.marshal".format(TABLES_VERSION))
+
+
+class CachedTable(object):
+    """
+    LALR table restored from the cache. Holds only what sly.Parser.parse reads.
+    """
+    def __init__(self, lr_action, lr_goto, defaulted_states):
+        self.lr_action = lr_action
+        self.lr_goto = lr_goto
+        self.defaulted_states = defaulted_states
+
+
+def is_enabled():
+    return os.environ.get("KOMPILATOR_TABLE_CACHE", "1") != "0"
+
+
+def grammar_signature(grammar):
+    """
+    Hash of everything the LALR table depends on: terminals, productions (in their numbering
+    order), precedence and the start symbol. Changing any grammar rule in parser.py or a token
+    in lex.py gives a different signature.
+    :param grammar: sly.yacc.Grammar built from _Parser
+    :return: hex digest
+    """
+    description = repr((
+        TABLES_VERSION,
+        sly.__version__,
+        sorted(grammar.Terminals),
+        [(p.name, p.prod, p.prec) for p in grammar.Productions if p is not None],
+        grammar.Start,
+    ))
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def load(signature, path=CACHE_FILE):
+    try:
+        with open(path, "rb") as f:
+            cached_signature, action, goto, defaulted = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if cached_signature != signature:
+        return None
+    return CachedTable(action, goto, defaulted)
+
+
+def save(signature, lrtable, path=CACHE_FILE):
+    """
+    Writes the table atomically, so concurrent compiler processes never read half a file.
+    A read-only installation just keeps building the table on every start.
+    """
+    data = (signature, lrtable.lr_action, lrtable.lr_goto, lrtable.defaulted_states)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def get_lrtable(grammar):
+    """
+    Returns LALR table for the grammar, loading it from the cache when the grammar did not
+    change since the table was generated.
+    :param grammar: sly.yacc.Grammar
+    :return: object with lr_action, lr_goto and defaulted_states
+    """
+    if not is_enabled():
+        return LRTable(grammar)
+    signature = grammar_signature(grammar)
+    table = load(signature)
+    if table is None:
+        table = LRTable(grammar)
+        save(signature, table)
+    return table
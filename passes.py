@@ -0,0 +1,113 @@
+"""
+Optimization passes and the pass manager running them.
+A pass is a function of the unit it changes: the list of commands (stage "ast", after the
+semantic analysis) or the IRCode (stage "ir", before lowering). It may return a dict of counters,
+e.g. of applied rewrites, which are summed up per pass. A pass keeping state between units (a
+program compiled command by command is one unit per command) is an object with a clear method,
+which the manager calls when it's cleared. Passes of a level run also on every level
+above it; at level 0 nothing runs and the code is exactly the one written by the handlers.
+The code of every level has to write the same numbers as at level 0, see differential.py.
+"""
+import time
+
+from cse import CommonSubexpressions
+from folding import ConstantFolder
+from fusion import DivisionFusion
+from licm import LoopInvariants
+from peephole import Peephole
+
+OPTIMIZATION_LEVELS = (0, 1, 2)
+
+
+class PassManager(object):
+    """
+    Ordered passes of one optimization level. seconds and counts are the totals of each pass
+    since the last clear.
+    """
+    def __init__(self, level=0):
+        if level not in OPTIMIZATION_LEVELS:
+            raise ValueError("No optimization level {}".format(level))
+        self.level = level
+        self.passes = []  # (name, stage, function)
+        self.seconds = {}
+        self.counts = {}
+
+    def clear(self):
+        self.seconds = {}
+        self.counts = {}
+        for _, _, function in self.passes:
+            if hasattr(function, "clear"):
+                function.clear()
+
+    def register(self, name, function, level=1, stage="ir"):
+        """
+        Adds a pass after the ones registered before, if it belongs to the level.
+        :param name: name of the pass in the statistics
+        :param function: pass, called with the unit
+        :param level: lowest optimization level running the pass
+        :param stage: "ast" or "ir"
+        :return:
+        """
+        if level <= self.level:
+            self.passes.append((name, stage, function))
+
+    def run(self, stage, unit):
+        for name, pass_stage, function in self.passes:
+            if pass_stage != stage:
+                continue
+            start = time.perf_counter()
+            counts = function(unit)
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            if counts:
+                total = self.counts.setdefault(name, {})
+                for counter, value in counts.items():
+                    total[counter] = total.get(counter, 0) + value
+
+
+# IR PASSES
+
+def remove_unreachable_blocks(code):
+    """
+    Removes blocks which no path from the first block reaches.
+    :param code: IRCode
+    :return:
+    """
+    successors = code.successors()
+    reachable = [False] * len(code.blocks)
+    reachable[0] = True
+    stack = [0]
+    while stack:
+        for following in successors[stack.pop()]:
+            if not reachable[following]:
+                reachable[following] = True
+                stack.append(following)
+    if all(reachable):
+        return None
+    blocks = []
+    removed = 0
+    for block, is_reachable in zip(code.blocks, reachable):
+        if is_reachable:
+            blocks.append(block)
+        else:
+            removed += len(block.code)
+            if block.label is not None:
+                del code.label_blocks[block.label]
+    code.blocks[:] = blocks
+    code.current = blocks[-1]
+    return {"instructions": removed}
+
+
+def default_passes(level, variables):
+    """
+    :param level: optimization level
+    :param variables: VariableManager of the compiler, for the temporaries of the passes
+    :return: PassManager with the passes of the level in their order
+    """
+    manager = PassManager(level)
+    manager.register("constant-folding", ConstantFolder(), level=1, stage="ast")
+    manager.register("cse", CommonSubexpressions(variables), level=2, stage="ast")
+    manager.register("loop-invariants", LoopInvariants(variables), level=2, stage="ast")
+    manager.register("division-fusion", DivisionFusion(variables), level=2, stage="ast")
+    manager.register("peephole", Peephole(), level=1)
+    manager.register("unreachable-blocks", remove_unreachable_blocks, level=1)
+    return manager
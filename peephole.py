@@ -0,0 +1,278 @@
+"""
+Peephole optimization of the IR, a pass of the "ir" stage. Inside a basic block the values of the
+registers and of the memory cells at known addresses are followed symbolically: a number, or a
+value without a number which two registers hold both after a copy or after loads of one cell.
+Instructions which don't change anything are removed by the rules:
+    redundant-reset     RESET of a register holding 0
+    redundant-copy      RESET x, ADD x y of a register x holding the value of y already
+    redundant-const     CONST of a register holding the number
+    const-reuse         CONST n of a register holding n - 1 or n + 1 becomes INC or DEC, of
+                        another register holding n a copy, when it's cheaper
+    load-after-store    LOAD of a value the register holds, e.g. after STORE of it to the cell
+    redundant-store     STORE of the value the cell holds
+    no-effect           ADD or SUB of 0, shifts of 0
+Jumps are rewritten by:
+    jump-chain          a jump to a JUMP (or to empty blocks before one) goes to its label
+    jump-to-next        a jump to the next block is removed
+Counters of the rules: instructions of the lowered code each rule removed, jumps retargeted by
+jump-chain.
+"""
+from array import array
+
+from ir import CONST, const_cost
+from machine_instructions import (COSTS, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL, GET,
+                                  JUMP, JODD, X_SHIFT, Y_SHIFT, OPERAND_SHIFT)
+from folding import WORD_LIMIT
+
+PEEPHOLE_RULES = ("redundant-reset", "redundant-copy", "redundant-const", "const-reuse",
+                  "load-after-store", "redundant-store", "no-effect", "jump-chain", "jump-to-next")
+OPERAND_MASK = (1 << OPERAND_SHIFT) - 1
+COPY_COST = COSTS[RESET] + COSTS[ADD]
+
+
+class Peephole(object):
+    """
+    The pass, with the rules of PEEPHOLE_RULES given in rules.
+    """
+    def __init__(self, rules=PEEPHOLE_RULES):
+        for rule in rules:
+            if rule not in PEEPHOLE_RULES:
+                raise ValueError("No peephole rule {}".format(rule))
+        self.rules = frozenset(rules)
+        self.counts = {}
+        self.symbols = 0
+        # values at the end of the last unit, its code goes on in the first block of the next one
+        self.exit = None
+
+    def clear(self):
+        self.exit = None
+
+    def __call__(self, code):
+        """
+        :param code: IRCode
+        :return: dict of counters
+        """
+        self.counts = dict((rule, 0) for rule in PEEPHOLE_RULES if rule in self.rules)
+        entry = self.exit
+        for block in code.blocks:
+            entry = self.block(code, block, entry if block.label is None else None)
+        self.exit = entry
+        if "jump-chain" in self.rules or "jump-to-next" in self.rules:
+            self.jumps(code)
+        return self.counts
+
+    def fresh(self):
+        """
+        :return: new value without a number, numbers are not negative
+        """
+        self.symbols -= 1
+        return self.symbols
+
+    def removed(self, rule, instructions=1):
+        self.counts[rule] += instructions
+
+    def block(self, code, block, entry=None):
+        """
+        :param code: IRCode
+        :param block: Block
+        :param entry: values of the registers and the memory the block starts with, None if
+                      nothing is known
+        :return: the values at the end of the block
+        """
+        rules = self.rules
+        redundant_const, const_reuse = "redundant-const" in rules, "const-reuse" in rules
+        redundant_copy, redundant_reset = "redundant-copy" in rules, "redundant-reset" in rules
+        load_after_store, redundant_store = "load-after-store" in rules, "redundant-store" in rules
+        no_effect = "no-effect" in rules
+        fresh = self.fresh
+        if entry is None:
+            values = [fresh() for _ in range(7)]  # by register x field, 1-6
+            memory = {}  # address -> value
+        else:
+            values, memory = entry
+        old_code, marks = block.code, block.lines
+        new_code = array('q')
+        new_lines = array('q')
+        append = new_code.append
+        m = 0
+        changed = False
+        i = 0
+        end = len(old_code)
+        while i < end:
+            while m < len(marks) and marks[m] <= i:
+                if new_lines and new_lines[-2] == len(new_code):
+                    new_lines[-1] = marks[m + 1]
+                else:
+                    new_lines.extend((len(new_code), marks[m + 1]))
+                m += 2
+            instruction = old_code[i]
+            i += 1
+            opcode = instruction & 15
+            x = instruction >> X_SHIFT & 7
+            y = instruction >> Y_SHIFT & 7
+            if opcode == CONST:
+                number = code.const_value(instruction)
+                if values[x] == number and redundant_const:
+                    self.removed("redundant-const", const_cost(number))
+                    changed = True
+                    continue
+                if const_reuse and number < WORD_LIMIT:
+                    reuse = self.reuse(values, x, number, instruction)
+                    if reuse is not None:
+                        self.removed("const-reuse", const_cost(number) - len(reuse))
+                        new_code.extend(reuse)
+                        values[x] = number
+                        changed = True
+                        continue
+                values[x] = number if number < WORD_LIMIT else fresh()
+            elif opcode == RESET:
+                following = old_code[i] if i < end else None
+                if following is not None and following & 15 == ADD \
+                        and following >> X_SHIFT & 7 == x and redundant_copy:
+                    source = following >> Y_SHIFT & 7
+                    if source != x and values[x] == values[source]:
+                        self.removed("redundant-copy", 2)
+                        changed = True
+                        i += 1
+                        continue
+                if values[x] == 0 and redundant_reset:
+                    self.removed("redundant-reset")
+                    changed = True
+                    continue
+                values[x] = 0
+            elif opcode == ADD or opcode == SUB:
+                left, right = values[x], values[y]
+                if right == 0 and no_effect:
+                    self.removed("no-effect")
+                    changed = True
+                    continue
+                if opcode == ADD and left == 0:
+                    values[x] = right
+                elif opcode == SUB and left == right:
+                    values[x] = 0
+                elif left >= 0 and right >= 0:
+                    result = left + right if opcode == ADD else max(left - right, 0)
+                    values[x] = result if result < WORD_LIMIT else fresh()
+                else:
+                    values[x] = fresh()
+            elif INC <= opcode <= SHL:
+                value = values[x]
+                if value == 0 and opcode in (SHR, SHL, DEC) and no_effect:
+                    self.removed("no-effect")
+                    changed = True
+                    continue
+                if value >= 0:
+                    value = (value + 1, max(value - 1, 0), value >> 1, value << 1)[opcode - INC]
+                    values[x] = value if value < WORD_LIMIT else fresh()
+                else:
+                    values[x] = fresh()
+            elif opcode == LOAD:
+                address = values[y]
+                value = memory.get(address) if address >= 0 else None
+                if value is not None and values[x] == value and load_after_store:
+                    self.removed("load-after-store")
+                    changed = True
+                    continue
+                if value is None:
+                    value = fresh()
+                    if address >= 0:
+                        memory[address] = value
+                values[x] = value
+            elif opcode == STORE:
+                address = values[y]
+                if address >= 0:
+                    if memory.get(address) == values[x] and redundant_store:
+                        self.removed("redundant-store")
+                        changed = True
+                        continue
+                    memory[address] = values[x]
+                else:
+                    memory.clear()
+            elif opcode == GET:
+                address = values[x]
+                if address >= 0:
+                    memory[address] = fresh()
+                else:
+                    memory.clear()
+            append(instruction)
+        while m < len(marks):
+            if new_lines and new_lines[-2] == len(new_code):
+                new_lines[-1] = marks[m + 1]
+            else:
+                new_lines.extend((len(new_code), marks[m + 1]))
+            m += 2
+        if changed:
+            block.set_code(new_code, new_lines)
+        return values, memory
+
+    @staticmethod
+    def reuse(values, x, number, instruction):
+        """
+        :return: instructions setting register x to the number from a register holding a close
+                 value, or None if it isn't cheaper than the CONST
+        """
+        register = instruction & 7 << X_SHIFT
+        if values[x] == number - 1 and number:
+            return (INC | register,)
+        if values[x] == number + 1:
+            return (DEC | register,)
+        if const_cost(number) > COPY_COST:
+            for source in range(1, 7):
+                if source != x and values[source] == number:
+                    return RESET | register, ADD | register | source << Y_SHIFT
+        return None
+
+    def jumps(self, code):
+        blocks = code.blocks
+        position = dict((id(block), i) for i, block in enumerate(blocks))
+        label_blocks = code.label_blocks
+        for i, block in enumerate(blocks):
+            if not block.code:
+                continue
+            instruction = block.code[-1]
+            opcode = instruction & 15
+            if not JUMP <= opcode <= JODD:
+                continue
+            label = instruction >> OPERAND_SHIFT
+            if "jump-chain" in self.rules:
+                target = self.chain(code, position, label)
+                if target != label:
+                    instruction = instruction & OPERAND_MASK | target << OPERAND_SHIFT
+                    block.code[-1] = instruction
+                    label = target
+                    self.counts["jump-chain"] += 1
+            if "jump-to-next" in self.rules:
+                following = i + 1
+                target = position[id(label_blocks[label])]
+                while following < target and not blocks[following].code:
+                    following += 1
+                if following == target:
+                    length = len(block.code) - 1
+                    lines = array('q', block.lines)
+                    for m in range(0, len(lines), 2):
+                        lines[m] = min(lines[m], length)
+                    block.set_code(block.code[:length], lines)
+                    self.removed("jump-to-next")
+
+    @staticmethod
+    def chain(code, position, label):
+        """
+        :return: label where a jump to label gets to through JUMPs and empty blocks
+        """
+        blocks = code.blocks
+        seen = set()
+        while label not in seen:
+            seen.add(label)
+            index = position[id(code.label_blocks[label])]
+            while index < len(blocks) and not blocks[index].code:
+                index += 1
+                if index < len(blocks) and blocks[index].label is not None:
+                    label = blocks[index].label
+                    seen.add(label)
+            if index == len(blocks):
+                break
+            block_code = blocks[index].code
+            if len(block_code) != 1 or block_code[0] & 15 != JUMP:
+                break
+            label = block_code[0] >> OPERAND_SHIFT
+        return label
@@ -15,6 +15,10 @@ class RegisterManager(object):
     def __init__(self):
         self.registers = {x: Register(x) for x in reg_names}
 
+    def clear(self):
+        for name in self.registers:
+            self.free_reg(name)
+
     def __getitem__(self, register):
         return self.registers[register]
 
@@ -0,0 +1,303 @@
+import sys
+
+from ast_nodes import (NUM, INT, TAB, ASSIGN, IF, IF_ELSE, WHILE, REPEAT, FOR_TO, FOR_DT, READ,
+                       WRITE, ARITHMETIC, walk)
+
+ARITHMETIC_KINDS = frozenset(ARITHMETIC.values())
+
+
+class SemanticAnalyzer(object):
+    """
+    Checks commands before the code generation: declarations, types, bounds and initialization.
+    Identifiers and table elements get their Int or Tab object in node.var, FOR loops their
+    iterator, bound and the iterator address used after the body, so Compiler generates code
+    without any lookups or checks. Everything is visited in the order of code generation, with
+    the same messages, and iterators are declared and deleted at the same moments, so they get
+    the same cells as before.
+    """
+    def __init__(self, variables):
+        """
+        :param variables: VariableManager with the declared variables
+        """
+        self.Variables = variables
+        self.error = False
+        self.operation = {
+            ASSIGN: self.assign,
+            WRITE: self.write,
+            READ: self.read,
+            IF: self.if_endif,
+            IF_ELSE: self.if_else_endif,
+            WHILE: self.while_loop,
+            REPEAT: self.repeat_until_loop,
+            FOR_TO: self.for_to_loop,
+            FOR_DT: self.for_downto_loop,
+        }
+
+    def clear(self):
+        self.error = False
+
+    def analyze(self, commands):
+        """
+        :param commands: list of AST nodes with commands
+        :return: True if no error was found
+        """
+        walk(commands, self.operation)
+        return not self.error
+
+    # COMMANDS
+
+    def assign(self, ast_node):
+        lvalue = ast_node.lvalue
+        if not self.check_lvalue(lvalue) or not self.check_rvalue(ast_node.rvalue):
+            return
+        self.initialize(lvalue)
+
+    def read(self, ast_node):
+        lvalue = ast_node.lvalue
+        if not self.check_lvalue(lvalue):
+            return
+        self.initialize(lvalue)
+
+    def write(self, ast_node):
+        self.check_rvalue(ast_node.value)
+
+    def initialize(self, lvalue):
+        if lvalue.kind == INT:
+            lvalue.var.is_initialized = True
+        elif lvalue.kind == TAB:
+            index = lvalue.index_value
+            if self.check_rvalue(index) and index.kind == NUM:
+                lvalue.var.initialize_element(index.value)
+
+    def check_condition(self, ast_condition):
+        return self.check_rvalue(ast_condition.left) and self.check_rvalue(ast_condition.right)
+
+    def if_endif(self, ast_node):
+        if self.check_condition(ast_node.condition):
+            yield ast_node.commands
+
+    def if_else_endif(self, ast_node):
+        if self.check_condition(ast_node.condition):
+            yield ast_node.commands
+            yield ast_node.else_commands
+
+    def while_loop(self, ast_node):
+        if self.check_condition(ast_node.condition):
+            yield ast_node.commands
+
+    def repeat_until_loop(self, ast_node):
+        # the condition is checked before the body, its values may be set only inside
+        if self.check_condition(ast_node.condition):
+            yield ast_node.commands
+
+    def for_to_loop(self, ast_node):
+        return self.for_loop(ast_node, ast_node.iterator + "TO")
+
+    def for_downto_loop(self, ast_node):
+        return self.for_loop(ast_node, ast_node.iterator + "DOWNTO")
+
+    def for_loop(self, ast_node, bound_name):
+        ast_node.bound_var = self.declare_iterator(bound_name, ast_node.stop, ast_node.lineno)
+        ast_node.iterator_var = self.declare_iterator(ast_node.iterator, ast_node.start,
+                                                      ast_node.lineno)
+        yield ast_node.commands
+        ast_node.step_address = self.Variables.get_iterator_address(ast_node.iterator)
+        self.Variables.delete_iterator(ast_node.iterator)
+        self.Variables.delete_iterator(bound_name)
+
+    # ITERATORS
+
+    def declare_iterator(self, name, ast_init_rvalue, line):
+        """
+        Creates new int iterator variable with given name. The init value is checked before the
+        iterator exists, but taken after, so FOR i FROM i... starts from the iterator itself.
+        :param name: Name of given iterator
+        :param ast_init_rvalue: AST node with initial value info for iterator
+        :param line: line number
+        :return: Int of the iterator
+        """
+        self.check_rvalue(ast_init_rvalue)
+        self.Variables.new_iterator(name, line)
+        iterator = self.Variables[name]
+        if not iterator.is_iterator:
+            raise Exception("NOT AN ITERATOR")
+        self.resolve_value(ast_init_rvalue)
+        return iterator
+
+    def resolve_value(self, ast_node):
+        """
+        Looks the value up again, for iterator bounds, which are used even if they are invalid.
+        :param ast_node: Num, Identifier or TabElement
+        :return:
+        """
+        if ast_node.kind == INT:
+            try:
+                ast_node.var = self.Variables[ast_node.name]
+            except KeyError:
+                self.error = True
+                print("Error! line {}\n"
+                      "Variable '{}' was not declared\n"
+                      .format(ast_node.lineno, ast_node.name), file=sys.stderr)
+        elif ast_node.kind == TAB:
+            index = ast_node.index_value
+            try:
+                ast_node.var = self.Variables[ast_node.name]
+                if index.kind == INT:
+                    index.var = self.Variables[index.name]
+            except KeyError:
+                self.error = True
+                print("Error! line {}\n"
+                      "Variable '{}' was not declared\n"
+                      .format(ast_node.lineno, ast_node.name), file=sys.stderr)
+
+    # CHECKS
+
+    def check_lvalue(self, var_info):
+        """
+        Checks if a thing described in ast var_info can be a variable, which can be updated.
+        :param var_info:
+        :return:
+        """
+        var_type = var_info.kind
+        var_name = var_info.name
+        line = var_info.lineno
+
+        try:
+            lvalue = self.Variables[var_name]
+        except KeyError:
+            self.error = True
+            print("Error! line {}\n"
+                  "Variable '{}' was not declared\n"
+                  .format(line, var_name), file=sys.stderr)
+            return False
+        var_info.var = lvalue
+
+        if var_type == TAB:
+            # unpack the rest
+            index = var_info.index_value
+            index_type = index.kind
+
+            if lvalue.type == "int":
+                self.error = True
+                print("Error! line {}\n"
+                      "Type of '{}' is 'int'."
+                      "Can't refer to an element od int.\n"
+                      .format(line, var_name), file=sys.stderr)
+                return False
+
+            if index_type == NUM:
+                num = index.value
+                if not self.Variables.check_if_in_bounds(var_name, num, line):
+                    return False
+            elif index_type == INT:
+                lvalue.initialize_all()
+                int_name = index.name
+                try:
+                    int_var = self.Variables[int_name]
+                except KeyError:
+                    self.error = True
+                    print("Error! line {}\n"
+                          "Variable '{}' was not declared\n"
+                          .format(line, int_name), file=sys.stderr)
+                    return False
+                index.var = int_var
+                if not int_var.is_initialized:
+                    self.error = True
+                    print("Error! line {}\n"
+                          "Variable '{}' was not initialized\n"
+                          .format(line, int_name), file=sys.stderr)
+                    return False
+
+        elif var_type == INT:
+            if lvalue.type == "tab":
+                self.error = True
+                print("Error! line {}\n"
+                      "Type of '{}' is 'tab'."
+                      " One can only refer to a single element of a table using tab(n).\n"
+                      .format(line, var_name), file=sys.stderr)
+                return False
+            elif lvalue.is_iterator:
+                self.error = True
+                print("Error! line {}\n"
+                      "{} is an iterator. "
+                      "Cannot change iterator value inside a loop\n"
+                      .format(line, var_name), file=sys.stderr)
+        else:
+            return False
+
+        return True
+
+    def check_rvalue(self, ast_node):
+        """
+        Checks if a thing described in ast_node is a existing valid value.
+        :param ast_node:
+        :return:
+        """
+        node_type = ast_node.kind
+        line = ast_node.lineno
+        if node_type == NUM:
+            return True
+        elif node_type in ARITHMETIC_KINDS:
+            left_op, right_op = ast_node.left, ast_node.right
+            return self.check_rvalue(left_op) and self.check_rvalue(right_op)
+        elif node_type in (TAB, INT):
+            var_type = node_type
+            var_name = ast_node.name
+
+            try:
+                var = self.Variables[var_name]
+            except KeyError:
+                self.error = True
+                print("Error! line {}\n"
+                      "Variable '{}' was not declared\n"
+                      .format(line, var_name), file=sys.stderr)
+                return False
+            ast_node.var = var
+
+            if var_type == TAB:
+                index = ast_node.index_value
+                index_type = index.kind
+
+                if index_type == NUM:
+                    num = index.value
+                    if not self.Variables.check_if_in_bounds(var_name, num, line):
+                        return False
+                    if not self.Variables[var_name].is_initialized(num):
+                        self.error = True
+                        print("Error! line {}\n"
+                              "{} element of tab {} is not initialized\n"
+                              .format(line, num, var_name), file=sys.stderr)
+                        return False
+
+                elif index_type == INT:
+                    int_name = index.name
+                    try:
+                        int_var = self.Variables[int_name]
+                    except KeyError:
+                        self.error = True
+                        print("Error! line {}\n"
+                              "Variable '{}' was not declared\n"
+                              .format(line, int_name), file=sys.stderr)
+                        return False
+                    index.var = int_var
+                    if not int_var.is_initialized:
+                        self.error = True
+                        print("Error! line {}\n"
+                              "Variable '{}' was not initialized\n"
+                              .format(line, int_name), file=sys.stderr)
+                        return False
+            elif var_type == INT:
+                if var.type == "tab":
+                    self.error = True
+                    print("Error! line {}\n"
+                          "Type of '{}' is 'tab'."
+                          " One can only refer to a single element of a table using tab(n).\n"
+                          .format(line, var_name), file=sys.stderr)
+                    return False
+                elif not var.is_initialized:
+                    self.error = True
+                    print("Error! line {}\n"
+                          "Variable '{}' was not initialized\n"
+                          .format(line, var_name), file=sys.stderr)
+                    return False
+        return True
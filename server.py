@@ -0,0 +1,68 @@
+"""
+Compile server. Keeps sly, the parser tables and the compiler imported and compiles sources sent
+over a unix socket. The sessions of all optimization levels are created before serving, so every
+request is served by a forked process which inherits the ready lexer, parser and compiler.
+Concurrent clients do not share any parser or compiler state and each compilation starts with
+fresh VariableManager, MemoryManager and MachineInstructions.
+Usage: python server.py [socket_path]
+"""
+import os
+import signal
+import socketserver
+import sys
+
+from kompilator import compile_source, get_session
+from passes import OPTIMIZATION_LEVELS
+from socket_protocol import DEFAULT_SOCKET, send_message, recv_message
+
+
+def compile_text(text, optimization=0):
+    """
+    Compiles source text in memory.
+    :param text: source code
+    :param optimization: optimization level, one of passes.OPTIMIZATION_LEVELS
+    :return: dict with machine code ("code", None when compilation failed) and everything the
+             compiler printed ("stdout", "stderr")
+    """
+    if optimization not in OPTIMIZATION_LEVELS:
+        return {"code": None, "stdout": "",
+                "stderr": "No optimization level {}\n".format(optimization)}
+    result = compile_source(text, optimization=optimization)
+    return {"code": result.code, "stdout": result.stdout, "stderr": result.stderr}
+
+
+class CompileRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            request = recv_message(self.request)
+        except (ConnectionError, ValueError):
+            return
+        send_message(self.request, compile_text(request["source"],
+                                                request.get("optimization", 0)))
+
+
+class CompileServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def server_bind(self):
+        # a socket file left by a killed server would make bind fail
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+if __name__ == '__main__':
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOCKET
+    # leave through the with block on kill too, so the socket file gets removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # created in the children they would be lost with each of them
+    for level in OPTIMIZATION_LEVELS:
+        get_session(level)
+    with CompileServer(socket_path, CompileRequestHandler) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
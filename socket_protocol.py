@@ -0,0 +1,31 @@
+"""
+Framing used between server.py and client.py: every message is a 4 byte big-endian length
+followed by that many bytes of utf-8 encoded json.
+"""
+import json
+import os
+import struct
+
+DEFAULT_SOCKET = os.environ.get("KOMPILATOR_SOCKET", "/tmp/kompilator.sock")
+HEADER = struct.Struct("!I")
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise ConnectionError("connection closed in the middle of a message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    size, = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return json.loads(_recv_exactly(sock, size))
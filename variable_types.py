@@ -55,6 +55,12 @@ class VariableManager(object):
         self.Memory = MemoryManager()
         self.error = False
 
+    def clear(self):
+        self.variables.clear()
+        self.shadowed.clear()
+        self.Memory.clear()
+        self.error = False
+
     def __getitem__(self, var_name):
         return self.variables[var_name]
 
@@ -83,6 +89,19 @@ class VariableManager(object):
             else:
                 raise ValueError("No variable type ", _type)
 
+    def new_temporary(self, line):
+        """
+        Int without a name, for a value kept by an optimization pass. Passes run after the
+        semantic analysis, which has freed the cells of the iterators already, so the cell is
+        after all of them.
+        :param line: line of the code computing the value
+        :return: Int with its own cell
+        """
+        address = self.Memory.allocate(1, first_cell=self.Memory.iterators_end)
+        temporary = Int(lineno=line, address=address)
+        temporary.is_initialized = True
+        return temporary
+
     def new_iterator(self, name, line):
         if name in self.variables.keys():
             self.shadowed[name] = self.variables[name]